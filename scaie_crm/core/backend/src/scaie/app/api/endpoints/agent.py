@@ -3,6 +3,8 @@ from sqlalchemy.orm import Session
 from typing import List, Dict, Any
 
 from ...core.database import get_db
+from ...core.metrics import metrics
+from ...services.llm_service import llm_service
 from ...models.contact import Contact, InterestLevel
 from ...models.conversation import Conversation, Message
 
@@ -41,4 +43,23 @@ async def get_agent_stats(db: Session = Depends(get_db)) -> Dict[str, Any]:
             "user": user_messages,
             "agent": agent_messages
         }
-    }
\ No newline at end of file
+    }
+
+
+@router.get("/metrics")
+async def get_pipeline_metrics() -> Dict[str, Any]:
+    """
+    Latency per stage of the message pipeline (retrieval, queue wait, prompt, LLM...),
+    counters, response cache hit rate, LLM concurrency limit and queue depth, circuit
+    breaker state, model routing decisions, and the estimated size of the system
+    prompt per interest level.
+    """
+    snapshot = metrics.snapshot()
+    snapshot["response_cache"] = llm_service.response_cache.stats()
+    snapshot["llm_limiter"] = llm_service.limiter.stats()
+    snapshot["llm_circuit"] = llm_service.circuit_breaker.stats()
+    snapshot["llm_router"] = llm_service.router.stats()
+    snapshot["system_prompt_tokens"] = {
+        level.value: llm_service.system_prompt(level.value)[1] for level in InterestLevel
+    }
+    return snapshot
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from ...core.database import get_db
+from ..sse import sse_response
 from ...services.omnipotent_agent import omnipotent_agent
 from ...services.llm_service import llm_service
 from ...models.conversation import Message, Conversation
@@ -12,6 +13,15 @@ from ...schemas.contact import ContactCreate, ContactUpdate
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+def _web_contact_info(request: ChatRequest) -> Dict[str, Any]:
+    return {
+        "name": request.contact_info.name if request.contact_info else "Usuario Web",
+        "phone": request.contact_info.phone if request.contact_info else None,
+        "email": request.contact_info.email if request.contact_info else None,
+        "company": request.contact_info.company if request.contact_info else None,
+        "platform_user_id": None  # Not applicable for web chat
+    }
+
 @router.post("/", response_model=ChatResponse)
 async def chat_with_agent(request: ChatRequest, db: Session = Depends(get_db)):
     """
@@ -26,13 +36,7 @@ async def chat_with_agent(request: ChatRequest, db: Session = Depends(get_db)):
         response_data = await omnipotent_agent.process_incoming_message(
             message=request.message.strip(),
             platform="web",  # Default platform for web chat
-            contact_info={
-                "name": request.contact_info.name if request.contact_info else "Usuario Web",
-                "phone": request.contact_info.phone if request.contact_info else None,
-                "email": request.contact_info.email if request.contact_info else None,
-                "company": request.contact_info.company if request.contact_info else None,
-                "platform_user_id": None  # Not applicable for web chat
-            }
+            contact_info=_web_contact_info(request)
         )
         
         return ChatResponse(
@@ -48,6 +52,24 @@ async def chat_with_agent(request: ChatRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 
+@router.post("/stream")
+async def chat_with_agent_stream(request: ChatRequest):
+    """
+    Same as POST /chat/ but streamed as Server-Sent Events: `delta` events
+    with the reply text as it is generated, then one `done` event with
+    response, contact_id, message_id and timings (the message is saved
+    before it is sent).
+    """
+    if not request.message or not request.message.strip():
+        raise HTTPException(status_code=400, detail="El mensaje no puede estar vacío")
+    
+    return sse_response(omnipotent_agent.process_incoming_message_stream(
+        message=request.message.strip(),
+        platform="web",
+        contact_info=_web_contact_info(request)
+    ))
+
+
 @router.post("/sandbox", response_model=SandboxResponse)
 async def sandbox_endpoint(request: SandboxRequest):
     """
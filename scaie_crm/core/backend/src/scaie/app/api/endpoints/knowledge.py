@@ -7,6 +7,7 @@ import io
 import json
 
 from ...core.database import get_db
+from ...core.tokens import estimate_tokens
 from ...services.rag_service import rag_service
 
 # Create logger
@@ -30,6 +31,7 @@ class KnowledgeSearch(BaseModel):
     query: str
     top_k: int = 5
     category: Optional[str] = None
+    mode: Optional[str] = None  # semantic | lexical | hybrid
 
 @router.post("/add")
 async def add_knowledge(knowledge: KnowledgeCreate):
@@ -37,7 +39,7 @@ async def add_knowledge(knowledge: KnowledgeCreate):
     Agregar nueva entrada de conocimiento a la base de datos RAG.
     """
     try:
-        knowledge_id = rag_service.add_knowledge(
+        knowledge_id, _ = await rag_service.aadd_knowledge(
             title=knowledge.title,
             content=knowledge.content,
             category=knowledge.category,
@@ -53,6 +55,32 @@ async def add_knowledge(knowledge: KnowledgeCreate):
         logger.error(f"Error agregando conocimiento: {str(e)}")
         raise HTTPException(status_code=500, detail="Error agregando conocimiento")
 
+@router.post("/add-batch")
+async def add_knowledge_batch(knowledge_items: List[KnowledgeCreate]):
+    """
+    Agregar varias entradas de conocimiento generando sus embeddings en lote.
+    """
+    try:
+        knowledge_ids, ingest_stats = await rag_service.aadd_knowledge_batch([
+            {
+                "title": item.title,
+                "content": item.content,
+                "category": item.category,
+                "metadata": item.metadata or {}
+            }
+            for item in knowledge_items
+        ])
+        
+        return {
+            "message": "Conocimiento agregado exitosamente",
+            "knowledge_ids": knowledge_ids,
+            "ingest_stats": ingest_stats
+        }
+        
+    except Exception as e:
+        logger.error(f"Error agregando conocimiento en lote: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error agregando conocimiento")
+
 @router.get("/list")
 async def list_knowledge(category: Optional[str] = None):
     """
@@ -82,13 +110,14 @@ async def get_categories():
 @router.post("/search")
 async def search_knowledge(search_request: KnowledgeSearch):
     """
-    Buscar conocimiento relevante usando búsqueda semántica.
+    Buscar conocimiento relevante (semántica, léxica BM25 o híbrida).
     """
     try:
-        results = rag_service.search_knowledge(
+        results = await rag_service.asearch_knowledge(
             query=search_request.query,
             top_k=search_request.top_k,
-            category=search_request.category
+            category=search_request.category,
+            mode=search_request.mode
         )
         
         return {"results": results}
@@ -98,20 +127,22 @@ async def search_knowledge(search_request: KnowledgeSearch):
         raise HTTPException(status_code=500, detail="Error buscando conocimiento")
 
 @router.get("/context/{query}")
-async def get_context(query: str, max_length: int = 1000):
+async def get_context(query: str, max_length: Optional[int] = None, max_tokens: Optional[int] = None):
     """
-    Obtener contexto relevante formateado para el LLM.
+    Obtener contexto relevante formateado para el LLM (presupuesto en tokens, y opcionalmente en caracteres).
     """
     try:
-        context = rag_service.get_relevant_context(
+        context = await rag_service.aget_relevant_context(
             query=query,
-            max_context_length=max_length
+            max_context_length=max_length,
+            max_tokens=max_tokens
         )
         
         return {
             "query": query,
             "context": context,
-            "context_length": len(context)
+            "context_length": len(context),
+            "context_tokens": estimate_tokens(context)
         }
         
     except Exception as e:
@@ -124,7 +155,7 @@ async def update_knowledge(knowledge_id: str, update_data: KnowledgeUpdate):
     Actualizar entrada de conocimiento existente.
     """
     try:
-        success = rag_service.update_knowledge(
+        success = await rag_service.aupdate_knowledge(
             knowledge_id=knowledge_id,
             content=update_data.content,
             title=update_data.title,
@@ -148,7 +179,7 @@ async def delete_knowledge(knowledge_id: str):
     Eliminar entrada de conocimiento.
     """
     try:
-        success = rag_service.delete_knowledge(knowledge_id)
+        success = await rag_service.adelete_knowledge(knowledge_id)
         
         if not success:
             raise HTTPException(status_code=404, detail="Conocimiento no encontrado")
@@ -194,7 +225,7 @@ async def upload_document(
             content_text = content.decode('utf-8')
         
         # Agregar a la base de conocimiento
-        knowledge_id = rag_service.add_knowledge(
+        knowledge_id, ingest_stats = await rag_service.aadd_knowledge(
             title=title,
             content=content_text,
             category=category,
@@ -208,7 +239,8 @@ async def upload_document(
         return {
             "message": "Documento subido y procesado exitosamente",
             "knowledge_id": knowledge_id,
-            "filename": file.filename
+            "filename": file.filename,
+            "ingest_stats": ingest_stats
         }
         
     except HTTPException:
@@ -223,7 +255,7 @@ async def initialize_default_knowledge():
     Inicializar la base de conocimiento con datos por defecto.
     """
     try:
-        rag_service.initialize_default_knowledge()
+        await rag_service.ainitialize_default_knowledge()
         
         return {
             "message": "Base de conocimiento inicializada con datos por defecto",
@@ -262,7 +294,11 @@ async def get_knowledge_stats():
             "total_content_length": total_content_length,
             "categories": len(categories),
             "category_stats": category_stats,
-            "embeddings_cached": len(rag_service.embeddings_cache)
+            "embeddings_cached": len(rag_service.embeddings_cache),
+            "last_ingest": rag_service.last_ingest_stats,
+            "query_cache": rag_service.query_cache.stats(),
+            "index": rag_service.index_stats(),
+            "context_cache": rag_service.context_assembler.stats()
         }
         
     except Exception as e:
@@ -5,6 +5,7 @@ from pydantic import BaseModel
 import logging
 
 from ...core.database import get_db
+from ..sse import sse_response
 from ...services.omnipotent_agent import omnipotent_agent
 from ...models.contact import Contact
 from ...models.conversation import Conversation
@@ -106,6 +107,22 @@ async def process_message_endpoint(
             detail="Error al procesar el mensaje. Por favor, inténtalo de nuevo más tarde."
         )
 
+@router.post("/process-message/stream")
+async def process_message_stream_endpoint(request: MessageRequest):
+    """
+    Streaming (Server-Sent Events) variant of /process-message: `delta`
+    events with the reply text, then a `done` event with response,
+    contact_id, message_id and timings once the message is saved.
+    
+    The agent opens its own database session, since the stream outlives
+    the request's dependencies.
+    """
+    return sse_response(omnipotent_agent.process_incoming_message_stream(
+        message=request.message,
+        platform=request.contact.platform if request.contact else "web",
+        contact_info=request.contact.dict() if request.contact else {}
+    ))
+
 @router.post("/execute-pending-actions/{conversation_id}")
 async def execute_pending_actions(
     conversation_id: int,
@@ -0,0 +1,31 @@
+import json
+import logging
+from typing import Any, AsyncIterator, Dict
+
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+
+async def _encode(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    try:
+        async for event in events:
+            data = {key: value for key, value in event.items() if key != "type"}
+            yield f"event: {event['type']}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    except Exception as e:
+        # Headers are already sent, so errors are reported as an event
+        logger.error(f"Error while streaming response: {str(e)}", exc_info=True)
+        detail = "Error al procesar el mensaje. Por favor, inténtalo de nuevo más tarde."
+        yield f"event: error\ndata: {json.dumps({'detail': detail}, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    """
+    Server-Sent Events response for {"type": ..., ...} events: the type is
+    the SSE event name and the remaining keys its JSON data.
+    """
+    return StreamingResponse(
+        _encode(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,62 @@
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List
+
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    """q-th percentile (0-100) of sorted samples, interpolated like numpy.percentile."""
+    position = (len(sorted_samples) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(sorted_samples) - 1)
+    return sorted_samples[low] + (sorted_samples[high] - sorted_samples[low]) * (position - low)
+
+
+class Metrics:
+    """
+    In-process counters and rolling latency samples.
+
+    Each timing keeps its last ``window`` samples, so the snapshot shows
+    recent behaviour rather than an all-time average. Nothing is persisted
+    and every worker process has its own numbers.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._timings: Dict[str, Deque[float]] = {}
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, ms: float):
+        """Record one latency sample in milliseconds."""
+        with self._lock:
+            samples = self._timings.get(name)
+            if samples is None:
+                samples = self._timings[name] = deque(maxlen=self.window)
+            samples.append(ms)
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters plus count/avg/p50/p95/max per timing."""
+        with self._lock:
+            timings = {name: sorted(samples) for name, samples in self._timings.items() if samples}
+            counters = dict(self._counters)
+        return {
+            "counters": counters,
+            "timings_ms": {
+                name: {
+                    "count": len(samples),
+                    "avg": round(sum(samples) / len(samples), 2),
+                    "p50": round(percentile(samples, 50), 2),
+                    "p95": round(percentile(samples, 95), 2),
+                    "max": round(samples[-1], 2)
+                }
+                for name, samples in timings.items()
+            }
+        }
+
+
+# Shared by the message pipeline (LLM service, agent, endpoints)
+metrics = Metrics()
@@ -0,0 +1,15 @@
+import re
+
+# Words and individual punctuation marks
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate sub-word token count of text without loading a tokenizer.
+
+    Short words and punctuation count as one token; longer words add one
+    token per ~4 extra characters, which is close to what WordPiece/BPE
+    tokenizers produce for Spanish and English text.
+    """
+    return sum(1 + max(0, len(piece) - 3) // 4 for piece in _PIECE_RE.findall(text))
@@ -44,6 +44,7 @@ app.add_middleware(
 
 # Include API routes
 from app.api.api import api_router
+from app.services.rag_service import rag_service
 # Primary versioned API
 app.include_router(api_router, prefix="/api/v1")
 # Backward-compatible unversioned prefix to support older clients/bots
@@ -69,10 +70,16 @@ else:
     # Raise an exception to stop the server if static directory is not found
     raise Exception(msg)
 
-# Health check endpoint
+# Warm the embedding model and knowledge index after startup instead of at import time
+@app.on_event("startup")
+async def warmup_rag():
+    if os.getenv("RAG_WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes"):
+        rag_service.start_background_warmup()
+
+# Health check endpoint (the app is healthy while the RAG service is still warming up)
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "rag": rag_service.status()}
 
 # Servir el archivo index.html para cualquier ruta no manejada
 @app.get("/", response_class=HTMLResponse)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from ..core.database import Base
@@ -35,6 +35,10 @@ class Message(Base):
     metadata_ = Column(JSON, nullable=True)  # Renamed from metadata to avoid Python keyword conflict
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    # Latest messages of a conversation (conversation history) in one index range scan
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+    )
     
     def to_dict(self):
         """Convert message to dictionary."""
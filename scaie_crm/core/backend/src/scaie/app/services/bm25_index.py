@@ -0,0 +1,112 @@
+import re
+import math
+import heapq
+import threading
+import unicodedata
+from collections import Counter
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Very common Spanish/English words; they carry no signal for ranking
+STOPWORDS = frozenset("""
+a al ante con como cual de del desde el en entre es esta este hay la las le les lo los mas me mi
+muy no nos o para pero por que se si sin sobre su sus te tu un una uno unos y ya yo
+an and are as at be by for from in is it of on or the to with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, strip accents (so "cuánto" == "cuanto") and split into word tokens."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _TOKEN_RE.findall(text) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Incrementally maintained inverted index with Okapi BM25 scoring.
+
+    Documents are identified by any hashable key; in the RAG service that is
+    the (category, chunk id) row id. Only postings of the query terms
+    are visited, so a lookup costs O(matching postings), not O(corpus).
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[Hashable, int]] = {}
+        self.doc_lengths: Dict[Hashable, int] = {}
+        self._doc_terms: Dict[Hashable, List[str]] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add_document(self, key: Hashable, text: str):
+        """Index text under key (replacing any previous version)."""
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        with self._lock:
+            self._remove(key)
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[key] = tf
+            self.doc_lengths[key] = len(tokens)
+            self._doc_terms[key] = list(counts.keys())
+            self._total_length += len(tokens)
+
+    def remove_document(self, key: Hashable):
+        """Drop key from the index if present."""
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: Hashable):
+        terms = self._doc_terms.pop(key, None)
+        if terms is None:
+            return
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(key, None)
+                if not docs:
+                    del self.postings[term]
+        self._total_length -= self.doc_lengths.pop(key, 0)
+
+    def search(self, query: str, top_k: int, accept: Optional[Callable[[Hashable], bool]] = None) -> List[Tuple[Hashable, float]]:
+        """
+        Return up to top_k (key, BM25 score) pairs, best first.
+
+        Args:
+            query: Query text
+            top_k: Number of results
+            accept: Optional predicate to filter keys (e.g. by category)
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self.doc_lengths)
+            if not n_docs or not terms:
+                return []
+            avg_length = self._total_length / n_docs
+            scores: Dict[Hashable, float] = {}
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for key, tf in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[key] / avg_length)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if accept is not None:
+            scores = {key: score for key, score in scores.items() if accept(key)}
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hashable]], k: int = 60) -> List[Tuple[Hashable, float]]:
+    """Fuse several best-first rankings with RRF: score = sum(1 / (k + rank))."""
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
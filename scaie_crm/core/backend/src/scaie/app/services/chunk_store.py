@@ -0,0 +1,21 @@
+from typing import Optional
+
+from .knowledge_store import KnowledgeStore
+
+
+class ChunkStore(KnowledgeStore):
+    """
+    Content-addressed chunk texts: ``{"id": <md5 of text>, "text": ...}``.
+
+    Knowledge entries only keep the list of chunk ids, so a chunk shared by
+    several documents is stored (and embedded) once. Persistence is the
+    same snapshot + write-ahead log as the knowledge base.
+    """
+
+    SNAPSHOT_FILE = "chunks.json"
+    WAL_FILE = "chunks.wal.jsonl"
+
+    def text(self, chunk_id: str) -> Optional[str]:
+        """Text of a chunk, or None if unknown."""
+        chunk = self.entries.get(chunk_id)
+        return chunk["text"] if chunk is not None else None
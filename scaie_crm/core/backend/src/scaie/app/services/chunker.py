@@ -0,0 +1,139 @@
+import os
+import re
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple, Type
+
+from ..core.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Sentence ends: ., !, ? or … followed by whitespace
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+class Chunker(ABC):
+    """Splits document content into the chunks that are embedded and searched."""
+
+    @abstractmethod
+    def split(self, text: str) -> List[str]:
+        """Chunks of text, in document order."""
+
+
+class WordWindowChunker(Chunker):
+    """Fixed windows of chunk_size words overlapping by overlap words (the original behaviour)."""
+
+    def __init__(self, chunk_size: int = 500, overlap: int = 50):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    def split(self, text: str) -> List[str]:
+        words = text.split()
+        chunks = []
+        for i in range(0, len(words), self.chunk_size - self.overlap):
+            chunk = " ".join(words[i:i + self.chunk_size])
+            if chunk.strip():
+                chunks.append(chunk.strip())
+        return chunks
+
+
+class SentenceChunker(Chunker):
+    """
+    Packs whole sentences (and lines, so lists stay intact) into chunks of at
+    most max_tokens estimated tokens. Consecutive chunks share up to
+    overlap_tokens of trailing sentences; a sentence longer than the budget
+    is split on word boundaries.
+    """
+
+    def __init__(self, max_tokens: int = 200, overlap_tokens: int = 30):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    def _units(self, text: str) -> List[Tuple[str, bool, int]]:
+        """(sentence, starts a new line, tokens) for every sentence in text."""
+        units = []
+        for line in text.splitlines():
+            for j, sentence in enumerate(_SENTENCE_END_RE.split(line.strip())):
+                sentence = sentence.strip()
+                if not sentence:
+                    continue
+                tokens = estimate_tokens(sentence)
+                if tokens <= self.max_tokens:
+                    units.append((sentence, j == 0, tokens))
+                else:
+                    for k, piece in enumerate(self._split_long(sentence)):
+                        units.append((piece, j == 0 and k == 0, estimate_tokens(piece)))
+        return units
+
+    def _split_long(self, sentence: str) -> List[str]:
+        pieces = []
+        words = []
+        tokens = 0
+        for word in sentence.split():
+            word_tokens = estimate_tokens(word)
+            if words and tokens + word_tokens > self.max_tokens:
+                pieces.append(" ".join(words))
+                words, tokens = [], 0
+            words.append(word)
+            tokens += word_tokens
+        if words:
+            pieces.append(" ".join(words))
+        return pieces
+
+    @staticmethod
+    def _join(units: List[Tuple[str, bool, int]]) -> str:
+        parts = []
+        for i, (sentence, new_line, _) in enumerate(units):
+            if i:
+                parts.append("\n" if new_line else " ")
+            parts.append(sentence)
+        return "".join(parts)
+
+    def split(self, text: str) -> List[str]:
+        chunks = []
+        current: List[Tuple[str, bool, int]] = []
+        current_tokens = 0
+        for unit in self._units(text):
+            tokens = unit[2]
+            if current and current_tokens + tokens > self.max_tokens:
+                chunks.append(self._join(current))
+                # Carry the trailing sentences over as overlap
+                kept = 0
+                keep = []
+                for previous in reversed(current):
+                    if kept + previous[2] > self.overlap_tokens or kept + previous[2] + tokens > self.max_tokens:
+                        break
+                    keep.insert(0, previous)
+                    kept += previous[2]
+                current, current_tokens = keep, kept
+            current.append(unit)
+            current_tokens += tokens
+        if current:
+            chunks.append(self._join(current))
+        return chunks
+
+
+CHUNKERS: Dict[str, Type[Chunker]] = {
+    "sentence": SentenceChunker,
+    "words": WordWindowChunker,
+}
+
+
+def create_chunker(name: str = None) -> Chunker:
+    """
+    Create the chunker selected by RAG_CHUNKER (a key of CHUNKERS).
+
+    The sentence chunker's budget comes from RAG_CHUNK_TOKENS and
+    RAG_CHUNK_OVERLAP_TOKENS; all-MiniLM-L6-v2 truncates its input at 256
+    word pieces, so longer chunks would not be fully embedded.
+    """
+    name = (name or os.getenv("RAG_CHUNKER", "sentence")).lower()
+    if name not in CHUNKERS:
+        logger.warning(f"Unknown RAG chunker '{name}', using sentence chunker")
+        name = "sentence"
+    if name == "sentence":
+        return SentenceChunker(
+            max_tokens=int(os.getenv("RAG_CHUNK_TOKENS", "200")),
+            overlap_tokens=int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "30")),
+        )
+    return CHUNKERS[name]()
@@ -0,0 +1,61 @@
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from ..core.cache import TTLCache
+from ..core.tokens import estimate_tokens
+
+
+class ContextAssembler:
+    """
+    Builds the knowledge context block sent to the LLM from search results.
+
+    Formatted ``**title**\\nchunk`` blocks are cached with their token count,
+    chunks are packed by token budget, and assembled contexts are memoized
+    under a caller-supplied key (the RAG service includes its knowledge
+    version, so any change to the knowledge base makes old entries
+    unreachable).
+    """
+
+    def __init__(self, max_blocks: int = 4096, max_contexts: int = 1024, ttl_seconds: Optional[float] = None):
+        self.blocks = TTLCache(max_entries=max_blocks)
+        self.contexts = TTLCache(max_entries=max_contexts, ttl_seconds=ttl_seconds)
+
+    def block(self, chunk_id: str, title: str, chunk: str) -> Tuple[str, int]:
+        """Formatted block for a chunk and its estimated token count."""
+        key = (chunk_id, title)
+        cached = self.blocks.get(key)
+        if cached is None:
+            text = f"**{title}**\n{chunk}\n"
+            cached = (text, estimate_tokens(text))
+            self.blocks.set(key, cached)
+        return cached
+
+    def assemble(self, results: List[Dict[str, Any]], max_tokens: int, max_chars: Optional[int] = None) -> str:
+        """
+        Pack formatted results, best first, into max_tokens (and max_chars if given).
+
+        A block that does not fit is skipped so a smaller one further down
+        can still use the remaining budget.
+        """
+        parts = []
+        tokens = 0
+        chars = 0
+        for result in results:
+            text, block_tokens = self.block(result.get("chunk_id") or result["chunk"], result["title"], result["chunk"])
+            if tokens + block_tokens > max_tokens:
+                continue
+            if max_chars is not None and chars + len(text) > max_chars:
+                continue
+            parts.append(text)
+            tokens += block_tokens
+            chars += len(text)
+        return "\n".join(parts)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """Memoized context for key, or None."""
+        return self.contexts.get(key)
+
+    def set(self, key: Hashable, context: str):
+        self.contexts.set(key, context)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"blocks": self.blocks.stats(), "contexts": self.contexts.stats()}
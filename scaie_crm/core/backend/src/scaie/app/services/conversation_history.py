@@ -0,0 +1,233 @@
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..core.tokens import estimate_tokens
+from ..models.conversation import Conversation, Message
+
+SENDER_LABELS = {"user": "Usuario", "agent": "Asistente"}
+
+# Key of the conversation summary in Conversation.context
+CONTEXT_KEY = "history_summary"
+
+# Conversation history in the prompt: up to LLM_HISTORY_MESSAGES recent messages within
+# LLM_HISTORY_MAX_TOKENS; older ones are folded into a rolling summary (one light-model call
+# per LLM_HISTORY_SUMMARY_BATCH messages that left the window) within LLM_HISTORY_SUMMARY_TOKENS
+LLM_HISTORY_MESSAGES = int(os.getenv("LLM_HISTORY_MESSAGES", "10"))
+LLM_HISTORY_MAX_TOKENS = int(os.getenv("LLM_HISTORY_MAX_TOKENS", "600"))
+LLM_HISTORY_SUMMARY_TOKENS = int(os.getenv("LLM_HISTORY_SUMMARY_TOKENS", "200"))
+LLM_HISTORY_SUMMARY_BATCH = int(os.getenv("LLM_HISTORY_SUMMARY_BATCH", "6"))
+
+SUMMARY_INSTRUCTIONS = (
+    "Resume la conversación entre un asistente de ventas de SCAIE y un contacto. Integra los mensajes "
+    "nuevos en el resumen anterior. Conserva quién es el contacto y su empresa, qué necesita, los datos "
+    "que dio (número de personas, fechas, presupuesto), sus objeciones y lo acordado. Escribe en tercera "
+    "persona, sin saludos, en menos de {words} palabras. Responde solo con el resumen."
+)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """text cut (at a word boundary) to about max_tokens estimated tokens."""
+    text = " ".join(text.split())
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    cut = text[:max(1, len(text) * max_tokens // tokens)]
+    if " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut + "…"
+
+
+class SummaryRequest:
+    """Messages that left the history window, to fold into the conversation summary."""
+
+    def __init__(self, summary: str, turns: List[Tuple[str, str]], through_id: int, max_tokens: int):
+        # Current summary, and the (sender, content) pairs to add to it, oldest first
+        self.summary = summary
+        self.turns = turns
+        # Last message covered once the new summary is applied
+        self.through_id = through_id
+        self.max_tokens = max_tokens
+
+    def messages(self) -> List[Dict[str, str]]:
+        """Chat messages of the summarization call."""
+        lines = "\n".join(f"{SENDER_LABELS.get(sender, sender)}: {content}" for sender, content in self.turns)
+        return [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(words=max(20, self.max_tokens * 3 // 4))},
+            {"role": "user", "content": f"Resumen anterior: {self.summary or '(ninguno)'}\n\nMensajes nuevos:\n{lines}"}
+        ]
+
+
+class ConversationWindow:
+    """
+    History sent with a message: the conversation summary, notes on older
+    messages it does not cover yet, and the latest turns verbatim.
+    """
+
+    def __init__(self, summary: str = "", turns: Optional[List[Tuple[str, str]]] = None, tokens: int = 0,
+                 summary_request: Optional[SummaryRequest] = None):
+        self.summary = summary
+        # (sender, content), oldest first
+        self.turns = turns or []
+        self.tokens = tokens
+        # Set when enough messages are waiting to be summarized (see LLMService.summarize_history)
+        self.summary_request = summary_request
+
+    def __bool__(self) -> bool:
+        return bool(self.summary or self.turns)
+
+    def render(self) -> str:
+        parts = []
+        if self.summary:
+            parts.append(f"Resumen de la conversación anterior: {self.summary}")
+        if self.turns:
+            lines = "\n".join(f"{SENDER_LABELS.get(sender, sender)}: {content}" for sender, content in self.turns)
+            parts.append(f"Últimos mensajes de la conversación:\n{lines}")
+        return "\n".join(parts)
+
+
+class ConversationHistory:
+    """
+    Builds the bounded conversation history for the LLM prompt.
+
+    One query reads the newest messages not yet folded into the summary
+    (served by the messages (conversation_id, created_at) index). The
+    newest ones that fit in ``max_messages`` and ``max_tokens`` are sent
+    as they are, each cut to ``message_tokens``. Older ones are appended,
+    once, to the pending messages in Conversation.context, and shown as
+    notes cut to ``note_tokens`` until they are summarized.
+
+    Once ``summary_batch`` messages are pending, build() returns a
+    SummaryRequest: the caller has the light model fold them into the
+    rolling summary (LLMService.summarize_history) and stores the result
+    with apply_summary(), so every turn of a long conversation stays
+    represented in about ``summary_tokens`` tokens. If summarizing keeps
+    failing, only the newest ``max_pending`` pending messages are kept
+    and "…" marks the gap. The history never exceeds max_tokens +
+    summary_tokens however long the conversation gets.
+    """
+
+    def __init__(self, max_messages: int = 10, max_tokens: int = 600, summary_tokens: int = 200,
+                 message_tokens: int = 150, note_tokens: int = 40, summary_batch: int = 6, batch: int = 20):
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.message_tokens = message_tokens
+        self.note_tokens = note_tokens
+        self.summary_batch = summary_batch
+        # Pending messages kept while summaries fail (bounds Conversation.context)
+        self.max_pending = 4 * summary_batch
+        # Most messages read past the window per turn (bounds the query for old conversations)
+        self.batch = batch
+
+    @property
+    def summary_max_tokens(self) -> int:
+        """Length asked of the summary; the rest of summary_tokens is left for pending notes."""
+        return self.summary_tokens // 2
+
+    def build(self, db: Session, conversation: Conversation, before_id: Optional[int] = None) -> ConversationWindow:
+        """
+        History of conversation up to (not including) message before_id,
+        usually the user message being answered. Messages that leave the
+        window are added to the pending messages in conversation.context;
+        the caller commits the session.
+        """
+        state = self._state(conversation)
+        through_id = state.get("through_id", 0)
+        pending: List[List[Any]] = list(state.get("pending", []))
+        dropped = state.get("dropped", False)
+
+        query = db.query(Message.id, Message.sender, Message.content).filter(
+            Message.conversation_id == conversation.id,
+            Message.id > through_id
+        )
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        rows = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(self.max_messages + self.batch).all()
+
+        turns: List[Tuple[str, str]] = []
+        tokens = 0
+        kept = 0
+        for row in rows[:self.max_messages]:
+            content = truncate_tokens(row.content or "", self.message_tokens)
+            line_tokens = estimate_tokens(content) + 3
+            if tokens + line_tokens > self.max_tokens:
+                break
+            turns.append((row.sender, content))
+            tokens += line_tokens
+            kept += 1
+        turns.reverse()
+
+        evicted = rows[kept:]
+        if evicted:
+            if len(rows) == self.max_messages + self.batch and through_id == 0:
+                # A long conversation seen for the first time: its opening is older than this batch
+                dropped = True
+            pending.extend([row.id, row.sender, truncate_tokens(row.content or "", self.message_tokens)]
+                           for row in reversed(evicted))
+            if len(pending) > self.max_pending:
+                # Summaries are failing: keep the newest
+                pending = pending[-self.max_pending:]
+                dropped = True
+            # Messages older than this batch are skipped, not re-read
+            self._save(conversation, {**state, "through_id": max(row.id for row in evicted),
+                                      "pending": pending, "dropped": dropped})
+
+        summary = self._render_summary(state.get("summary", ""), pending, dropped)
+        if summary:
+            tokens += estimate_tokens(summary)
+        request = None
+        if len(pending) >= self.summary_batch:
+            request = SummaryRequest(state.get("summary", ""), [(sender, content) for _, sender, content in pending],
+                                     pending[-1][0], self.summary_max_tokens)
+        return ConversationWindow(summary, turns, tokens, request)
+
+    def _render_summary(self, summary: str, pending: Sequence[Sequence[Any]], dropped: bool) -> str:
+        """
+        The summary followed by notes on the pending messages: the newest
+        that fit in the summary_tokens left by the summary.
+        """
+        parts = [summary] if summary else []
+        budget = self.summary_tokens - estimate_tokens(summary) - 1
+        notes: List[str] = []
+        for _, sender, content in reversed(pending):
+            note = f"{SENDER_LABELS.get(sender, sender)}: {truncate_tokens(content, self.note_tokens)}"
+            budget -= estimate_tokens(note) + 1
+            if budget < 0:
+                dropped = True
+                break
+            notes.append(note)
+        if dropped:
+            parts.append("…")
+        parts.extend(reversed(notes))
+        return "; ".join(parts)
+
+    def apply_summary(self, conversation: Conversation, summary: str, through_id: int):
+        """
+        Store the summary of the messages up to through_id (SummaryRequest.through_id)
+        and drop them from the pending messages; the caller commits the session.
+        """
+        state = self._state(conversation)
+        if through_id <= state.get("summary_through_id", 0):
+            # A newer summary was stored meanwhile
+            return
+        pending = [entry for entry in state.get("pending", []) if entry[0] > through_id]
+        self._save(conversation, {**state, "summary": truncate_tokens(summary, self.summary_max_tokens),
+                                  "summary_through_id": through_id, "pending": pending, "dropped": False})
+
+    @staticmethod
+    def _state(conversation: Conversation) -> Dict[str, Any]:
+        return dict((conversation.context or {}).get(CONTEXT_KEY) or {})
+
+    def _save(self, conversation: Conversation, state: Dict[str, Any]):
+        # JSON columns only notice reassignment, not in-place edits
+        conversation.context = {**(conversation.context or {}), CONTEXT_KEY: state}
+
+
+conversation_history = ConversationHistory(
+    max_messages=LLM_HISTORY_MESSAGES,
+    max_tokens=LLM_HISTORY_MAX_TOKENS,
+    summary_tokens=LLM_HISTORY_SUMMARY_TOKENS,
+    summary_batch=LLM_HISTORY_SUMMARY_BATCH
+)
@@ -0,0 +1,230 @@
+import os
+import json
+import pickle
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingStore:
+    """
+    Hash-keyed float32 embedding store backed by a memory-mapped file.
+
+    On disk the store is three files in ``path``:
+
+    - ``embeddings.<gen>.f32``: raw float32 rows, append-only
+    - ``embeddings_index.<gen>.tsv``: one ``<hash>\\t<row>`` line per stored
+      vector; a ``-<hash>`` line is a tombstone left by ``delete``
+    - ``embeddings_meta.json``: vector dimension and current generation
+
+    Compaction writes a new generation and switches to it by atomically
+    replacing the meta file, so a crash never leaves a half-written store.
+
+    Vectors are read through ``np.memmap`` so startup only parses the index
+    and worker processes share the page cache. New vectors stay in memory
+    until ``flush`` appends them; tombstoned rows are reclaimed by ``compact``.
+    """
+
+    META_FILE = "embeddings_meta.json"
+    LEGACY_FILE = "embeddings_cache.pkl"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dim: Optional[int] = None
+        self.generation = 0
+        self._rows: Dict[str, int] = {}
+        self._pending: Dict[str, np.ndarray] = {}
+        self._dead_rows = 0
+        self._vectors: Optional[np.memmap] = None
+        self._lock = threading.RLock()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _vectors_file(self, generation: Optional[int] = None) -> str:
+        return self._file(f"embeddings.{self.generation if generation is None else generation}.f32")
+
+    def _index_file(self, generation: Optional[int] = None) -> str:
+        return self._file(f"embeddings_index.{self.generation if generation is None else generation}.tsv")
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._pending)
+
+    def __contains__(self, text_hash: str) -> bool:
+        return text_hash in self._pending or text_hash in self._rows
+
+    def load(self):
+        """Open the store, migrating the legacy pickle cache on first run."""
+        meta_file = self._file(self.META_FILE)
+        if not os.path.exists(meta_file):
+            self._migrate_legacy_cache()
+            return
+
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.generation = meta.get("generation", 0)
+
+        self._rows = {}
+        self._dead_rows = 0
+        index_file = self._index_file()
+        if os.path.exists(index_file):
+            with open(index_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if not line:
+                        continue
+                    if line.startswith("-"):
+                        if self._rows.pop(line[1:], None) is not None:
+                            self._dead_rows += 1
+                        continue
+                    text_hash, row = line.split("\t")
+                    if text_hash in self._rows:
+                        self._dead_rows += 1
+                    self._rows[text_hash] = int(row)
+
+        self._remap()
+        logger.info(f"Opened embedding store with {len(self._rows)} vectors")
+
+    def _migrate_legacy_cache(self):
+        """Import ``embeddings_cache.pkl`` (dict of hash -> list of floats)."""
+        legacy_file = self._file(self.LEGACY_FILE)
+        if not os.path.exists(legacy_file):
+            return
+        try:
+            with open(legacy_file, 'rb') as f:
+                legacy = pickle.load(f)
+            for text_hash, vector in legacy.items():
+                self.put(text_hash, np.asarray(vector, dtype=np.float32))
+            self.flush()
+            logger.info(f"Migrated {len(legacy)} embeddings from {self.LEGACY_FILE}")
+        except Exception as e:
+            logger.error(f"Error migrating legacy embeddings cache: {str(e)}")
+
+    def _remap(self):
+        """(Re)open the vectors file after it grew or was compacted."""
+        vectors_file = self._vectors_file()
+        if self.dim is None or not os.path.exists(vectors_file):
+            self._vectors = None
+            return
+        rows = os.path.getsize(vectors_file) // (4 * self.dim)
+        if rows == 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(vectors_file, dtype=np.float32, mode='r', shape=(rows, self.dim))
+
+    def get(self, text_hash: str) -> Optional[np.ndarray]:
+        """Return the stored vector (a read-only view for flushed rows) or None."""
+        with self._lock:
+            vector = self._pending.get(text_hash)
+            if vector is not None:
+                return vector
+            row = self._rows.get(text_hash)
+            if row is None or self._vectors is None:
+                return None
+            return self._vectors[row]
+
+    def put(self, text_hash: str, vector: np.ndarray):
+        """Stage a vector; it is written to disk by the next ``flush``."""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        with self._lock:
+            if text_hash in self:
+                return
+            if self.dim is None:
+                self.dim = len(vector)
+            elif len(vector) != self.dim:
+                raise ValueError(f"Embedding dimension {len(vector)} does not match store dimension {self.dim}")
+            self._pending[text_hash] = vector
+
+    def delete(self, text_hash: str):
+        """Forget a vector; its row is reclaimed on the next compaction."""
+        with self._lock:
+            if self._pending.pop(text_hash, None) is not None:
+                return
+            if self._rows.pop(text_hash, None) is not None:
+                self._dead_rows += 1
+                with open(self._index_file(), 'a', encoding='utf-8') as f:
+                    f.write(f"-{text_hash}\n")
+
+    def flush(self):
+        """Append staged vectors to disk and compact if mostly tombstones."""
+        with self._lock:
+            self._append_pending()
+            if self._dead_rows > max(1024, len(self._rows)):
+                self.compact()
+
+    def _append_pending(self):
+        if not self._pending:
+            return
+        if not os.path.exists(self._file(self.META_FILE)):
+            self._write_meta(self.generation)
+        vectors_file = self._vectors_file()
+        row_bytes = 4 * self.dim
+        first_row = os.path.getsize(vectors_file) // row_bytes if os.path.exists(vectors_file) else 0
+
+        hashes = list(self._pending.keys())
+        block = np.stack([self._pending[h] for h in hashes]).astype(np.float32, copy=False)
+        with open(vectors_file, 'r+b' if os.path.exists(vectors_file) else 'wb') as f:
+            # Drop any partial row left by an interrupted append
+            f.truncate(first_row * row_bytes)
+            f.seek(first_row * row_bytes)
+            f.write(block.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._index_file(), 'a', encoding='utf-8') as f:
+            f.writelines(f"{h}\t{first_row + i}\n" for i, h in enumerate(hashes))
+            f.flush()
+            os.fsync(f.fileno())
+
+        for i, h in enumerate(hashes):
+            self._rows[h] = first_row + i
+        self._pending = {}
+        self._remap()
+
+    def compact(self):
+        """Rewrite the store without tombstoned rows as a new generation."""
+        with self._lock:
+            if self.dim is None:
+                return
+            self._append_pending()
+
+            old_generation = self.generation
+            new_generation = old_generation + 1
+            hashes: List[str] = list(self._rows.keys())
+            with open(self._vectors_file(new_generation), 'wb') as f:
+                if hashes and self._vectors is not None:
+                    rows = np.fromiter((self._rows[h] for h in hashes), dtype=np.int64, count=len(hashes))
+                    f.write(np.ascontiguousarray(self._vectors[rows]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._index_file(new_generation), 'w', encoding='utf-8') as f:
+                f.writelines(f"{h}\t{i}\n" for i, h in enumerate(hashes))
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Switching the meta file is the commit point of the compaction
+            self._write_meta(new_generation)
+            self.generation = new_generation
+            for old_file in (self._vectors_file(old_generation), self._index_file(old_generation)):
+                try:
+                    os.remove(old_file)
+                except OSError:
+                    pass
+
+            self._rows = {h: i for i, h in enumerate(hashes)}
+            self._dead_rows = 0
+            self._remap()
+            logger.info(f"Compacted embedding store to {len(hashes)} vectors")
+
+    def _write_meta(self, generation: int):
+        meta_file = self._file(self.META_FILE)
+        tmp_file = meta_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"dim": self.dim, "dtype": "float32", "generation": generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, meta_file)
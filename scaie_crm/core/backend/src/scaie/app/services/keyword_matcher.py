@@ -0,0 +1,74 @@
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Sequence, Set, Tuple
+
+_TOKEN_RE = re.compile(r"\w+")
+_ACCENTS = str.maketrans("áéíóúü", "aeiouu")
+# A letter repeated ("holaa", "siii"); digits are left alone
+_REPEATED_RE = re.compile(r"([^\W\d_])\1+")
+
+
+def tokenize(text: str) -> Tuple[str, ...]:
+    """Lowercase word tokens of text (accents kept, punctuation dropped)."""
+    return tuple(_TOKEN_RE.findall(text.lower()))
+
+
+@lru_cache(maxsize=8192)
+def stem(token: str) -> str:
+    """
+    Form a token is matched in: accents folded, repeated letters collapsed
+    and a plural "s" plus a final a/e/o dropped, so "precios", "Precio" and
+    "sesiones"/"sesión" compare equal. Tokens of up to 3 letters ("no", "hi",
+    "rag") and 4-letter words like "caro" keep their ending and only match
+    themselves.
+    """
+    token = _REPEATED_RE.sub(r"\1", token.translate(_ACCENTS))
+    if len(token) > 3 and token.endswith("s"):
+        token = token[:-1]
+    if len(token) > 4 and token[-1] in "aeo":
+        token = token[:-1]
+    return token
+
+
+class KeywordMatcher:
+    """
+    Matches many keyword rules against a tokenized text in one pass.
+
+    ``rules`` is an ordered list of ``(name, keywords)``; the position in the
+    list is the rule's priority. A keyword is a word or a phrase and only
+    matches whole tokens ("no" matches "no, gracias" but not "nosotros"),
+    compared by stem() so plurals, gender, accents and elongated words
+    ("holaa") still match. ``match`` returns every rule with a keyword in
+    the text, highest priority first.
+    """
+
+    def __init__(self, rules: Sequence[Tuple[str, Iterable[str]]]):
+        self.rules = [name for name, _ in rules]
+        phrase_rules: Dict[Tuple[str, ...], Set[int]] = {}
+        for priority, (_, keywords) in enumerate(rules):
+            for keyword in keywords:
+                phrase = tuple(stem(token) for token in tokenize(keyword))
+                if phrase:
+                    phrase_rules.setdefault(phrase, set()).add(priority)
+        self._phrases: Dict[Tuple[str, ...], FrozenSet[int]] = {
+            phrase: frozenset(priorities) for phrase, priorities in phrase_rules.items()
+        }
+        # Length of the longest phrase starting with each token
+        self._max_len: Dict[str, int] = {}
+        for phrase in self._phrases:
+            self._max_len[phrase[0]] = max(self._max_len.get(phrase[0], 0), len(phrase))
+
+    def match(self, tokens: Sequence[str]) -> List[str]:
+        """Names of all rules with a keyword in tokens (see tokenize), in priority order."""
+        phrases = self._phrases
+        tokens = [stem(token) for token in tokens]
+        hits: Set[int] = set()
+        for i, token in enumerate(tokens):
+            longest = self._max_len.get(token)
+            if longest is None:
+                continue
+            for end in range(i + 1, min(i + longest, len(tokens)) + 1):
+                priorities = phrases.get(tuple(tokens[i:end]))
+                if priorities is not None:
+                    hits |= priorities
+        return [self.rules[priority] for priority in sorted(hits)]
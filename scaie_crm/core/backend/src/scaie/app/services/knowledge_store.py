@@ -0,0 +1,188 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class KnowledgeStore:
+    """
+    Knowledge base persistence: JSON snapshot plus an append-only write-ahead log.
+
+    Every mutation appends one JSON line to ``knowledge_base.wal.jsonl``, so
+    the cost of a write is proportional to the entry, not to the whole
+    knowledge base. Once the log grows past ``compact_every`` records a
+    background thread folds it into ``knowledge_base.json`` (temp file +
+    atomic rename). Replaying the log is idempotent, so a crash at any
+    point loses at most the record being written.
+    """
+
+    SNAPSHOT_FILE = "knowledge_base.json"
+    WAL_FILE = "knowledge_base.wal.jsonl"
+
+    def __init__(self, path: str, compact_every: int = 200, fsync: bool = True):
+        self.path = path
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._wal_records = 0
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread: Optional[threading.Thread] = None
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Load the snapshot and replay any logged mutations on top of it."""
+        with self._lock:
+            self.entries = {}
+            snapshot_file = self._file(self.SNAPSHOT_FILE)
+            if os.path.exists(snapshot_file):
+                with open(snapshot_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+
+            # A rotated log only survives if a compaction was interrupted
+            old_wal_file = self._file(self.WAL_FILE + ".old")
+            needs_compaction = os.path.exists(old_wal_file)
+            self._wal_records = 0
+            for wal_file in (old_wal_file, self._file(self.WAL_FILE)):
+                records, torn = self._replay(wal_file)
+                self._wal_records += records
+                needs_compaction = needs_compaction or torn
+
+            if self._wal_records:
+                logger.info(f"Replayed {self._wal_records} knowledge log records")
+
+        if needs_compaction:
+            # Start from a clean snapshot instead of appending after a torn record
+            self.compact()
+        return self.entries
+
+    def _replay(self, wal_file: str):
+        """Apply a log file; returns (records applied, whether a torn record was found)."""
+        if not os.path.exists(wal_file):
+            return 0, False
+        count = 0
+        torn = False
+        with open(wal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn write from a crash; every other record is intact (a log kept
+                    # by a failed compaction can have more records after it)
+                    logger.warning(f"Ignoring truncated record in {wal_file}")
+                    torn = True
+                    continue
+                if record["op"] == "put":
+                    self.entries[record["id"]] = record["entry"]
+                elif record["op"] == "delete":
+                    self.entries.pop(record["id"], None)
+                count += 1
+        return count, torn
+
+    def put(self, entry: Dict[str, Any]):
+        """Insert or replace an entry (keyed by entry["id"])."""
+        self.put_many([entry])
+
+    def put_many(self, entries: List[Dict[str, Any]]):
+        """Insert or replace several entries with a single log write."""
+        with self._lock:
+            for entry in entries:
+                self.entries[entry["id"]] = entry
+            self._append([{"op": "put", "id": entry["id"], "entry": entry} for entry in entries])
+
+    def delete(self, knowledge_id: str):
+        """Remove an entry."""
+        self.delete_many([knowledge_id])
+
+    def delete_many(self, knowledge_ids: List[str]):
+        """Remove several entries with a single log write."""
+        with self._lock:
+            for knowledge_id in knowledge_ids:
+                self.entries.pop(knowledge_id, None)
+            self._append([{"op": "delete", "id": knowledge_id} for knowledge_id in knowledge_ids])
+
+    def _append(self, records: List[Dict[str, Any]]):
+        if not records:
+            return
+        with open(self._file(self.WAL_FILE), 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._wal_records += len(records)
+        if self._wal_records >= self.compact_every:
+            self.compact_in_background()
+
+    def compact_in_background(self):
+        """Start a compaction unless one is already running."""
+        with self._lock:
+            if self._compaction_thread and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(target=self.compact, name="knowledge-compaction", daemon=True)
+            self._compaction_thread.start()
+
+    def compact(self):
+        """Fold the log into a new snapshot."""
+        with self._compaction_lock:
+            self._compact()
+
+    def _compact(self):
+        try:
+            with self._lock:
+                # Copy the entries and rotate the log together so no record is lost or applied twice
+                entries = dict(self.entries)
+                wal_file = self._file(self.WAL_FILE)
+                old_wal_file = wal_file + ".old"
+                if os.path.exists(wal_file):
+                    if os.path.exists(old_wal_file):
+                        # Left by a failed compaction: keep its records, oldest first
+                        self._append_file(wal_file, old_wal_file)
+                        os.remove(wal_file)
+                    else:
+                        os.replace(wal_file, old_wal_file)
+                self._wal_records = 0
+
+            # Entries are replaced, never edited in place, so the shallow copy is stable
+            data = json.dumps(entries, ensure_ascii=False, indent=2)
+
+            snapshot_file = self._file(self.SNAPSHOT_FILE)
+            tmp_file = snapshot_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp_file, snapshot_file)
+
+            if os.path.exists(old_wal_file):
+                os.remove(old_wal_file)
+            logger.info(f"Compacted knowledge base snapshot ({len(entries)} entries)")
+        except Exception as e:
+            logger.error(f"Error compacting knowledge base: {str(e)}")
+
+    def _append_file(self, source: str, target: str):
+        """Append the records of log source to log target."""
+        with open(source, 'rb') as f:
+            records = f.read()
+        with open(target, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                # Start on a new line after a torn last record
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write(records)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """Block until a running background compaction finishes."""
+        thread = self._compaction_thread
+        if thread:
+            thread.join(timeout)
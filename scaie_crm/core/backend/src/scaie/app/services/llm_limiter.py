@@ -0,0 +1,209 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from ..core.metrics import metrics
+
+
+class LLMOverloaded(Exception):
+    """Raised when a call is shed: the queue is full or its deadline expired while waiting."""
+
+
+class TokenBucket:
+    """
+    Request rate limit: ``rate`` tokens per second, bursts of up to ``burst``.
+
+    Tokens are reserved in arrival order; the balance goes negative while
+    callers are waiting for tokens that have not been refilled yet.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """Seconds to wait before using the reserved token, or None (nothing reserved) if longer than max_wait."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+
+class LimiterSlot:
+    """One admitted call; ``async with`` releases it and reports how the call went."""
+
+    def __init__(self, limiter: "AdaptiveLimiter"):
+        self.limiter = limiter
+        self.started = time.monotonic()
+        # Latency fed to the limiter; defaults to how long the slot was held
+        self.latency_ms: Optional[float] = None
+
+    def mark_first_token(self):
+        """For streamed calls: use the time to the first token as the latency signal."""
+        if self.latency_ms is None:
+            self.latency_ms = (time.monotonic() - self.started) * 1000
+
+    async def __aenter__(self) -> "LimiterSlot":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter._release(self, exc)
+        return False
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit and request queue in front of the LLM provider.
+
+    At most ``limit`` calls run at once; the rest wait in FIFO order, up to
+    ``max_queue`` of them, for at most ``queue_timeout_ms`` (the deadline
+    also covers waiting for a rate limit token). Calls that cannot be
+    admitted in time raise LLMOverloaded.
+
+    The limit adapts AIMD style between ``min_concurrency`` and
+    ``max_concurrency``: every successful call within ``latency_target_ms``
+    made while all slots were busy adds 1/limit (about +1 per limit's worth
+    of calls), while a 429 halves it and a slow call cuts it by 10%. Only
+    calls started after the last cut can cut it again, so one burst of 429s
+    counts once.
+    """
+
+    def __init__(self, max_concurrency: int = 8, min_concurrency: int = 1, max_queue: int = 100,
+                 queue_timeout_ms: float = 10000, rate_per_minute: float = 0, burst: Optional[float] = None,
+                 latency_target_ms: float = 0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.max_queue = max_queue
+        self.queue_timeout_ms = queue_timeout_ms
+        self.latency_target_ms = latency_target_ms
+        self.bucket = TokenBucket(rate_per_minute / 60, burst or self.max_concurrency) if rate_per_minute > 0 else None
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._waiting = 0
+        self._last_decrease = 0.0
+        self.shed = 0
+        self.rate_limited = 0
+
+    @property
+    def capacity(self) -> int:
+        return max(self.min_concurrency, int(self.limit))
+
+    @property
+    def queued(self) -> int:
+        """Calls waiting for a slot or a rate limit token."""
+        return self._waiting
+
+    async def acquire(self, timings: Optional[Dict[str, Any]] = None) -> LimiterSlot:
+        """
+        Wait for a slot and a rate limit token; use the result with ``async with``.
+
+        The wait is recorded as llm.queue_wait_ms (and in timings["queue_wait_ms"]).
+        """
+        started = time.monotonic()
+        deadline = started + self.queue_timeout_ms / 1000
+        self._waiting += 1
+        try:
+            await self._acquire_slot(deadline)
+            try:
+                if self.bucket is not None:
+                    wait = self.bucket.reserve(deadline - time.monotonic())
+                    if wait is None:
+                        self._shed("no rate limit token before the queue deadline")
+                    if wait:
+                        await asyncio.sleep(wait)
+            except BaseException:
+                self._release_slot()
+                raise
+        finally:
+            self._waiting -= 1
+            wait_ms = (time.monotonic() - started) * 1000
+            metrics.observe("llm.queue_wait_ms", wait_ms)
+            if timings is not None:
+                timings["queue_wait_ms"] = wait_ms
+        return LimiterSlot(self)
+
+    async def _acquire_slot(self, deadline: float):
+        if self.in_flight < self.capacity and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._shed(f"queue full ({self.max_queue} waiting)")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait((future,), timeout=max(0.0, deadline - time.monotonic()))
+        except BaseException:
+            # Cancelled while waiting: give back a slot granted in the meantime
+            if future.done():
+                self._release_slot()
+            else:
+                self._abandon(future)
+            raise
+        if not future.done():
+            self._abandon(future)
+            self._shed(f"no free slot within {self.queue_timeout_ms:.0f} ms")
+
+    def _abandon(self, future: asyncio.Future):
+        future.cancel()
+        self._waiters.remove(future)
+
+    def _shed(self, reason: str):
+        self.shed += 1
+        metrics.increment("llm.limiter.shed")
+        raise LLMOverloaded(reason)
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        """Hand free slots to waiters in arrival order; a slot is counted in_flight once granted."""
+        while self._waiters and self.in_flight < self.capacity:
+            future = self._waiters.popleft()
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _release(self, slot: LimiterSlot, error: Optional[BaseException]):
+        if error is None:
+            latency_ms = slot.latency_ms
+            if latency_ms is None:
+                latency_ms = (time.monotonic() - slot.started) * 1000
+            if self.latency_target_ms and latency_ms > self.latency_target_ms:
+                self._decrease(slot, 0.9)
+            elif self.in_flight >= self.capacity:
+                # Only grow while the limit is what holds calls back
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+        elif getattr(error, "status_code", None) == 429:
+            self.rate_limited += 1
+            metrics.increment("llm.limiter.rate_limited")
+            self._decrease(slot, 0.5)
+        self._release_slot()
+
+    def _decrease(self, slot: LimiterSlot, factor: float):
+        if slot.started < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        self.limit = max(float(self.min_concurrency), self.limit * factor)
+        metrics.increment("llm.limiter.decreases")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "min_concurrency": self.min_concurrency,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout_ms": self.queue_timeout_ms,
+            "rate_per_minute": self.bucket.rate * 60 if self.bucket else None,
+            "shed": self.shed,
+            "rate_limited": self.rate_limited
+        }
@@ -0,0 +1,171 @@
+import random
+import time
+from typing import Any, Dict, Optional
+
+from openai import APIError
+
+from ..core.metrics import metrics
+
+# Status codes worth another attempt; 5xx, timeouts and connection errors also open the circuit
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+class LLMTimeout(Exception):
+    """An attempt got no response within the per-attempt timeout."""
+
+
+class CircuitOpen(Exception):
+    """The circuit breaker is open: the call was not sent to the provider."""
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """The provider is down or misbehaving (as opposed to rejecting this request or being busy)."""
+    if isinstance(error, LLMTimeout):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        # Connection errors, timeouts and errors reported inside a stream
+        return isinstance(error, APIError)
+    return status >= 500
+
+
+def is_retryable(error: BaseException) -> bool:
+    return is_upstream_failure(error) or getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+class RetryPolicy:
+    """
+    Per-attempt timeout and bounded retries with exponential backoff.
+
+    The delay before retry n is drawn uniformly from
+    [0, min(max_delay_ms, base_delay_ms * 2^(n-1))] ("full jitter"), so
+    callers that failed together do not retry together; a Retry-After
+    header from the provider raises it, up to max_delay_ms.
+    """
+
+    def __init__(self, max_retries: int = 2, timeout_ms: float = 20000,
+                 base_delay_ms: float = 250, max_delay_ms: float = 4000):
+        self.max_retries = max_retries
+        self.timeout_ms = timeout_ms
+        self.base_delay_ms = base_delay_ms
+        self.max_delay_ms = max_delay_ms
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        """Whether to try again after attempt (1-based) failed with error."""
+        return attempt <= self.max_retries and is_retryable(error)
+
+    def delay(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """Seconds to wait before the retry that follows attempt (1-based)."""
+        ceiling = min(self.max_delay_ms, self.base_delay_ms * 2 ** (attempt - 1))
+        delay_ms = random.uniform(0, ceiling)
+        retry_after = self._retry_after_ms(error)
+        if retry_after is not None:
+            delay_ms = max(delay_ms, min(retry_after, self.max_delay_ms))
+        return delay_ms / 1000
+
+    @staticmethod
+    def _retry_after_ms(error: Optional[BaseException]) -> Optional[float]:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if not headers:
+            return None
+        try:
+            return float(headers.get("retry-after")) * 1000
+        except (TypeError, ValueError):
+            return None
+
+
+class CircuitCall:
+    """One attempt admitted by the breaker; ``async with`` reports its outcome."""
+
+    def __init__(self, breaker: "CircuitBreaker", probe: bool):
+        self.breaker = breaker
+        self.probe = probe
+
+    async def __aenter__(self) -> "CircuitCall":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.breaker._record(self, exc)
+        return False
+
+
+class CircuitBreaker:
+    """
+    Stops calling the provider while it is failing.
+
+    closed: calls go through; ``failure_threshold`` consecutive upstream
+    failures (5xx, timeouts, connection errors) open the circuit.
+    open: calls raise CircuitOpen without touching the network until
+    ``reset_timeout_ms`` have passed.
+    half_open: a single probe call goes through (the rest still raise
+    CircuitOpen); it closes the circuit if it succeeds and reopens it if
+    it fails. Outcomes that say nothing about the provider's health
+    (4xx, shed by the limiter, cancelled) change nothing.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_ms: float = 30000):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout_ms = reset_timeout_ms
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+
+    def check(self):
+        """Raise CircuitOpen if a call now would be rejected (does not take the half-open probe)."""
+        if self.state == self.OPEN and not self._probe_due():
+            self._reject()
+        if self.state == self.HALF_OPEN and self._probing:
+            self._reject()
+
+    def call(self) -> CircuitCall:
+        """Admit one attempt or raise CircuitOpen; use the result with ``async with``."""
+        if self.state == self.OPEN:
+            if not self._probe_due():
+                self._reject()
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self._reject()
+            self._probing = True
+            return CircuitCall(self, probe=True)
+        return CircuitCall(self, probe=False)
+
+    def _probe_due(self) -> bool:
+        return (time.monotonic() - self.opened_at) * 1000 >= self.reset_timeout_ms
+
+    def _reject(self):
+        self.rejected += 1
+        metrics.increment("llm.circuit.rejected")
+        raise CircuitOpen(f"circuit open after {self.failures} consecutive failures")
+
+    def _record(self, call: CircuitCall, error: Optional[BaseException]):
+        if call.probe:
+            self._probing = False
+        if error is None:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+        elif is_upstream_failure(error):
+            self.failures += 1
+            if call.probe or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def _transition(self, state: str):
+        self.state = state
+        metrics.increment(f"llm.circuit.{state}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout_ms": self.reset_timeout_ms,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,90 @@
+from typing import Any, Dict, Optional
+
+from ..core.metrics import metrics
+from ..core.tokens import estimate_tokens
+from ..models.contact import InterestLevel
+from .keyword_matcher import KeywordMatcher
+from .message_classifier import MessageSignals
+
+# Classifier signals that always go to the strong model: buying intent, requests
+# for a person or a call, objections and role-specific questions
+ESCALATION_SIGNALS = frozenset({"interes_fuerte", "pide_telefono", "contacto", "agendar"})
+ESCALATION_PREFIXES = ("objecion:", "rol:")
+# "negativo" also matches a bare "no" ("no sé qué incluye"): only these refusals escalate
+REFUSAL_PHRASES = ("no gracias", "no estoy interesado", "no me interesa", "no ahora", "otro momento",
+                   "no puedo", "no es posible", "muy caro", "muy costoso")
+# Contacts close to buying are always answered by the strong model
+ESCALATION_LEVELS = frozenset({InterestLevel.INTERESTED.value, InterestLevel.CONFIRMED.value})
+# FAQ-type rules the light model can answer when the message is not long
+FAQ_SIGNALS = ("saludo", "sitio_web", "tareas", "herramientas", "modelos", "tendencias", "prompts")
+
+
+class ModelRoute:
+    """Model chosen for one message, its tier ("light" or "strong") and why."""
+
+    def __init__(self, model: str, tier: str, reason: str):
+        self.model = model
+        self.tier = tier
+        self.reason = reason
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"model": self.model, "tier": self.tier, "reason": self.reason}
+
+
+class ModelRouter:
+    """
+    Picks the model for a message that needs an LLM reply.
+
+    Escalation comes first: contacts at an interested/confirmed level and
+    messages with ESCALATION_SIGNALS or a REFUSAL_PHRASES refusal go to
+    ``strong_model``. Otherwise messages of at most ``short_tokens``
+    estimated tokens, and FAQ-type messages of at most ``faq_tokens``, go
+    to ``light_model``; anything else goes to the strong model. With mode "off" (or no light model)
+    every message goes to the strong model.
+    """
+
+    def __init__(self, light_model: Optional[str], strong_model: str, mode: str = "auto",
+                 short_tokens: int = 12, faq_tokens: int = 40):
+        self.light_model = light_model
+        self.strong_model = strong_model
+        self.mode = mode
+        self.short_tokens = short_tokens
+        self.faq_tokens = faq_tokens
+        self.decisions: Dict[str, int] = {}
+        self._refusals = KeywordMatcher([("rechazo", REFUSAL_PHRASES)])
+
+    def route(self, message: str, signals: MessageSignals, interest_level: str) -> ModelRoute:
+        if self.mode != "auto" or not self.light_model or self.light_model == self.strong_model:
+            return self._decide("strong", "fixed")
+        if interest_level in ESCALATION_LEVELS:
+            return self._decide("strong", f"interest:{interest_level}")
+        for name in signals.matches:
+            if name in ESCALATION_SIGNALS:
+                return self._decide("strong", f"signal:{name}")
+            if name.startswith(ESCALATION_PREFIXES):
+                return self._decide("strong", f"signal:{name.split(':')[0]}")
+        if signals.has("negativo") and self._refusals.match(signals.tokens):
+            return self._decide("strong", "signal:rechazo")
+        tokens = estimate_tokens(message)
+        if tokens <= self.short_tokens:
+            return self._decide("light", "short")
+        if tokens <= self.faq_tokens:
+            for name in FAQ_SIGNALS:
+                if signals.has(name):
+                    return self._decide("light", f"faq:{name}")
+        return self._decide("strong", "default")
+
+    def _decide(self, tier: str, reason: str) -> ModelRoute:
+        model = self.light_model if tier == "light" else self.strong_model
+        self.decisions[f"{tier}:{reason}"] = self.decisions.get(f"{tier}:{reason}", 0) + 1
+        metrics.increment(f"llm.route.{tier}")
+        metrics.increment(f"llm.route.reason.{reason}")
+        return ModelRoute(model, tier, reason)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "light_model": self.light_model,
+            "strong_model": self.strong_model,
+            "decisions": dict(self.decisions)
+        }
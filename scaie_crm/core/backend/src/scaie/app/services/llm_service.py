@@ -3,7 +3,8 @@ import sys
 import logging
 from dotenv import load_dotenv
 import asyncio
-from typing import Dict, Any, Optional, List
+import time
+from typing import Dict, Any, AsyncIterator, Optional, List, Tuple
 
 # Load environment variables from .env file (no secret printing)
 env_path = os.path.join(os.path.dirname(__file__), "../../../../../.env")
@@ -39,6 +40,15 @@ from ..core.database import get_db, SessionLocal
 from ..models.conversation import Message, Conversation
 from ..models.contact import Contact, InterestLevel
 from ..services.contact_service import contact_service
+from ..core.metrics import metrics
+from ..core.single_flight import SingleFlight
+from ..core.tokens import estimate_tokens
+from .message_classifier import message_classifier, MessageSignals
+from .response_cache import ResponseCache
+from .conversation_history import ConversationWindow, SummaryRequest
+from .llm_limiter import AdaptiveLimiter, LLMOverloaded
+from .llm_router import ModelRouter
+from .llm_resilience import CircuitBreaker, CircuitOpen, LLMTimeout, RetryPolicy
 from openai import AsyncOpenAI, OpenAI, APIError, RateLimitError
 
 # Configurar logging
@@ -54,6 +64,57 @@ AGENT_PERSONALITY = os.getenv('AGENT_PERSONALITY', 'experto en ventas de worksho
 AGENT_TONE = os.getenv('AGENT_TONE', 'profesional y directo')
 AGENT_GOAL = os.getenv('AGENT_GOAL', 'vender el workshop "Sé más eficiente con IA" y posicionar a SCAIE como consultor experto en IA')
 
+# Knowledge base context in the prompt: retrieval runs while the message is processed and
+# the prompt is built without it if it is not ready RAG_CONTEXT_BUDGET_MS after it started
+LLM_USE_RAG = os.getenv("LLM_USE_RAG", "true").lower() in ("1", "true", "yes")
+RAG_CONTEXT_BUDGET_MS = float(os.getenv("RAG_CONTEXT_BUDGET_MS", "300"))
+
+# Provider prompt caching of the static system prompt prefix: "implicit" relies on
+# automatic prefix caching, "explicit" also marks the prefix with cache_control
+LLM_PROMPT_CACHE = os.getenv("LLM_PROMPT_CACHE", "implicit").lower()
+
+# Cache of LLM replies per interest level + normalized message (exact, then by
+# embedding similarity); cleared when prompts or knowledge change
+LLM_RESPONSE_CACHE = os.getenv("LLM_RESPONSE_CACHE", "true").lower() in ("1", "true", "yes")
+LLM_RESPONSE_CACHE_SIZE = int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "1024"))
+LLM_RESPONSE_CACHE_TTL = float(os.getenv("LLM_RESPONSE_CACHE_TTL", "3600"))
+LLM_RESPONSE_CACHE_THRESHOLD = float(os.getenv("LLM_RESPONSE_CACHE_THRESHOLD", "0.92"))
+# Longest wait for the message embedding of the similarity lookup; past it (or while the
+# RAG service is still warming up) only the exact lookup is done
+LLM_RESPONSE_CACHE_EMBED_MS = float(os.getenv("LLM_RESPONSE_CACHE_EMBED_MS", "100"))
+
+# Backpressure for LLM calls: adaptive concurrency (cut on 429s and on calls slower than
+# LLM_LATENCY_TARGET_MS), optional requests-per-minute limit, and a bounded queue whose
+# callers get a canned reply if they are not admitted within LLM_QUEUE_TIMEOUT_MS
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "100"))
+LLM_QUEUE_TIMEOUT_MS = float(os.getenv("LLM_QUEUE_TIMEOUT_MS", "10000"))
+LLM_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", "0"))
+LLM_LATENCY_TARGET_MS = float(os.getenv("LLM_LATENCY_TARGET_MS", "8000"))
+
+# Resilience: per-attempt timeout, retries with jittered exponential backoff for 408/409/429/5xx,
+# timeouts and connection errors, and a circuit breaker that answers with the fallback right away
+# after LLM_CIRCUIT_FAILURES consecutive provider failures, probing again after LLM_CIRCUIT_RESET_MS
+LLM_TIMEOUT_MS = float(os.getenv("LLM_TIMEOUT_MS", "20000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_MS = float(os.getenv("LLM_RETRY_BASE_MS", "250"))
+LLM_RETRY_MAX_MS = float(os.getenv("LLM_RETRY_MAX_MS", "4000"))
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", "5"))
+LLM_CIRCUIT_RESET_MS = float(os.getenv("LLM_CIRCUIT_RESET_MS", "30000"))
+
+# Concurrent identical requests share one LLM call: "exact" (same messages, model and
+# sampling settings), "message" (same interest level and normalized message text) or "off"
+LLM_COALESCE = os.getenv("LLM_COALESCE", "exact").lower()
+
+# Model routing: short and FAQ-type messages go to LLM_LIGHT_MODEL; buying signals, objections,
+# interested/confirmed contacts and everything else to QWEN_MODEL. "off" always uses QWEN_MODEL
+LLM_ROUTING = os.getenv("LLM_ROUTING", "auto").lower()
+QWEN_MODEL = os.getenv('QWEN_MODEL', 'qwen-plus')
+LLM_LIGHT_MODEL = os.getenv("LLM_LIGHT_MODEL", "qwen-turbo")
+LLM_ROUTE_SHORT_TOKENS = int(os.getenv("LLM_ROUTE_SHORT_TOKENS", "12"))
+LLM_ROUTE_FAQ_TOKENS = int(os.getenv("LLM_ROUTE_FAQ_TOKENS", "40"))
+
 # Initialize OpenAI client (DashScope-compatible)
 DISABLE_LLM = os.getenv("DISABLE_LLM", "false").lower() in ("1", "true", "yes")
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
@@ -69,7 +130,9 @@ try:
     if api_key and not DISABLE_LLM:
         client = AsyncOpenAI(
             api_key=api_key,
-            base_url=base_url
+            base_url=base_url,
+            # Retries are done by LLMService (RetryPolicy), which also feeds the circuit breaker
+            max_retries=0
         )
         logger.info("LLM client initialized successfully")
     else:
@@ -93,6 +156,35 @@ def format_response(text):
     
     return text
 
+class ContextPrefetch:
+    """Knowledge retrieval started ahead of the LLM call (see LLMService.prefetch_context)."""
+    
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.started = time.perf_counter()
+        self.retrieval_ms: Optional[float] = None
+        future.add_done_callback(self._done)
+    
+    def _done(self, future: asyncio.Future):
+        self.retrieval_ms = (time.perf_counter() - self.started) * 1000
+        # Recorded here so retrievals that miss the budget are measured too
+        metrics.observe("llm.retrieval_ms", self.retrieval_ms)
+        # Mark the exception as retrieved even if nobody awaits the context
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Error retrieving knowledge context: {str(future.exception())}")
+    
+    async def result(self, budget_ms: float) -> Tuple[str, bool]:
+        """Context, or "" once budget_ms have passed since retrieval started; returns (context, timed_out)."""
+        remaining = budget_ms / 1000 - (time.perf_counter() - self.started)
+        try:
+            # shield: on timeout retrieval keeps running and still fills the context memo
+            return await asyncio.wait_for(asyncio.shield(self.future), timeout=max(0.0, remaining)), False
+        except asyncio.TimeoutError:
+            return "", True
+        except Exception:
+            return "", False
+
+
 class LLMService:
     def __init__(self):
         self.client = client
@@ -101,196 +193,705 @@ class LLMService:
         self.agent_tone = AGENT_TONE
         self.agent_goal = AGENT_GOAL
         self.workshop_knowledge = workshop_knowledge_instance
+        self.knowledge_version = 0
+        self.response_cache = ResponseCache(
+            max_entries=LLM_RESPONSE_CACHE_SIZE,
+            ttl_seconds=LLM_RESPONSE_CACHE_TTL,
+            threshold=LLM_RESPONSE_CACHE_THRESHOLD
+        )
+        self.limiter = AdaptiveLimiter(
+            max_concurrency=LLM_MAX_CONCURRENCY,
+            min_concurrency=LLM_MIN_CONCURRENCY,
+            max_queue=LLM_QUEUE_MAX,
+            queue_timeout_ms=LLM_QUEUE_TIMEOUT_MS,
+            rate_per_minute=LLM_RATE_LIMIT_RPM,
+            latency_target_ms=LLM_LATENCY_TARGET_MS
+        )
+        self.retry_policy = RetryPolicy(
+            max_retries=LLM_MAX_RETRIES,
+            timeout_ms=LLM_TIMEOUT_MS,
+            base_delay_ms=LLM_RETRY_BASE_MS,
+            max_delay_ms=LLM_RETRY_MAX_MS
+        )
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=LLM_CIRCUIT_FAILURES,
+            reset_timeout_ms=LLM_CIRCUIT_RESET_MS
+        )
+        self.single_flight = SingleFlight()
+        self.router = ModelRouter(
+            light_model=LLM_LIGHT_MODEL,
+            strong_model=QWEN_MODEL,
+            mode=LLM_ROUTING,
+            short_tokens=LLM_ROUTE_SHORT_TOKENS,
+            faq_tokens=LLM_ROUTE_FAQ_TOKENS
+        )
+        # interest level -> (static prefix, strategy, tokens), valid for _system_prompts_fingerprint
+        self._static_prompt = ""
+        self._system_prompts: Dict[str, Tuple[str, str, int]] = {}
+        self._system_prompts_fingerprint: Optional[Tuple[Any, ...]] = None
 
-    async def generate_response(self, message: str, contact: Optional[Contact] = None) -> Dict[str, Any]:
+    def prefetch_context(self, message: str) -> Optional[ContextPrefetch]:
         """
-        Generate AI response for incoming message.
+        Start retrieving knowledge context for message in the background.
         
-        Args:
-            message: Incoming message text
-            contact: Contact object (optional)
-            
-        Returns:
-            Dict with response and metadata
+        Call it as early as possible (before loading the contact, saving the
+        message...) and pass the result to generate_response.
         """
+        if not (RAG_AVAILABLE and LLM_USE_RAG):
+            return None
         try:
-            # Check for specific keywords that require predefined responses
-            response = self._check_predefined_responses(message, contact)
-            if response:
-                return {
-                    'success': True,
-                    'response': response,
-                    'contact_id': contact.id if contact else None
-                }
+            return ContextPrefetch(rag_service.submit_relevant_context(message))
+        except Exception as e:
+            logger.error(f"Error starting knowledge retrieval: {str(e)}")
+            return None
+    
+    def _record_timings(self, timings: Dict[str, Any], started: float) -> Dict[str, Any]:
+        """Add the total and export every stage to the shared metrics."""
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        for stage, value in timings.items():
+            if isinstance(value, float):
+                timings[stage] = round(value, 2)
+                # Recorded where they are measured (retrieval and queue waits that fail count too)
+                if stage not in ("retrieval_ms", "queue_wait_ms"):
+                    metrics.observe(f"llm.{stage}", value)
+        return timings
+    
+    async def _prepare_prompt(self, message: str, contact: Optional[Contact],
+                              context_prefetch: Optional[ContextPrefetch],
+                              timings: Dict[str, Any],
+                              history: Optional[ConversationWindow] = None,
+                              signals: Optional[MessageSignals] = None) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        """
+        Wait (within budget) for the knowledge context, pick the model and build the completion arguments.
         
-            # Generate response using LLM
-            system_prompt = self._create_system_prompt(contact)
-            user_prompt = self._create_user_prompt(message, contact)
-            
-            if not self.client:
-                logger.warning("LLM client not initialized - using fallback response")
-                return {
-                    'success': False,
-                    'error': 'LLM client not initialized',
-                    'response': 'Lo siento, el servicio de IA no está disponible en este momento. Por favor, comunícate al 5535913417 para obtener asistencia.'
-                }
-            
-            # Call with a modest timeout to avoid hanging during local runs
+        Returns the create() kwargs and the estimated prompt tokens per part.
+        """
+        stage = time.perf_counter()
+        interest_level = self._interest_level(contact)
+        system_tokens = self.system_prompt_parts(interest_level)[2]
+        
+        context = ""
+        if context_prefetch is not None:
+            wait = time.perf_counter()
+            context, timed_out = await context_prefetch.result(RAG_CONTEXT_BUDGET_MS)
+            timings["retrieval_wait_ms"] = (time.perf_counter() - wait) * 1000
+            timings["context_timed_out"] = timed_out
+            if context_prefetch.retrieval_ms is not None:
+                timings["retrieval_ms"] = context_prefetch.retrieval_ms
+            if timed_out:
+                metrics.increment("llm.context_timeouts")
+                logger.warning(f"Knowledge retrieval missed the {RAG_CONTEXT_BUDGET_MS:.0f} ms budget; answering without context")
+        
+        history_text = history.render() if history else ""
+        user_prompt = self._create_user_prompt(message, contact, context, history_text)
+        timings["prompt_ms"] = (time.perf_counter() - stage) * 1000 - timings.get("retrieval_wait_ms", 0.0)
+        
+        prompt_tokens = {"system": system_tokens, "user": estimate_tokens(user_prompt)}
+        if history_text:
+            prompt_tokens["history"] = estimate_tokens(history_text)
+            prompt_tokens["user"] -= prompt_tokens["history"]
+        
+        route = self.router.route(message, signals or message_classifier.classify(message), interest_level)
+        timings["model"] = route.model
+        timings["route"] = route.reason
+        kwargs = {
+            "model": route.model,
+            "messages": self._build_messages(interest_level, user_prompt),
+            "temperature": float(os.getenv('TEMPERATURE', '0.9')),  # Más creativo/natural
+            "max_tokens": int(os.getenv('MAX_TOKENS', '512'))       # Respuestas más cortas
+        }
+        return kwargs, prompt_tokens
+
+    def _cache_generation(self) -> Tuple[Any, ...]:
+        """Prompts and knowledge that cached replies were produced with."""
+        return (self._prompt_fingerprint(), rag_service.version if RAG_AVAILABLE else None)
+
+    async def _cached_reply(self, message: str, interest_level: str, timings: Dict[str, Any],
+                            history: Optional[ConversationWindow] = None) -> Tuple[Optional[str], Any]:
+        """
+        Cached reply for message, if any, and the message embedding (used to
+        cache the new reply on a miss; None if there is no embedding model or
+        it was not ready within LLM_RESPONSE_CACHE_EMBED_MS).
+        Messages with conversation history are not looked up: their reply depends on it.
+        """
+        if not LLM_RESPONSE_CACHE or history:
+            return None, None
+        stage = time.perf_counter()
+        cache = self.response_cache
+        cache.check_generation(self._cache_generation())
+        reply = cache.get_exact(interest_level, message)
+        hit = "exact" if reply is not None else None
+        vector = None
+        if reply is None and RAG_AVAILABLE and cache.semantic and rag_service.is_ready:
             try:
-                response = await self.client.chat.completions.create(
-                    model=os.getenv('QWEN_MODEL', 'qwen-plus'),
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=float(os.getenv('TEMPERATURE', '0.9')),  # Más creativo/natural
-                    max_tokens=int(os.getenv('MAX_TOKENS', '512'))       # Respuestas más cortas
-                )
+                # shield: on timeout the embedding still lands in the query cache
+                vector = await asyncio.wait_for(asyncio.shield(rag_service.aembed_query(message)),
+                                                timeout=LLM_RESPONSE_CACHE_EMBED_MS / 1000)
+            except asyncio.TimeoutError:
+                metrics.increment("llm.response_cache.embed_timeout")
             except Exception as e:
-                # Specific handling for HTTP 501 error
-                if getattr(e, 'status_code', None) == 501:
-                    logger.error(f"HTTP 501 error calling LLM API: {str(e)}", exc_info=True)
-                    return {
-                        'success': False,
-                        'error': 'HTTP 501 error',
-                        'response': 'Lo siento, estamos experimentando problemas temporales con nuestro servicio de IA. Por favor, inténtalo de nuevo más tarde.'
-                    }
-                else:
-                    logger.error(f"Error calling LLM API: {str(e)}", exc_info=True)  # Added exc_info for detailed traceback
+                logger.error(f"Error embedding message for the response cache: {str(e)}")
+            if vector is not None:
+                similar = cache.get_similar(interest_level, vector)
+                if similar is not None:
+                    reply, hit = similar[0], "semantic"
+        if reply is None:
+            cache.miss()
+        metrics.increment(f"llm.response_cache.{hit or 'miss'}")
+        timings["cache_ms"] = (time.perf_counter() - stage) * 1000
+        timings["response_cache"] = hit or "miss"
+        return reply, vector
+
+    @staticmethod
+    def _contact_names(contact: Optional[Contact]) -> Tuple[Optional[str], ...]:
+        return (contact.name, contact.company) if contact is not None else ()
+
+    @staticmethod
+    def _mentions(reply: str, names: Tuple[Optional[str], ...]) -> bool:
+        """Whether reply contains any of the names (a contact's name or company: it was written for them)."""
+        reply_lower = reply.lower()
+        return any(name and name.lower() in reply_lower for name in names)
+
+    def _cache_reply(self, message: str, contact: Optional[Contact], interest_level: str, reply: str,
+                     vector: Any, timings: Dict[str, Any], history: Optional[ConversationWindow] = None):
+        """
+        Cache a fresh LLM reply unless it names the contact, answers within a
+        conversation history or was generated without its knowledge context.
+        """
+        if not LLM_RESPONSE_CACHE or history or timings.get("context_timed_out"):
+            return
+        if self._mentions(reply, self._contact_names(contact)):
+            return
+        self.response_cache.set(interest_level, message, reply, vector)
+
+    def _success_result(self, response: str, contact: Optional[Contact], timings: Dict[str, Any],
+                        started: float, prompt_tokens: Optional[Dict[str, int]] = None,
+                        usage: Any = None) -> Dict[str, Any]:
+        result = {
+            'success': True,
+            'response': response,
+            'contact_id': contact.id if contact else None
+        }
+        if prompt_tokens is not None:
+            for part, tokens in prompt_tokens.items():
+                metrics.increment(f"llm.prompt_tokens.{part}", tokens)
+            result['prompt_tokens'] = prompt_tokens
+            result['usage'] = self._record_usage(usage)
+            self._record_model(timings, result['usage'])
+        result['timings'] = self._record_timings(timings, started)
+        return result
+    
+    @staticmethod
+    def _record_model(timings: Dict[str, Any], usage: Optional[Dict[str, int]]):
+        """Per-model latency and token usage of a completed LLM call."""
+        model = timings.get("model")
+        if not model:
+            return
+        for stage in ("llm_ms", "llm_ttfb_ms"):
+            if stage in timings:
+                metrics.observe(f"llm.model.{model}.{stage}", timings[stage])
+        metrics.increment(f"llm.model.{model}.calls")
+        if usage:
+            for name in ("prompt_tokens", "completion_tokens"):
+                metrics.increment(f"llm.model.{model}.{name}", usage[name])
+
+    async def _attempt(self, call) -> Any:
+        """Await one request to the provider, raising LLMTimeout after the per-attempt timeout."""
+        try:
+            return await asyncio.wait_for(call, self.retry_policy.timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            raise LLMTimeout(f"no response from the LLM within {self.retry_policy.timeout_ms:.0f} ms")
+
+    async def _before_retry(self, e: Exception, attempt: int):
+        delay = self.retry_policy.delay(attempt, e)
+        logger.warning(f"LLM attempt {attempt} failed ({str(e)}); retrying in {delay * 1000:.0f} ms")
+        metrics.increment("llm.retries")
+        await asyncio.sleep(delay)
+
+    async def _complete(self, kwargs: Dict[str, Any], timings: Dict[str, Any]) -> Any:
+        """
+        Non-streamed completion: each attempt goes through the circuit breaker
+        and the limiter, with the RetryPolicy timeout; retryable errors are
+        retried after a jittered backoff.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            timings["attempts"] = attempt
+            try:
+                async with self.circuit_breaker.call(), await self.limiter.acquire(timings):
+                    return await self._attempt(self.client.chat.completions.create(**kwargs))
+            except Exception as e:
+                if not self.retry_policy.should_retry(e, attempt):
                     raise
-            
-            ai_response = response.choices[0].message.content
-            
-            # Format response
-            formatted_response = format_response(ai_response)
-            
+                await self._before_retry(e, attempt)
+
+    def _coalesce_key(self, message: str, interest_level: str, kwargs: Dict[str, Any],
+                      history: Optional[ConversationWindow] = None) -> Tuple[Any, ...]:
+        sampling = (kwargs["model"], kwargs["temperature"], kwargs["max_tokens"])
+        if LLM_COALESCE == "message":
+            return (interest_level, ResponseCache.normalize(message), history.render() if history else "") + sampling
+        return (json.dumps(kwargs["messages"], ensure_ascii=False),) + sampling
+
+    async def _complete_coalesced(self, message: str, contact: Optional[Contact], interest_level: str,
+                                  kwargs: Dict[str, Any], timings: Dict[str, Any],
+                                  history: Optional[ConversationWindow] = None) -> Tuple[Any, bool]:
+        """
+        _complete, sharing one call among concurrent identical requests (LLM_COALESCE).
+        
+        Returns the response and whether it came from a call made for another request.
+        """
+        if LLM_COALESCE not in ("exact", "message"):
+            return await self._complete(kwargs, timings), False
+        
+        # Read now: the contact may be detached by the time other requests look at it
+        requester = (contact.id if contact is not None else None, self._contact_names(contact))
+        
+        async def call():
+            return await self._complete(kwargs, timings), requester
+        
+        (response, (owner_id, owner_names)), shared = await self.single_flight.do(
+            self._coalesce_key(message, interest_level, kwargs, history), call
+        )
+        if not shared:
+            return response, False
+        # "message" keys ignore the contact block of the prompt: a reply addressed to someone else is not reused
+        if LLM_COALESCE == "message" and owner_id != requester[0] \
+                and self._mentions(response.choices[0].message.content or "", owner_names):
+            return await self._complete(kwargs, timings), False
+        metrics.increment("llm.coalesced")
+        timings["coalesced"] = True
+        return response, True
+
+    def _error_result(self, e: Exception) -> Dict[str, Any]:
+        """Fallback answer for an error raised while calling the LLM."""
+        if isinstance(e, CircuitOpen):
+            logger.warning(f"LLM call skipped: {str(e)}")
             return {
-                'success': True,
-                'response': formatted_response,
-                'contact_id': contact.id if contact else None
+                'success': False,
+                'error': 'LLM circuit open',
+                'response': self._predefined_response("contacto")
             }
-            
-        except RateLimitError as e:
+        if isinstance(e, LLMOverloaded):
+            logger.warning(f"LLM call shed: {str(e)}")
+            return {
+                'success': False,
+                'error': 'LLM overloaded',
+                'response': 'Estamos atendiendo muchos mensajes en este momento. Te respondo en unos minutos o, si prefieres, llámanos al 5535913417.'
+            }
+        if getattr(e, 'status_code', None) == 501:
+            logger.error(f"HTTP 501 error calling LLM API: {str(e)}", exc_info=True)
+            return {
+                'success': False,
+                'error': 'HTTP 501 error',
+                'response': 'Lo siento, estamos experimentando problemas temporales con nuestro servicio de IA. Por favor, inténtalo de nuevo más tarde.'
+            }
+        if isinstance(e, RateLimitError):
             logger.error(f"Rate limit error: {e}")
             return {
                 'success': False,
                 'error': str(e),
                 'response': 'Demasiadas solicitudes. Por favor, inténtalo de nuevo en unos momentos.'
             }
-        except APIError as e:
+        if isinstance(e, (APIError, LLMTimeout)):
             logger.error(f"OpenAI API error: {e}")
             return {
                 'success': False,
                 'error': str(e),
                 'response': 'Lo siento, estoy experimentando dificultades técnicas. Por favor, inténtalo de nuevo más tarde o comunícate al 5535913417.'
             }
+        logger.error(f"Unexpected error generating response: {e}", exc_info=True)
+        return {
+            'success': False,
+            'error': str(e),
+            'response': 'Lo siento, ha ocurrido un error inesperado. Por favor, comunícate al 5535913417 para obtener asistencia.'
+        }
+
+    def _no_client_result(self) -> Dict[str, Any]:
+        logger.warning("LLM client not initialized - using fallback response")
+        return {
+            'success': False,
+            'error': 'LLM client not initialized',
+            'response': 'Lo siento, el servicio de IA no está disponible en este momento. Por favor, comunícate al 5535913417 para obtener asistencia.'
+        }
+
+    async def generate_response(self, message: str, contact: Optional[Contact] = None,
+                                context_prefetch: Optional[ContextPrefetch] = None,
+                                signals: Optional[MessageSignals] = None,
+                                history: Optional[ConversationWindow] = None) -> Dict[str, Any]:
+        """
+        Generate AI response for incoming message.
+        
+        Args:
+            message: Incoming message text
+            contact: Contact object (optional)
+            context_prefetch: Retrieval started with prefetch_context (started here if omitted)
+            signals: message_classifier.classify(message), if the caller already has it
+            history: Earlier messages of the conversation (conversation_history.build)
+            
+        Returns:
+            Dict with response, metadata and per-stage timings (ms)
+        """
+        started = time.perf_counter()
+        timings: Dict[str, Any] = {}
+        if context_prefetch is None:
+            context_prefetch = self.prefetch_context(message)
+        
+        try:
+            # Check for specific keywords that require predefined responses
+            stage = time.perf_counter()
+            response = self._check_predefined_responses(message, contact, signals)
+            timings["predefined_ms"] = (time.perf_counter() - stage) * 1000
+            if response:
+                return self._success_result(response, contact, timings, started)
+            
+            interest_level = self._interest_level(contact)
+            response, vector = await self._cached_reply(message, interest_level, timings, history)
+            if response is not None:
+                return self._success_result(response, contact, timings, started)
+            
+            if not self.client:
+                return self._no_client_result()
+            
+            # While the provider is failing, answer right away without building the prompt
+            self.circuit_breaker.check()
+            
+            # Generate response using LLM
+            kwargs, prompt_tokens = await self._prepare_prompt(message, contact, context_prefetch, timings, history,
+                                                               signals)
+            stage = time.perf_counter()
+            response, shared = await self._complete_coalesced(message, contact, interest_level, kwargs, timings, history)
+            timings["llm_ms"] = (time.perf_counter() - stage) * 1000
+            
+            # Format response
+            formatted_response = format_response(response.choices[0].message.content)
+            if shared:
+                # Tokens and cache entry belong to the request that made the call
+                return self._success_result(formatted_response, contact, timings, started)
+            self._cache_reply(message, contact, interest_level, formatted_response, vector, timings, history)
+            return self._success_result(formatted_response, contact, timings, started, prompt_tokens, response)
+            
         except Exception as e:
-            logger.error(f"Unexpected error generating response: {e}", exc_info=True)
-            return {
-                'success': False,
-                'error': str(e),
-                'response': 'Lo siento, ha ocurrido un error inesperado. Por favor, comunícate al 5535913417 para obtener asistencia.'
-            }
+            return self._error_result(e)
+
+    async def generate_response_stream(self, message: str, contact: Optional[Contact] = None,
+                                       context_prefetch: Optional[ContextPrefetch] = None,
+                                       signals: Optional[MessageSignals] = None,
+                                       history: Optional[ConversationWindow] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of generate_response.
+        
+        Yields {"type": "delta", "text": ...} events as the completion arrives
+        (asterisks removed, like format_response) and ends with one
+        {"type": "done", ...} event carrying the same dict generate_response
+        returns. Its 'response' is the final text and replaces the deltas if
+        the call failed halfway. Timings include ttfb_ms (message received to
+        first text) and llm_ttfb_ms (request sent to first token).
+        """
+        started = time.perf_counter()
+        timings: Dict[str, Any] = {}
+        if context_prefetch is None:
+            context_prefetch = self.prefetch_context(message)
+        
+        try:
+            stage = time.perf_counter()
+            response = self._check_predefined_responses(message, contact, signals)
+            timings["predefined_ms"] = (time.perf_counter() - stage) * 1000
+            if response:
+                timings["ttfb_ms"] = (time.perf_counter() - started) * 1000
+                yield {"type": "delta", "text": response}
+                yield {"type": "done", **self._success_result(response, contact, timings, started)}
+                return
+            
+            interest_level = self._interest_level(contact)
+            response, vector = await self._cached_reply(message, interest_level, timings, history)
+            if response is not None:
+                timings["ttfb_ms"] = (time.perf_counter() - started) * 1000
+                yield {"type": "delta", "text": response}
+                yield {"type": "done", **self._success_result(response, contact, timings, started)}
+                return
+            
+            if not self.client:
+                result = self._no_client_result()
+                yield {"type": "delta", "text": result["response"]}
+                yield {"type": "done", **result}
+                return
+            
+            self.circuit_breaker.check()
+            
+            kwargs, prompt_tokens = await self._prepare_prompt(message, contact, context_prefetch, timings, history,
+                                                               signals)
+            stage = time.perf_counter()
+            parts: List[str] = []
+            usage_chunk = None
+            attempt = 0
+            while True:
+                attempt += 1
+                timings["attempts"] = attempt
+                try:
+                    async with self.circuit_breaker.call(), await self.limiter.acquire(timings) as slot:
+                        stream = await self._attempt(self.client.chat.completions.create(
+                            **kwargs, stream=True, stream_options={"include_usage": True},
+                            # Bounds the wait for each chunk once the stream has started
+                            timeout=self.retry_policy.timeout_ms / 1000
+                        ))
+                        # Closes the connection if the caller stops reading early
+                        async with stream:
+                            async for chunk in stream:
+                                # With include_usage the last chunk has usage and no choices
+                                if getattr(chunk, "usage", None) is not None:
+                                    usage_chunk = chunk
+                                if not chunk.choices:
+                                    continue
+                                text = (chunk.choices[0].delta.content or "").replace('*', '')
+                                if not parts:
+                                    text = text.lstrip()
+                                if not text:
+                                    continue
+                                if not parts:
+                                    slot.mark_first_token()
+                                    now = time.perf_counter()
+                                    timings["llm_ttfb_ms"] = (now - stage) * 1000
+                                    timings["ttfb_ms"] = (now - started) * 1000
+                                parts.append(text)
+                                yield {"type": "delta", "text": text}
+                    break
+                except Exception as e:
+                    # Text already sent cannot be taken back: retry only before the first delta
+                    if parts or not self.retry_policy.should_retry(e, attempt):
+                        raise
+                    await self._before_retry(e, attempt)
+            timings["llm_ms"] = (time.perf_counter() - stage) * 1000
+            
+            formatted_response = format_response("".join(parts))
+            self._cache_reply(message, contact, interest_level, formatted_response, vector, timings, history)
+            yield {"type": "done", **self._success_result(formatted_response, contact, timings, started,
+                                                          prompt_tokens, usage_chunk)}
+            
+        except Exception as e:
+            yield {"type": "done", **self._error_result(e)}
     
-    def _check_predefined_responses(self, message: str, contact: Optional[Contact] = None) -> Optional[str]:
+    async def summarize_history(self, request: SummaryRequest) -> Optional[str]:
+        """
+        Fold the messages of request into the conversation summary with the
+        light model (ConversationWindow.summary_request).
+        
+        Returns the new summary, or None if the LLM is unavailable or fails;
+        the messages then stay pending and are summarized on a later turn.
+        """
+        if not self.client:
+            return None
+        model = self.router.light_model or QWEN_MODEL
+        timings: Dict[str, Any] = {"model": model}
+        try:
+            stage = time.perf_counter()
+            response = await self._complete({
+                "model": model,
+                "messages": request.messages(),
+                "temperature": 0.2,
+                "max_tokens": request.max_tokens
+            }, timings)
+            timings["llm_ms"] = (time.perf_counter() - stage) * 1000
+        except Exception as e:
+            logger.warning(f"Could not summarize the conversation history: {str(e)}")
+            metrics.increment("llm.history_summary.errors")
+            return None
+        self._record_model(timings, self._record_usage(response))
+        metrics.increment("llm.history_summary.calls")
+        summary = " ".join((response.choices[0].message.content or "").split())
+        return summary or None
+    
+    def reload_knowledge(self, knowledge: Optional[Dict[str, Any]] = None):
+        """
+        Use new workshop knowledge, or pick up in-place edits of the current one.
+        
+        The keyword rules built from it (objections, roles) are recompiled.
+        """
+        if knowledge is not None:
+            self.workshop_knowledge = knowledge
+        self.knowledge_version += 1
+        message_classifier.reload(self.workshop_knowledge)
+
+    def _build_messages(self, interest_level: str, user_prompt: str) -> List[Dict[str, Any]]:
+        """
+        Chat messages for a call: the static system prefix first, then the
+        interest level strategy, then the user prompt.
+        
+        With LLM_PROMPT_CACHE=explicit the prefix is marked with cache_control
+        (DashScope explicit context cache); otherwise the provider's implicit
+        prefix cache applies on its own, as the prefix never changes.
+        """
+        static, strategy, _ = self.system_prompt_parts(interest_level)
+        if LLM_PROMPT_CACHE == "explicit":
+            system_content: Any = [
+                {"type": "text", "text": static, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": strategy}
+            ]
+        else:
+            system_content = static + strategy
+        return [
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _record_usage(self, response: Any) -> Optional[Dict[str, int]]:
+        """Token usage reported by the provider, split into cached/uncached prompt tokens."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return None
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        result = {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "uncached_tokens": prompt_tokens - cached_tokens,
+            "completion_tokens": getattr(usage, "completion_tokens", None) or 0
+        }
+        # Explicit cache: tokens written to the cache by this call
+        created = getattr(details, "cache_creation_input_tokens", None) if details is not None else None
+        if created:
+            result["cache_creation_tokens"] = created
+        for name, value in result.items():
+            metrics.increment(f"llm.usage.{name}", value)
+        return result
+
+    def _check_predefined_responses(self, message: str, contact: Optional[Contact] = None,
+                                    signals: Optional[MessageSignals] = None) -> Optional[str]:
         """
         Check for keywords that require predefined responses.
         
+        The first matching rule (in PREDEFINED_KEYWORDS order) that has an
+        answer wins.
+        
         Args:
             message: Incoming message text
             contact: Contact object (optional)
+            signals: message_classifier result for message, if already computed
             
         Returns:
             Predefined response or None
         """
-        message_lower = message.lower()
+        if message_classifier.knowledge is not self.workshop_knowledge:
+            message_classifier.reload(self.workshop_knowledge)
+            signals = None
+        if signals is None:
+            signals = message_classifier.classify(message)
+        for rule in signals.predefined:
+            response = self._predefined_response(rule)
+            if response:
+                return response
+        return None
+
+    def _predefined_response(self, rule: str) -> Optional[str]:
+        """Answer for a matched predefined response rule, or None if it has none."""
+        contacto = self.workshop_knowledge['detalles_contacto']
 
         # Friendly greeting for first-contact style
-        greeting_keywords = [
-            "hola", "buenas", "buen dia", "buen día", "que tal", "qué tal", "hey", "hi", "saludos"
-        ]
-        if any(gk in message_lower for gk in greeting_keywords):
+        if rule == "saludo":
             return "¡Hola! 👋 Soy SCAI, tu asistente de IA. ¿Quieres que tu equipo trabaje más eficiente? Te ayudo a automatizar tareas en minutos. ¿De qué área es tu equipo?"
         
-        # Contact information keywords
-        contact_keywords = [
-            "humano", "persona", "asesor", "cotizacion", "cotización", 
-            "precio específico", "precio personalizado", "hablar con alguien"
-        ]
-        
-        if any(keyword in message_lower for keyword in contact_keywords):
-            return f"Perfecto, te conecto con un experto. 📞 Llama al {self.workshop_knowledge['detalles_contacto']['telefono']} o agenda una llamada gratuita aquí: {self.workshop_knowledge['detalles_contacto']['calendly']}"
-        
-        # Scheduling keywords
-        schedule_keywords = [
-            "agendar", "cita", "llamada", "reunión", "consultoría", 
-            "sesión", "entrevista", "conversar"
-        ]
-        
-        if any(keyword in message_lower for keyword in schedule_keywords):
-            return f"¡Genial! 📅 Agenda tu llamada gratuita de 15 minutos aquí: {self.workshop_knowledge['detalles_contacto']['calendly']}. ¿A qué hora te viene mejor?"
+        # Contact information
+        if rule == "contacto":
+            return f"Perfecto, te conecto con un experto. 📞 Llama al {contacto['telefono']} o agenda una llamada gratuita aquí: {contacto['calendly']}"
         
-        # Website keywords
-        website_keywords = [
-            "más información", "detalles", "sitio web", "página web", 
-            "información adicional", "ver más"
-        ]
+        # Scheduling
+        if rule == "agendar":
+            return f"¡Genial! 📅 Agenda tu llamada gratuita de 15 minutos aquí: {contacto['calendly']}. ¿A qué hora te viene mejor?"
         
-        if any(keyword in message_lower for keyword in website_keywords):
-            return f"Te dejo más info en: {self.workshop_knowledge['detalles_contacto']['sitio_web']}. ¿Hay algo específico que te interese saber?"
+        # Website
+        if rule == "sitio_web":
+            return f"Te dejo más info en: {contacto['sitio_web']}. ¿Hay algo específico que te interese saber?"
         
         # Objection handling (concise)
-        objs = self.workshop_knowledge.get("objecciones", {})
-        for key, cfg in objs.items():
-            if any(k in message_lower for k in cfg.get("keywords", [])):
-                return cfg.get("respuesta")
+        if rule.startswith("objecion:"):
+            cfg = self.workshop_knowledge.get("objecciones", {}).get(rule.split(":", 1)[1], {})
+            return cfg.get("respuesta")
 
         # Role-based quick value hints
-        roles = self.workshop_knowledge.get("casos_uso_por_rol", {})
-        for role, ideas in roles.items():
-            if role in message_lower:
-                top = ", ".join(ideas[:2])
-                return f"Para {role}: {top}. ¿Cuál te ayudaría más esta semana?"
+        if rule.startswith("rol:"):
+            role = rule.split(":", 1)[1]
+            ideas = self.workshop_knowledge.get("casos_uso_por_rol", {}).get(role, [])
+            top = ", ".join(ideas[:2])
+            return f"Para {role}: {top}. ¿Cuál te ayudaría más esta semana?"
 
         # Daily tasks examples when user asks "para qué" or similar
-        if any(k in message_lower for k in ["para que", "para qué", "como me ayuda", "tareas", "diario", "cotidianas"]):
+        if rule == "tareas":
             tareas = self.workshop_knowledge.get("tareas_diarias_ejemplos", [])
             if tareas:
                 return f"Ejemplos rápidos: {tareas[0]}, {tareas[1]}. ¿Cuál haces más seguido?"
+            return None
 
         # Free tools recommendations
-        if any(k in message_lower for k in ["gratis", "free", "herramientas", "empiezo", "comenzar"]):
+        if rule == "herramientas":
             tools = self.workshop_knowledge.get('herramientas_gratuitas', {})
             texto = ", ".join(tools.get('texto', [])[:2]) if isinstance(tools.get('texto', []), list) else "ChatGPT o Claude"
             auto = ", ".join(tools.get('automatizacion', [])[:1]) if isinstance(tools.get('automatizacion', []), list) else "Make/Zapier"
             return f"Empieza con {texto} y {auto}. En 2h te dejo 2–3 flujos listos. ¿Texto o automatizar primero?"
 
         # Models guidance
-        if any(k in message_lower for k in ["modelos", "chatgpt", "claude", "mistral", "gemini"]):
+        if rule == "modelos":
             return "Todos sirven; lo importante es tu flujo. Vemos tu caso y elegimos el modelo. ¿Qué tarea quieres resolver primero?"
 
         # Trends: RAG, vision
-        if any(k in message_lower for k in ["rag", "documentos", "pdf", "visión", "vision", "imagenes", "imágenes", "ocr"]):
+        if rule == "tendencias":
             t = self.workshop_knowledge.get('temas_tendencia', {})
             rag = t.get('rag', 'conectar tus documentos a la IA (RAG)')
             vis = t.get('vision', 'analizar imágenes y PDFs')
             return f"Hacemos {rag} y {vis} con plantillas simples. ¿Docs o imágenes primero?"
 
         # Prompt tips
-        if any(k in message_lower for k in ["prompt", "prompts", "mejores prompts", "como pedir", "cómo pedir"]):
+        if rule == "prompts":
             tips = self.workshop_knowledge.get('consejos_prompts', [])
             if tips:
                 return f"Tip rápido: {tips[0]}. ¿Quieres ejemplos para tu caso?"
 
         return None
     
+    def _prompt_fingerprint(self) -> Tuple[Any, ...]:
+        """Everything the system prompt depends on besides the interest level."""
+        return (self.agent_name, self.agent_personality, self.agent_tone, self.agent_goal,
+                id(self.workshop_knowledge), self.knowledge_version)
+
+    def system_prompt_parts(self, interest_level: str = InterestLevel.NEW.value) -> Tuple[str, str, int]:
+        """
+        (static prefix, interest level strategy, estimated tokens) of the system prompt.
+        
+        The prefix is the same for every contact and interest level, so it is
+        sent first and byte-identical on every call (provider prompt caching
+        matches on it). Both parts are rendered once and reused until an agent
+        setting or the workshop knowledge changes (reload_knowledge).
+        """
+        fingerprint = self._prompt_fingerprint()
+        if fingerprint != self._system_prompts_fingerprint:
+            self._static_prompt = self._render_static_prompt()
+            self._system_prompts = {}
+            self._system_prompts_fingerprint = fingerprint
+        cached = self._system_prompts.get(interest_level)
+        if cached is None:
+            strategy = self._persuasion_strategy(interest_level)
+            tokens = estimate_tokens(self._static_prompt + strategy)
+            cached = self._system_prompts[interest_level] = (self._static_prompt, strategy, tokens)
+        return cached
+
+    def system_prompt(self, interest_level: str = InterestLevel.NEW.value) -> Tuple[str, int]:
+        """System prompt for an interest level (InterestLevel value) and its estimated token count."""
+        static, strategy, tokens = self.system_prompt_parts(interest_level)
+        return static + strategy, tokens
+
     def _create_system_prompt(self, contact: Optional[Contact] = None) -> str:
         """Create system prompt for the AI agent with enhanced persuasion strategy."""
-        # Determine contact's interest level for contextual responses
-        interest_level = "nuevo"
+        return self.system_prompt(self._interest_level(contact))[0]
+
+    @staticmethod
+    def _interest_level(contact: Optional[Contact]) -> str:
+        """Contact's interest level value, "nuevo" when unknown."""
         if contact and contact.interest_level:
-            interest_level = contact.interest_level.value
-            
+            return contact.interest_level.value
+        return InterestLevel.NEW.value
+
+    def _persuasion_strategy(self, interest_level: str) -> str:
+        """Part of the system prompt that depends on the interest level (InterestLevel value)."""
         # Define persuasion strategy based on interest level - FLUJO NATURAL
         persuasion_strategy = ""
         if interest_level == "nuevo":  # NEW enum value
@@ -329,7 +930,10 @@ FASE 4 - VALOR SIN PRESIÓN (NO INTERESADO):
 3. MANTÉN RELACIÓN: "Si en el futuro te interesa, aquí estaré"
 4. NO INSISTAS en contacto directo
 """
+        return persuasion_strategy
 
+    def _render_static_prompt(self) -> str:
+        """Part of the system prompt shared by every contact; keep it free of per-call data."""
         return f"""
         Eres {self.agent_name}, un consultor experto en automatización con IA.
 
@@ -360,8 +964,6 @@ FASE 4 - VALOR SIN PRESIÓN (NO INTERESADO):
         ✅ DESPUÉS de ofrecer contacto: "¿Quieres un tip de IA mientras tanto?"
         ✅ Comparte valor gratuito para mantener engagement
 
-        {persuasion_strategy}
-
         INFORMACIÓN DEL WORKSHOP:
         - Título: \"{self.workshop_knowledge['titulo']}\"
         - Beneficio clave: Sin programación, resultados inmediatos
@@ -393,8 +995,9 @@ FASE 4 - VALOR SIN PRESIÓN (NO INTERESADO):
         6. CONSTRUYE RELACIÓN antes de vender
         """
 
-    def _create_user_prompt(self, message: str, contact: Optional[Contact] = None) -> str:
-        """Create user prompt with context."""
+    def _create_user_prompt(self, message: str, contact: Optional[Contact] = None, knowledge_context: str = "",
+                            history: str = "") -> str:
+        """Create user prompt with conversation history, contact info and retrieved knowledge."""
         contact_info = ""
         if contact:
             contact_info = f"""
@@ -405,10 +1008,25 @@ FASE 4 - VALOR SIN PRESIÓN (NO INTERESADO):
             - Nivel de interés: {contact.interest_level.value if contact.interest_level else 'No especificado'}
             """
         
+        knowledge_info = ""
+        if knowledge_context:
+            knowledge_info = f"""
+            Información relevante de la base de conocimiento (úsala solo si aplica, no inventes datos):
+            {knowledge_context}
+            """
+        
+        history_info = ""
+        if history:
+            history_info = f"""
+            {history}
+            """
+        
         return f"""
+        {history_info}
         MENSAJE DEL USUARIO: {message}
         
         {contact_info}
+        {knowledge_info}
         
         Por favor, responde de manera profesional y amigable, siguiendo las instrucciones proporcionadas.
         Considera el nivel de interés del contacto para personalizar tu enfoque de persuasión.
@@ -0,0 +1,114 @@
+import threading
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from .keyword_matcher import KeywordMatcher, tokenize
+from .workshop_knowledge import workshop_knowledge_instance
+
+# Keyword rules for predefined responses, in priority order. "objecciones"
+# stands for the objection and role rules taken from the workshop knowledge.
+PREDEFINED_KEYWORDS: List[Tuple[str, List[str]]] = [
+    ("saludo", ["hola", "buenas", "buen dia", "buen día", "que tal", "qué tal", "hey", "hi", "saludos"]),
+    ("contacto", ["humano", "persona", "asesor", "cotizacion", "cotización",
+                  "precio específico", "precio personalizado", "hablar con alguien"]),
+    ("agendar", ["agendar", "cita", "llamada", "reunión", "consultoría",
+                 "sesión", "entrevista", "conversar"]),
+    ("sitio_web", ["más información", "detalles", "sitio web", "página web",
+                   "información adicional", "ver más"]),
+    ("objecciones", []),
+    ("tareas", ["para que", "para qué", "como me ayuda", "tareas", "diario", "cotidianas"]),
+    ("herramientas", ["gratis", "free", "herramientas", "empiezo", "comenzar"]),
+    ("modelos", ["modelos", "chatgpt", "claude", "mistral", "gemini"]),
+    ("tendencias", ["rag", "documentos", "pdf", "visión", "vision", "imagenes", "imágenes", "ocr"]),
+    ("prompts", ["prompt", "prompts", "mejores prompts", "como pedir", "cómo pedir"]),
+]
+
+# Interest signals used to update Contact.interest_level
+INTEREST_KEYWORDS: List[Tuple[str, List[str]]] = [
+    # User explicitly shows interest
+    ("interes_fuerte", [
+        "interesado", "interesada", "interesados", "interesadas", "quiero", "necesito", "me gusta", "me gustaría",
+        "agendar", "cita", "llamada", "información", "detalles",
+        "precio", "costo", "cuanto", "cuánto", "presupuesto",
+        "cotización", "cotizacion", "contactar", "asesor",
+        "demo", "demostración", "prueba", "muestra", "más info",
+        "más información", "hablar", "charlar", "platica", "platicar"
+    ]),
+    # User shows curiosity or asks specific questions
+    ("interes_medio", [
+        "como funciona", "cómo funciona", "cómo funcionaría", "que incluye", "qué incluye",
+        "duracion", "duración", "tiempo", "cuanto tiempo", "cuánto tiempo",
+        "modalidad", "online", "presencial", "híbrido", "híbrida",
+        "equipo", "personas", "participantes", "empresa",
+        "resultados", "beneficios", "ventajas", "ayuda",
+        "automatizar", "procesos", "tareas", "eficiente"
+    ]),
+    # User shows disinterest
+    ("negativo", [
+        "no", "no gracias", "no estoy interesado", "no me interesa",
+        "ocupado", "después", "otro momento", "no ahora",
+        "caro", "muy caro", "costoso", "muy costoso",
+        "no puedo", "no es posible", "no tengo"
+    ]),
+    # User asks for a phone number
+    ("pide_telefono", ["teléfono", "telefono", "número", "numero", "whatsapp"]),
+]
+
+INTEREST_CLASSES = frozenset(name for name, _ in INTEREST_KEYWORDS)
+
+
+class MessageSignals:
+    """Classes found in one message: predefined response rules and interest signals."""
+
+    def __init__(self, tokens: Tuple[str, ...], matches: List[str]):
+        self.tokens = tokens
+        # Rule names in priority order
+        self.matches = matches
+        self.classes: FrozenSet[str] = frozenset(matches)
+
+    @property
+    def predefined(self) -> List[str]:
+        """Matched predefined response rules, highest priority first."""
+        return [name for name in self.matches if name not in INTEREST_CLASSES]
+
+    def has(self, name: str) -> bool:
+        return name in self.classes
+
+
+class MessageClassifier:
+    """
+    Tokenizes a message once and matches every keyword rule (predefined
+    responses and interest signals) against it.
+
+    The rules are compiled when the classifier is created and again only
+    on reload(), which must be called after the workshop knowledge changes.
+    """
+
+    def __init__(self, knowledge: Dict[str, Any]):
+        self._lock = threading.Lock()
+        self.reload(knowledge)
+
+    def reload(self, knowledge: Optional[Dict[str, Any]] = None):
+        """Recompile the rules from knowledge (or the current knowledge, edited in place)."""
+        with self._lock:
+            if knowledge is not None:
+                self.knowledge = knowledge
+            rules: List[Tuple[str, Sequence[str]]] = []
+            for name, keywords in PREDEFINED_KEYWORDS:
+                if name == "objecciones":
+                    # Objections and roles keep their place in the priority order
+                    for key, cfg in self.knowledge.get("objecciones", {}).items():
+                        rules.append((f"objecion:{key}", cfg.get("keywords", [])))
+                    for role in self.knowledge.get("casos_uso_por_rol", {}):
+                        rules.append((f"rol:{role}", [role]))
+                else:
+                    rules.append((name, keywords))
+            rules.extend(INTEREST_KEYWORDS)
+            self._matcher = KeywordMatcher(rules)
+
+    def classify(self, message: str) -> MessageSignals:
+        tokens = tokenize(message)
+        return MessageSignals(tokens, self._matcher.match(tokens))
+
+
+# Built once at import; shared by llm_service and omnipotent_agent
+message_classifier = MessageClassifier(workshop_knowledge_instance)
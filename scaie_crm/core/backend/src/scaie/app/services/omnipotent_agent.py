@@ -4,18 +4,23 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import re
+import time
+import asyncio
 import logging
-from typing import Dict, List, Any, Optional, cast
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, cast
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, func
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel
 
 from ..core.database import get_db
+from ..core.metrics import metrics
 from ..models.contact import Contact, InterestLevel, PlatformType
 from ..models.conversation import Conversation, Message
 from ..models.agent_action import AgentAction, AgentTask
-from ..services.llm_service import llm_service
+from ..services.llm_service import llm_service, ContextPrefetch
+from ..services.conversation_history import conversation_history, ConversationWindow
+from ..services.message_classifier import message_classifier, MessageSignals
 from ..services.scaie_knowledge import scaie_knowledge
 from ..services.workshop_knowledge import workshop_knowledge_instance
 from ..api.endpoints.contacts import ContactCreate
@@ -37,54 +42,32 @@ class OmnipotentAgent:
         """
         Process an incoming message and determine appropriate actions.
         """
+        # Knowledge retrieval runs in the RAG pool while the contact and messages are loaded/saved
+        context_prefetch = self.llm_service.prefetch_context(message)
+        # Tokenized and classified once for the predefined responses and the interest update
+        signals = message_classifier.classify(message)
+        
         created_session = False
         if db is None:
             db_gen = get_db()
             db = next(db_gen)
             created_session = True
         
-        user_message = None
-        ai_message = None
-        
         try:
-            # Get or create contact
-            contact = self._get_or_create_contact(db, contact_info, platform)
-            logger.info(f"Contact created/retrieved: ID {contact.id}")
-            
-            # Create or get conversation
-            conversation = self._get_or_create_conversation(db, contact.id, platform)  # type: ignore[arg-type]
-            logger.info(f"Conversation created/retrieved: ID {conversation.id}")
-            
-            # Save user message
-            try:
-                user_message = self._save_message(db, conversation.id, contact.id, "user", message)  # type: ignore[arg-type]
-                logger.info(f"User message saved: ID {user_message.id}")
-            except SQLAlchemyError as e:
-                logger.error(f"Database error saving user message: {str(e)}")
-                db.rollback()
-                # Continue anyway since we can still generate a response
+            contact, conversation, history = self._start_turn(db, message, contact_info, platform)
+            # The light model folds older messages into the summary while the response is generated
+            summary_task = self._start_summary(history)
             
             # Generate response using LLM
             try:
-                response_text = await self._generate_response(db, message, contact, conversation)
+                response_text = await self._generate_response(db, message, contact, conversation, context_prefetch,
+                                                              signals, history)
             except Exception as e:
                 logger.error(f"Error generating response: {str(e)}", exc_info=True)
                 response_text = "Lo siento, estoy teniendo dificultades técnicas. Por favor, inténtalo de nuevo más tarde."
                 
-            # Save agent (AI) response
-            try:
-                # Use consistent sender label 'agent' across the codebase
-                ai_message = self._save_message(db, conversation.id, contact.id, "agent", response_text)  # type: ignore[arg-type]
-                logger.info(f"AI message saved: ID {ai_message.id}")
-            except SQLAlchemyError as e:
-                logger.error(f"Database error saving AI message: {str(e)}")
-                db.rollback()
-            
-            # Update contact interest level based on conversation
-            try:
-                self._update_contact_interest(db, contact, message, response_text)
-            except Exception as e:
-                logger.error(f"Error updating contact interest: {str(e)}")
+            ai_message = self._finish_turn(db, contact, conversation, message, response_text, signals)
+            await self._save_summary(db, conversation, history, summary_task)
             
             return {
                 "response": response_text,
@@ -108,6 +91,151 @@ class OmnipotentAgent:
                 except:
                     pass
     
+    async def process_incoming_message_stream(self, message: str, platform: str, contact_info: Dict[str, Any],
+                                              db: Optional[Session] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of process_incoming_message.
+        
+        Yields the {"type": "delta", "text": ...} events of
+        llm_service.generate_response_stream. Once the stream completes the
+        agent message is saved and the interest level updated, then a final
+        {"type": "done", "response", "contact_id", "message_id", "timings"}
+        event is yielded. If the consumer stops early nothing is saved.
+        """
+        started = time.perf_counter()
+        context_prefetch = self.llm_service.prefetch_context(message)
+        signals = message_classifier.classify(message)
+        
+        created_session = False
+        if db is None:
+            db_gen = get_db()
+            db = next(db_gen)
+            created_session = True
+        
+        try:
+            contact, conversation, history = self._start_turn(db, message, contact_info, platform)
+            summary_task = self._start_summary(history)
+            
+            result: Dict[str, Any] = {}
+            first_delta = True
+            async for event in self.llm_service.generate_response_stream(message, contact, context_prefetch, signals,
+                                                                         history):
+                if event["type"] == "delta":
+                    if first_delta:
+                        metrics.observe("agent.stream_ttfb_ms", (time.perf_counter() - started) * 1000)
+                        first_delta = False
+                    yield event
+                else:
+                    result = event
+            if not result.get("success"):
+                logger.error(f"LLM service error: {result.get('error')}")
+            response_text = result.get("response") or "Lo siento, estoy teniendo dificultades técnicas. Por favor, inténtalo de nuevo más tarde."
+            
+            ai_message = self._finish_turn(db, contact, conversation, message, response_text, signals)
+            await self._save_summary(db, conversation, history, summary_task)
+            metrics.observe("agent.stream_total_ms", (time.perf_counter() - started) * 1000)
+            
+            yield {
+                "type": "done",
+                "response": response_text,
+                "contact_id": contact.id,
+                "message_id": ai_message.id if ai_message else None,
+                "timings": result.get("timings", {})
+            }
+            
+        except Exception as e:
+            logger.error(f"Error processing incoming message: {str(e)}")
+            raise
+        finally:
+            if created_session:
+                try:
+                    db.close()
+                except:
+                    pass
+    
+    def _start_turn(self, db: Session, message: str, contact_info: Dict[str, Any],
+                    platform: str) -> Tuple[Contact, Conversation, ConversationWindow]:
+        """
+        Load or create the contact and conversation, save the user message and
+        load the conversation history that precedes it.
+        """
+        # Get or create contact
+        contact = self._get_or_create_contact(db, contact_info, platform)
+        logger.info(f"Contact created/retrieved: ID {contact.id}")
+        
+        # Create or get conversation
+        conversation = self._get_or_create_conversation(db, contact.id, platform)  # type: ignore[arg-type]
+        logger.info(f"Conversation created/retrieved: ID {conversation.id}")
+        
+        # Save user message
+        user_message_id = None
+        try:
+            user_message = self._save_message(db, conversation.id, contact.id, "user", message)  # type: ignore[arg-type]
+            user_message_id = user_message.id
+            logger.info(f"User message saved: ID {user_message.id}")
+        except SQLAlchemyError as e:
+            logger.error(f"Database error saving user message: {str(e)}")
+            db.rollback()
+            # Continue anyway since we can still generate a response
+        
+        try:
+            history = conversation_history.build(db, conversation, before_id=user_message_id)
+        except SQLAlchemyError as e:
+            logger.error(f"Database error loading conversation history: {str(e)}")
+            db.rollback()
+            return contact, conversation, ConversationWindow()
+        
+        try:
+            if db.is_modified(conversation):
+                # Messages that left the history window, pending summarization
+                db.commit()
+        except SQLAlchemyError as e:
+            # Not saved: the same messages leave the window again next turn
+            logger.error(f"Database error saving conversation history: {str(e)}")
+            db.rollback()
+        return contact, conversation, history
+    
+    def _start_summary(self, history: ConversationWindow) -> Optional[asyncio.Future]:
+        """Start summarizing the messages that left the history window, if enough are pending."""
+        if history.summary_request is None:
+            return None
+        return asyncio.ensure_future(self.llm_service.summarize_history(history.summary_request))
+    
+    async def _save_summary(self, db: Session, conversation: Conversation, history: ConversationWindow,
+                            summary_task: Optional[asyncio.Future]):
+        """Store the summary started by _start_summary in the conversation once it is ready."""
+        if summary_task is None:
+            return
+        summary = await summary_task
+        if not summary:
+            return
+        try:
+            conversation_history.apply_summary(conversation, summary, history.summary_request.through_id)
+            db.commit()
+        except SQLAlchemyError as e:
+            # Not saved: the messages stay pending and are summarized on a later turn
+            logger.error(f"Database error saving the conversation summary: {str(e)}")
+            db.rollback()
+    
+    def _finish_turn(self, db: Session, contact: Contact, conversation: Conversation, message: str,
+                     response_text: str, signals: Optional[MessageSignals] = None) -> Optional[Message]:
+        """Save the agent response and update the contact's interest level."""
+        ai_message = None
+        try:
+            # Use consistent sender label 'agent' across the codebase
+            ai_message = self._save_message(db, conversation.id, contact.id, "agent", response_text)  # type: ignore[arg-type]
+            logger.info(f"AI message saved: ID {ai_message.id}")
+        except SQLAlchemyError as e:
+            logger.error(f"Database error saving AI message: {str(e)}")
+            db.rollback()
+        
+        # Update contact interest level based on conversation
+        try:
+            self._update_contact_interest(db, contact, message, response_text, signals)
+        except Exception as e:
+            logger.error(f"Error updating contact interest: {str(e)}")
+        return ai_message
+    
     def _get_or_create_contact(self, db: Session, contact_info: Dict[str, Any], platform: str) -> Contact:
         """
         Get existing contact or create a new one based on platform-specific identifiers.
@@ -258,7 +386,10 @@ class OmnipotentAgent:
         db.refresh(message)
         return message
     
-    async def _generate_response(self, db: Session, message: str, contact: Contact, conversation: Conversation) -> str:
+    async def _generate_response(self, db: Session, message: str, contact: Contact, conversation: Conversation,
+                                 context_prefetch: Optional[ContextPrefetch] = None,
+                                 signals: Optional[MessageSignals] = None,
+                                 history: Optional[ConversationWindow] = None) -> str:
         """
         Generate a response using the LLM service.
         """
@@ -267,7 +398,8 @@ class OmnipotentAgent:
             return "Lo siento, el servicio de IA no está disponible en este momento. Por favor, comunícate al 5535913417 para obtener asistencia."
 
         try:
-            response_data = await llm_service.generate_response(message, contact)
+            response_data = await llm_service.generate_response(message, contact, context_prefetch=context_prefetch,
+                                                                signals=signals, history=history)
             
             if response_data.get("success"):
                 return response_data["response"]
@@ -278,49 +410,24 @@ class OmnipotentAgent:
             logger.error(f"Error generating response: {str(e)}")
             return "Disculpa, estoy teniendo dificultades técnicas. Por favor, inténtalo de nuevo más tarde."
     
-    def _update_contact_interest(self, db: Session, contact: Contact, user_message: str, ai_response: str):
+    def _update_contact_interest(self, db: Session, contact: Contact, user_message: str, ai_response: str,
+                                 signals: Optional[MessageSignals] = None):
         """
         Update contact interest level based on conversation content with enhanced persuasion logic.
         """
-        # Enhanced interest detection with more sophisticated patterns
-        user_message_lower = user_message.lower()
-        
-        # Strong interest signals - user explicitly shows interest
-        strong_interest_keywords = [
-            "interesado", "interesada", "quiero", "necesito", "me gusta", 
-            "agendar", "cita", "llamada", "información", "detalles",
-            "precio", "costo", "cuanto", "cuánto", "presupuesto",
-            "cotización", "cotizacion", "contactar", "asesor",
-            "demo", "demostración", "prueba", "muestra", "más info",
-            "más información", "hablar", "charlar", "platica", "platicar"
-        ]
-        
-        # Medium interest signals - user shows curiosity or asks specific questions
-        medium_interest_keywords = [
-            "como funciona", "cómo funciona", "que incluye", "qué incluye",
-            "duracion", "duración", "tiempo", "cuanto tiempo", "cuánto tiempo",
-            "modalidad", "online", "presencial", "híbrido", "híbrida",
-            "equipo", "personas", "participantes", "empresa",
-            "resultados", "beneficios", "ventajas", "ayuda",
-            "automatizar", "procesos", "tareas", "eficiente"
-        ]
-        
-        # Negative signals - user shows disinterest
-        negative_keywords = [
-            "no", "no gracias", "no estoy interesado", "no me interesa",
-            "ocupado", "después", "otro momento", "no ahora",
-            "caro", "muy caro", "costoso", "muy costoso",
-            "no puedo", "no es posible", "no tengo"
-        ]
+        # Keyword signals (whole words/phrases), shared with the predefined responses
+        if signals is None:
+            signals = message_classifier.classify(user_message)
         
         # Calendly click or phone number request signals
-        calendly_requested = "calendly" in ai_response.lower() or "agendar" in ai_response.lower()
-        phone_requested = any(keyword in user_message_lower for keyword in ["teléfono", "telefono", "número", "numero", "whatsapp"])
+        ai_response_lower = ai_response.lower()
+        calendly_requested = "calendly" in ai_response_lower or "agendar" in ai_response_lower
+        phone_requested = signals.has("pide_telefono")
         
         # Check for explicit interest signals
-        has_strong_interest = any(keyword in user_message_lower for keyword in strong_interest_keywords)
-        has_medium_interest = any(keyword in user_message_lower for keyword in medium_interest_keywords)
-        has_negative_signal = any(keyword in user_message_lower for keyword in negative_keywords)
+        has_strong_interest = signals.has("interes_fuerte")
+        has_medium_interest = signals.has("interes_medio")
+        has_negative_signal = signals.has("negativo")
         
         # Update interest level based on detected signals
         if has_negative_signal and not (has_strong_interest or has_medium_interest):
@@ -663,49 +770,24 @@ async def _generate_response(db: Session, message: str, contact: Contact, conver
         return "Disculpa, estoy teniendo dificultades técnicas. Por favor, inténtalo de nuevo más tarde."
 
 
-async def _update_contact_interest(db: Session, contact: Contact, user_message: str, ai_response: str):
+async def _update_contact_interest(db: Session, contact: Contact, user_message: str, ai_response: str,
+                                   signals: Optional[MessageSignals] = None):
     """
     Update contact interest level based on conversation content with enhanced persuasion logic.
     """
-    # Enhanced interest detection with more sophisticated patterns
-    user_message_lower = user_message.lower()
-    
-    # Strong interest signals - user explicitly shows interest
-    strong_interest_keywords = [
-        "interesado", "interesada", "quiero", "necesito", "me gusta", 
-        "agendar", "cita", "llamada", "información", "detalles",
-        "precio", "costo", "cuanto", "cuánto", "presupuesto",
-        "cotización", "cotizacion", "contactar", "asesor",
-        "demo", "demostración", "prueba", "muestra", "más info",
-        "más información", "hablar", "charlar", "platica", "platicar"
-    ]
-    
-    # Medium interest signals - user shows curiosity or asks specific questions
-    medium_interest_keywords = [
-        "como funciona", "cómo funciona", "que incluye", "qué incluye",
-        "duracion", "duración", "tiempo", "cuanto tiempo", "cuánto tiempo",
-        "modalidad", "online", "presencial", "híbrido", "híbrida",
-        "equipo", "personas", "participantes", "empresa",
-        "resultados", "beneficios", "ventajas", "ayuda",
-        "automatizar", "procesos", "tareas", "eficiente"
-    ]
-    
-    # Negative signals - user shows disinterest
-    negative_keywords = [
-        "no", "no gracias", "no estoy interesado", "no me interesa",
-        "ocupado", "después", "otro momento", "no ahora",
-        "caro", "muy caro", "costoso", "muy costoso",
-        "no puedo", "no es posible", "no tengo"
-    ]
+    # Keyword signals (whole words/phrases), shared with the predefined responses
+    if signals is None:
+        signals = message_classifier.classify(user_message)
     
     # Calendly click or phone number request signals
-    calendly_requested = "calendly" in ai_response.lower() or "agendar" in ai_response.lower()
-    phone_requested = any(keyword in user_message_lower for keyword in ["teléfono", "telefono", "número", "numero", "whatsapp"])
+    ai_response_lower = ai_response.lower()
+    calendly_requested = "calendly" in ai_response_lower or "agendar" in ai_response_lower
+    phone_requested = signals.has("pide_telefono")
     
     # Check for explicit interest signals
-    has_strong_interest = any(keyword in user_message_lower for keyword in strong_interest_keywords)
-    has_medium_interest = any(keyword in user_message_lower for keyword in medium_interest_keywords)
-    has_negative_signal = any(keyword in user_message_lower for keyword in negative_keywords)
+    has_strong_interest = signals.has("interes_fuerte")
+    has_medium_interest = signals.has("interes_medio")
+    has_negative_signal = signals.has("negativo")
     
     # Update interest level based on detected signals
     if has_negative_signal and not (has_strong_interest or has_medium_interest):
@@ -1,79 +1,302 @@
 import os
 import logging
-from typing import List, Dict, Any, Optional
-import json
+from typing import List, Dict, Any, Optional, Tuple
 import asyncio
+import functools
+import itertools
 from datetime import datetime
 import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Vector database - using simple file-based storage for now
 # In production, consider using ChromaDB, FAISS, or Pinecone
-import pickle
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from ..core.cache import TTLCache
+from .bm25_index import BM25Index, reciprocal_rank_fusion
+from .chunk_store import ChunkStore
+from .chunker import create_chunker
+from .context_assembler import ContextAssembler
+from .embedding_store import EmbeddingStore
+from .knowledge_store import KnowledgeStore
+from .vector_index import BruteForceIndex, IVFIndex, create_index
 
 logger = logging.getLogger(__name__)
 
+# Number of logged knowledge mutations before the snapshot is rewritten in the background
+RAG_COMPACT_EVERY = int(os.getenv("RAG_COMPACT_EVERY", "200"))
+
+# Chunks per model.encode() call when embedding documents
+RAG_ENCODE_BATCH_SIZE = int(os.getenv("RAG_ENCODE_BATCH_SIZE", "64"))
+
+# Worker threads for the async API (embedding and search run off the event loop)
+RAG_MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "2"))
+
+# Bounded, non-persistent cache for query embeddings (TTL in seconds, 0 = no expiry)
+RAG_QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024"))
+RAG_QUERY_CACHE_TTL = float(os.getenv("RAG_QUERY_CACHE_TTL", "3600"))
+
+# Token budget for get_relevant_context and number of chunks it considers
+RAG_CONTEXT_MAX_TOKENS = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "250"))
+RAG_CONTEXT_TOP_K = int(os.getenv("RAG_CONTEXT_TOP_K", "3"))
+
+# Retrieval: "semantic", "lexical" (BM25) or "hybrid" (rank fusion of both)
+RAG_SEARCH_MODE = os.getenv("RAG_SEARCH_MODE", "hybrid").lower()
+# Candidates taken from each ranking before fusing them in hybrid mode
+RAG_HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))
+# If > 0, vector scoring only looks at this many BM25 candidates (falls back to a full scan when BM25 finds nothing)
+RAG_BM25_PREFILTER = int(os.getenv("RAG_BM25_PREFILTER", "0"))
+
+# Vector index backend: "bruteforce" (exact) or "ivf" (approximate, for large knowledge bases)
+RAG_INDEX_BACKEND = os.getenv("RAG_INDEX_BACKEND", "bruteforce").lower()
+
 class RAGService:
     def __init__(self):
-        self.model = None
-        self.knowledge_base = {}
-        self.embeddings_cache = {}
+        # Embedding model, loaded on first use or by warmup() (see the model property)
+        self._model = None
+        self._model_loaded = False
+        self._model_lock = threading.Lock()
+        self._warm = False
+        self._warmup_lock = threading.Lock()
+        self._warmup_thread: Optional[threading.Thread] = None
         self.knowledge_path = "data/knowledge"
         self.embeddings_path = "data/embeddings"
+        # Snapshot + write-ahead log for knowledge entries
+        self.knowledge_store = KnowledgeStore(self.knowledge_path, compact_every=RAG_COMPACT_EVERY)
+        # Chunk texts keyed by content hash; entries only reference chunk ids
+        self.chunk_store = ChunkStore(self.knowledge_path, compact_every=RAG_COMPACT_EVERY)
+        # Splits content into chunks (RAG_CHUNKER)
+        self.chunker = create_chunker()
+        # Hash-keyed chunk embeddings, memory-mapped from data/embeddings
+        self.embeddings_cache = EmbeddingStore(self.embeddings_path)
+        # User queries are cached separately so they never reach the persisted store
+        self.query_cache = TTLCache(
+            max_entries=RAG_QUERY_CACHE_SIZE,
+            ttl_seconds=RAG_QUERY_CACHE_TTL or None
+        )
         self.model_name = "all-MiniLM-L6-v2"  # Lightweight embedding model
         
+        # In-memory index over all chunk embeddings, rebuilt lazily after changes.
+        # Rebuilds swap in a new index object so concurrent searches never see a half-built one.
+        # Each build gets its own rescoring file (see _new_index).
+        self._index_generation = itertools.count()
+        self.index = self._new_index()
+        self._index_dirty = True
+        # Background k-means for the IVF backend running (see _schedule_retrain); guarded by _write_lock
+        self._retraining = False
+        # Inverted index over chunks, maintained incrementally by add/update/delete
+        self.bm25 = BM25Index()
+        # category -> knowledge ids, maintained alongside the BM25 index.
+        # Sets are replaced, never mutated, so readers can use them without the write lock.
+        self.category_ids: Dict[str, frozenset] = {}
+        # (category, chunk id) -> {knowledge id: chunk index}: one index row per unique chunk
+        # and category, whatever the number of documents containing it (copy-on-write too)
+        self.chunk_owners: Dict[tuple, Dict[str, int]] = {}
+        # Bumped on every knowledge change; part of the memoized context keys
+        self.version = 0
+        # Formatted context blocks and memoized contexts for get_relevant_context
+        self.context_assembler = ContextAssembler(ttl_seconds=RAG_QUERY_CACHE_TTL or None)
+        # Serializes knowledge mutations and index rebuilds
+        self._write_lock = threading.RLock()
+        # Bounded pool used by the async API
+        self._executor = ThreadPoolExecutor(max_workers=RAG_MAX_CONCURRENCY, thread_name_prefix="rag")
+        
+        # Throughput of the most recent ingestion that encoded chunks, for /knowledge/stats;
+        # add_knowledge/add_knowledge_batch return the stats of their own call
+        self.last_ingest_stats: Dict[str, Any] = {}
+        
         # Create directories if they don't exist
         os.makedirs(self.knowledge_path, exist_ok=True)
         os.makedirs(self.embeddings_path, exist_ok=True)
+        self._remove_stale_rescore_files()
         
-        # Initialize model
-        self._initialize_model()
-        
-        # Load existing knowledge base
+        # Load existing knowledge base (the embedding model is loaded lazily)
         self._load_knowledge_base()
     
+    @property
+    def model(self):
+        """The embedding model; loading it on first access."""
+        if not self._model_loaded:
+            with self._model_lock:
+                if not self._model_loaded:
+                    self._initialize_model()
+                    self._model_loaded = True
+        return self._model
+    
     def _initialize_model(self):
         """Initialize the sentence transformer model for embeddings."""
         try:
-            self.model = SentenceTransformer(self.model_name)
-            logger.info(f"Initialized embedding model: {self.model_name}")
+            # Imported here: sentence_transformers pulls in torch, which is slow to import
+            from sentence_transformers import SentenceTransformer
+            start = time.perf_counter()
+            self._model = SentenceTransformer(self.model_name)
+            logger.info(f"Initialized embedding model: {self.model_name} ({time.perf_counter() - start:.2f}s)")
         except Exception as e:
             logger.error(f"Error initializing embedding model: {str(e)}")
-            self.model = None
+            self._model = None
+    
+    @property
+    def is_ready(self) -> bool:
+        """True once the model is loaded and the index is built."""
+        return self._warm
+    
+    def status(self) -> Dict[str, Any]:
+        """Readiness summary for health checks."""
+        return {
+            "ready": self._warm,
+            "loading": bool(self._warmup_thread and self._warmup_thread.is_alive()),
+            "model_available": self._model is not None if self._model_loaded else None,
+            "knowledge_entries": len(self.knowledge_base)
+        }
+    
+    def warmup(self):
+        """Load the model, seed the default knowledge if empty and build the index."""
+        if self._warm:
+            return
+        with self._warmup_lock:
+            if self._warm:
+                return
+            try:
+                if self.model and not self.knowledge_base:
+                    self.initialize_default_knowledge()
+                self._ensure_index()
+            except Exception as e:
+                logger.error(f"Error warming up RAG service: {str(e)}")
+            self._warm = True
+            logger.info("RAG service ready")
+    
+    def start_background_warmup(self):
+        """Run warmup() in a daemon thread so application startup is not blocked."""
+        if self._warm or (self._warmup_thread and self._warmup_thread.is_alive()):
+            return
+        self._warmup_thread = threading.Thread(target=self.warmup, name="rag-warmup", daemon=True)
+        self._warmup_thread.start()
     
     def _load_knowledge_base(self):
         """Load the knowledge base from disk."""
         try:
-            knowledge_file = os.path.join(self.knowledge_path, "knowledge_base.json")
-            if os.path.exists(knowledge_file):
-                with open(knowledge_file, 'r', encoding='utf-8') as f:
-                    self.knowledge_base = json.load(f)
-                logger.info(f"Loaded {len(self.knowledge_base)} knowledge entries")
+            self.knowledge_store.load()
+            logger.info(f"Loaded {len(self.knowledge_base)} knowledge entries")
+            self.chunk_store.load()
+            self._migrate_inline_chunks()
             
-            # Load embeddings cache
-            embeddings_file = os.path.join(self.embeddings_path, "embeddings_cache.pkl")
-            if os.path.exists(embeddings_file):
-                with open(embeddings_file, 'rb') as f:
-                    self.embeddings_cache = pickle.load(f)
-                logger.info(f"Loaded {len(self.embeddings_cache)} cached embeddings")
+            for knowledge in self.knowledge_base.values():
+                self._index_entry(knowledge)
+            
+            # Chunks left behind by an interrupted delete
+            orphans = [chunk_id for chunk_id in list(self.chunk_store.entries) if not self._chunk_referenced(chunk_id)]
+            if orphans:
+                self.chunk_store.delete_many(orphans)
+            
+            # Open the embeddings store (migrates embeddings_cache.pkl on first run)
+            self.embeddings_cache.load()
+            logger.info(f"Loaded {len(self.embeddings_cache)} cached embeddings")
                 
         except Exception as e:
             logger.error(f"Error loading knowledge base: {str(e)}")
     
-    def _save_knowledge_base(self):
-        """Save the knowledge base to disk."""
+    @property
+    def knowledge_base(self) -> Dict[str, Dict[str, Any]]:
+        """Knowledge entries by id; read-only here, every mutation goes through knowledge_store."""
+        return self.knowledge_store.entries
+    
+    def _migrate_inline_chunks(self):
+        """Move chunk texts stored inside entries (older format) to the chunk store."""
+        legacy = [knowledge for knowledge in self.knowledge_base.values() if "chunks" in knowledge]
+        if not legacy:
+            return
+        
+        chunks = {}
+        migrated = []
+        for knowledge in legacy:
+            knowledge = dict(knowledge)
+            texts = knowledge.pop("chunks")
+            # Same hashes as the embedding store, so no chunk is re-embedded
+            knowledge["chunk_ids"] = [self._get_text_hash(text) for text in texts]
+            chunks.update(zip(knowledge["chunk_ids"], texts))
+            migrated.append(knowledge)
+        
+        self.chunk_store.put_many([{"id": chunk_id, "text": text} for chunk_id, text in chunks.items()])
+        self.knowledge_store.put_many(migrated)
+        logger.info(f"Moved {len(chunks)} chunks of {len(migrated)} knowledge entries to the chunk store")
+    
+    def _chunk_referenced(self, chunk_id: str) -> bool:
+        return any((category, chunk_id) in self.chunk_owners for category in list(self.category_ids))
+    
+    def _index_entry(self, knowledge: Dict[str, Any]):
+        """Add an entry to the category map, its chunks' owners and the BM25 index."""
+        self.version += 1
+        category = knowledge.get("category", "general")
+        self.category_ids[category] = self.category_ids.get(category, frozenset()) | {knowledge["id"]}
+        for i, chunk_id in enumerate(knowledge.get("chunk_ids", [])):
+            key = (category, chunk_id)
+            owners = self.chunk_owners.get(key, {})
+            if knowledge["id"] not in owners:
+                self.chunk_owners[key] = {**owners, knowledge["id"]: i}
+                self._index_chunk_lexical(key)
+    
+    def _unindex_entry(self, knowledge: Dict[str, Any]):
+        """Remove an entry from the category map, its chunks' owners and the BM25 index."""
+        self.version += 1
+        category = knowledge.get("category", "general")
+        remaining = self.category_ids.get(category, frozenset()) - {knowledge["id"]}
+        if remaining:
+            self.category_ids[category] = remaining
+        else:
+            self.category_ids.pop(category, None)
+        for chunk_id in knowledge.get("chunk_ids", []):
+            key = (category, chunk_id)
+            owners = self.chunk_owners.get(key, {})
+            if knowledge["id"] not in owners:
+                continue
+            owners = {owner: i for owner, i in owners.items() if owner != knowledge["id"]}
+            if owners:
+                self.chunk_owners[key] = owners
+            else:
+                del self.chunk_owners[key]
+            self._index_chunk_lexical(key)
+    
+    def _index_chunk_lexical(self, key: tuple):
+        """(Re)index a unique chunk in BM25 with the titles of the entries containing it."""
+        owners = self.chunk_owners.get(key)
+        text = self.chunk_store.text(key[1])
+        if not owners or text is None:
+            self.bm25.remove_document(key)
+            return
+        titles = dict.fromkeys(
+            self.knowledge_base[owner].get("title", "") for owner in owners if owner in self.knowledge_base
+        )
+        self.bm25.add_document(key, "\n".join([*titles, text]))
+    
+    def _release_chunks(self, chunk_ids: List[str]):
+        """Drop the texts and embeddings of chunks no entry references any more."""
+        orphans = [chunk_id for chunk_id in dict.fromkeys(chunk_ids) if not self._chunk_referenced(chunk_id)]
+        if not orphans:
+            return
+        try:
+            for chunk_id in orphans:
+                self.embeddings_cache.delete(chunk_id)
+            self.chunk_store.delete_many(orphans)
+        except Exception as e:
+            logger.error(f"Error releasing chunks: {str(e)}")
+    
+    def _save_knowledge_entry(self, knowledge_id: str, knowledge: Dict[str, Any] = None, chunks: Dict[str, str] = None):
+        """
+        Apply and persist one knowledge mutation (knowledge None deletes the
+        entry), its new chunks and any new embeddings (append-only).
+        """
         try:
-            knowledge_file = os.path.join(self.knowledge_path, "knowledge_base.json")
-            with open(knowledge_file, 'w', encoding='utf-8') as f:
-                json.dump(self.knowledge_base, f, ensure_ascii=False, indent=2)
+            # Embeddings and chunks first, so a logged entry never points at missing data
+            self.embeddings_cache.flush()
+            if chunks:
+                self.chunk_store.put_many([{"id": chunk_id, "text": text} for chunk_id, text in chunks.items()])
             
-            # Save embeddings cache
-            embeddings_file = os.path.join(self.embeddings_path, "embeddings_cache.pkl")
-            with open(embeddings_file, 'wb') as f:
-                pickle.dump(self.embeddings_cache, f)
-                
-            logger.info("Knowledge base and embeddings saved")
+            if knowledge is None:
+                self.knowledge_store.delete(knowledge_id)
+            else:
+                self.knowledge_store.put(knowledge)
         except Exception as e:
             logger.error(f"Error saving knowledge base: {str(e)}")
     
@@ -89,189 +312,504 @@ class RAGService:
         text_hash = self._get_text_hash(text)
         
         # Check cache first
-        if text_hash in self.embeddings_cache:
-            return np.array(self.embeddings_cache[text_hash])
+        cached = self.embeddings_cache.get(text_hash)
+        if cached is not None:
+            return cached
         
         try:
             # Generate new embedding
             embedding = self.model.encode(text, convert_to_numpy=True)
             
             # Cache the embedding
-            self.embeddings_cache[text_hash] = embedding.tolist()
+            self.embeddings_cache.put(text_hash, embedding)
             
             return embedding
         except Exception as e:
             logger.error(f"Error generating embedding: {str(e)}")
             return None
     
-    def add_knowledge(self, title: str, content: str, category: str = "general", metadata: Dict[str, Any] = None) -> str:
-        """Add new knowledge to the knowledge base."""
-        knowledge_id = f"{category}_{self._get_text_hash(content)[:8]}"
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        return " ".join(query.lower().split())
+    
+    def _get_query_embedding(self, query: str) -> Optional[np.ndarray]:
+        """Embed a search query through the bounded query LRU cache."""
+        if not self.model:
+            return None
         
-        # Split content into chunks for better retrieval
-        chunks = self._chunk_text(content)
+        # The MiniLM tokenizer is uncased, so case and spacing do not change the embedding
+        key = self._normalize_query(query)
+        embedding = self.query_cache.get(key)
+        if embedding is not None:
+            return embedding
+        
+        try:
+            embedding = self.model.encode(query, convert_to_numpy=True)
+            self.query_cache.set(key, embedding)
+            return embedding
+        except Exception as e:
+            logger.error(f"Error generating query embedding: {str(e)}")
+            return None
+    
+    def _encode_missing(self, chunks: List[str]) -> Dict[str, Any]:
+        """
+        Embed every chunk whose hash is not cached, in batched encode() calls.
+        
+        Returns ingestion stats (chunks seen, chunks encoded, chunks/sec).
+        """
+        start = time.perf_counter()
+        missing = {}
+        for chunk in chunks:
+            chunk_hash = self._get_text_hash(chunk)
+            if chunk_hash not in self.embeddings_cache and chunk_hash not in missing:
+                missing[chunk_hash] = chunk
+        
+        if missing and self.model:
+            try:
+                embeddings = self.model.encode(
+                    list(missing.values()),
+                    batch_size=RAG_ENCODE_BATCH_SIZE,
+                    convert_to_numpy=True
+                )
+                for chunk_hash, embedding in zip(missing.keys(), embeddings):
+                    self.embeddings_cache.put(chunk_hash, embedding)
+            except Exception as e:
+                logger.error(f"Error generating embeddings: {str(e)}")
+        
+        elapsed = time.perf_counter() - start
+        stats = {
+            "chunks": len(chunks),
+            "encoded": len(missing),
+            "seconds": round(elapsed, 4),
+            "chunks_per_sec": round(len(missing) / elapsed, 1) if missing and elapsed > 0 else None
+        }
+        if missing:
+            self.last_ingest_stats = stats
+            logger.info(f"Encoded {len(missing)}/{len(chunks)} chunks in {elapsed:.2f}s ({stats['chunks_per_sec']} chunks/sec)")
+        return stats
+    
+    def _rebuild_index(self):
+        """
+        Rebuild the chunk embedding matrix: one row per unique chunk and category.
+        
+        With the IVF backend, once the service is serving, the clustering of
+        the current index is kept (new rows go to their nearest centroid) and
+        k-means only runs again in the background when needs_retrain says so.
+        """
+        keys = list(self.chunk_owners.keys())
+        self._encode_missing([
+            self.chunk_store.text(chunk_id) for _, chunk_id in keys
+            if chunk_id not in self.embeddings_cache and self.chunk_store.text(chunk_id) is not None
+        ])
+        row_ids, vectors, categories = self._index_rows(keys)
+        
+        index = self._new_index()
+        if isinstance(index, IVFIndex):
+            previous = self.index
+            if isinstance(previous, IVFIndex) and index.extend_from(previous, row_ids, vectors, labels=categories):
+                pass
+            elif self._warm:
+                # Searched exactly until the background training finishes
+                BruteForceIndex.build(index, row_ids, vectors, labels=categories)
+            else:
+                # Startup: reuse the persisted clustering when the chunks have not changed
+                index_file = os.path.join(self.embeddings_path, "ivf_index.npz")
+                fingerprint = IVFIndex.fingerprint(row_ids, vectors)
+                if not index.load(index_file, row_ids, vectors, fingerprint, labels=categories):
+                    index.build(row_ids, vectors, labels=categories)
+                    index.save(index_file, fingerprint)
+            if index.needs_retrain:
+                self._schedule_retrain()
+        else:
+            # Partitioned by category so filtered searches only score that category's rows
+            index.build(row_ids, vectors, labels=categories)
+        self._swap_index(index)
+        self._index_dirty = False
+        logger.info(f"Rebuilt knowledge index ({len(row_ids)} chunks)")
+    
+    def _index_rows(self, keys: List[tuple]) -> tuple:
+        """Row ids, embedding matrix and category of the given (category, chunk id) keys that have embeddings."""
+        row_ids = []
+        vectors = []
+        categories = []
+        for category, chunk_id in keys:
+            embedding = self.embeddings_cache.get(chunk_id)
+            if embedding is not None:
+                row_ids.append((category, chunk_id))
+                vectors.append(embedding)
+                categories.append(category)
         
-        knowledge_entry = {
-            "id": knowledge_id,
+        vectors = np.array(vectors, dtype=np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+        return row_ids, vectors, categories
+    
+    def _schedule_retrain(self):
+        """
+        Retrain the IVF clustering in a background thread (call with _write_lock
+        held); searches keep using the current index meanwhile.
+        """
+        if self._retraining:
+            return
+        self._retraining = True
+        threading.Thread(target=self._retrain_index, name="rag-ivf-train", daemon=True).start()
+    
+    def _retrain_index(self):
+        """Train a new IVF index on a snapshot of the rows and swap it in if nothing changed meanwhile."""
+        try:
+            while True:
+                with self._write_lock:
+                    snapshot = self.index
+                    if self._index_dirty or not getattr(snapshot, "needs_retrain", False):
+                        # The next _rebuild_index schedules another run if still needed
+                        self._retraining = False
+                        return
+                    row_ids, vectors, categories = self._index_rows(list(self.chunk_owners.keys()))
+                
+                start = time.perf_counter()
+                index = self._new_index()
+                try:
+                    index.build(row_ids, vectors, labels=categories)
+                except Exception:
+                    self._remove_rescore_file(index)
+                    raise
+                
+                with self._write_lock:
+                    if self.index is not snapshot or self._index_dirty:
+                        # Knowledge changed while training: train again on the new rows
+                        self._remove_rescore_file(index)
+                        continue
+                    self._swap_index(index)
+                    self._retraining = False
+                index.save(os.path.join(self.embeddings_path, "ivf_index.npz"), IVFIndex.fingerprint(row_ids, vectors))
+                logger.info(f"Retrained IVF index ({len(row_ids)} chunks) in {time.perf_counter() - start:.2f}s")
+                return
+        except Exception as e:
+            logger.error(f"Error training the IVF index: {str(e)}")
+            with self._write_lock:
+                self._retraining = False
+    
+    def _new_index(self):
+        """
+        Empty index of the configured backend; quantized indexes rescore from data/embeddings.
+        
+        Every index writes its own rescoring file, so a background retrain and a
+        rebuild never write the same file.
+        """
+        rescore_file = f"index_rescore.{next(self._index_generation)}.f32"
+        return create_index(RAG_INDEX_BACKEND, rescore_path=os.path.join(self.embeddings_path, rescore_file))
+    
+    def _swap_index(self, index):
+        """Make index the current one (call with _write_lock held) and delete the rescoring file it supersedes."""
+        previous = self.index
+        self.index = index
+        if previous is not index:
+            self._remove_rescore_file(previous)
+    
+    @staticmethod
+    def _remove_rescore_file(index):
+        """Delete an index's rescoring file; searches still using the index keep their mapping."""
+        if index.full is None:
+            return
+        try:
+            os.remove(index.rescore_path)
+        except OSError as e:
+            logger.warning(f"Could not remove rescoring vectors {index.rescore_path}: {str(e)}")
+    
+    def _remove_stale_rescore_files(self):
+        """Delete rescoring files left by a previous run (generations restart at 0)."""
+        for name in os.listdir(self.embeddings_path):
+            if name.startswith("index_rescore.") and (name.endswith(".f32") or name.endswith(".tmp")):
+                try:
+                    os.remove(os.path.join(self.embeddings_path, name))
+                except OSError as e:
+                    logger.warning(f"Could not remove stale rescoring vectors {name}: {str(e)}")
+    
+    def index_stats(self) -> Dict[str, Any]:
+        """Size and storage of the current vector index."""
+        index = self.index
+        return {
+            "backend": RAG_INDEX_BACKEND,
+            "quantization": index.quantization,
+            "rescoring": index.full is not None,
+            "rows": len(index),
+            "memory_bytes": index.memory_bytes()
+        }
+    
+    def _ensure_index(self):
+        """Rebuild the index if the knowledge base changed since the last build."""
+        if self._index_dirty:
+            with self._write_lock:
+                if self._index_dirty:
+                    self._rebuild_index()
+    
+    def add_knowledge(self, title: str, content: str, category: str = "general", metadata: Dict[str, Any] = None) -> Tuple[str, Dict[str, Any]]:
+        """Add new knowledge to the knowledge base; returns (knowledge id, ingest stats)."""
+        knowledge_ids, stats = self.add_knowledge_batch([{
             "title": title,
             "content": content,
-            "chunks": chunks,
             "category": category,
-            "metadata": metadata or {},
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
-        }
-        
-        self.knowledge_base[knowledge_id] = knowledge_entry
-        
-        # Generate embeddings for chunks
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{knowledge_id}_chunk_{i}"
-            embedding = self._get_embedding(chunk)
-            if embedding is not None:
-                self.embeddings_cache[self._get_text_hash(chunk)] = embedding.tolist()
+            "metadata": metadata
+        }])
+        return knowledge_ids[0], stats
+    
+    def add_knowledge_batch(self, documents: List[Dict[str, Any]]) -> Tuple[List[str], Dict[str, Any]]:
+        """
+        Add several documents, embedding all their uncached chunks in batched calls.
         
-        self._save_knowledge_base()
-        logger.info(f"Added knowledge: {title} ({len(chunks)} chunks)")
+        Args:
+            documents: Dicts with title, content and optional category/metadata
+            
+        Returns:
+            Knowledge ids (in the same order as documents) and the ingest stats
+            of this call (see _encode_missing)
+        """
+        entries = []
+        chunks = {}
+        for document in documents:
+            category = document.get("category") or "general"
+            content = document["content"]
+            now = datetime.now().isoformat()
+            # Split content into chunks for better retrieval; identical chunks share one id
+            texts = self.chunker.split(content)
+            chunk_ids = [self._get_text_hash(text) for text in texts]
+            chunks.update(zip(chunk_ids, texts))
+            entries.append({
+                "id": f"{category}_{self._get_text_hash(content)[:8]}",
+                "title": document["title"],
+                "content": content,
+                "chunk_ids": chunk_ids,
+                "category": category,
+                "metadata": document.get("metadata") or {},
+                "created_at": now,
+                "updated_at": now
+            })
         
-        return knowledge_id
-    
-    def _chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-        """Split text into overlapping chunks for better retrieval."""
-        words = text.split()
-        chunks = []
+        with self._write_lock:
+            stats = self._encode_missing(list(chunks.values()))
+            
+            previous = [self.knowledge_base[entry["id"]] for entry in entries if entry["id"] in self.knowledge_base]
+            for knowledge in previous:
+                self._unindex_entry(knowledge)
+            
+            try:
+                # Embeddings and chunks first, so a logged entry never points at missing data
+                self.embeddings_cache.flush()
+                self.chunk_store.put_many([
+                    {"id": chunk_id, "text": text} for chunk_id, text in chunks.items()
+                    if chunk_id not in self.chunk_store.entries
+                ])
+                self.knowledge_store.put_many(entries)
+            except Exception as e:
+                logger.error(f"Error saving knowledge base: {str(e)}")
+            self._index_dirty = True
+            
+            for entry in entries:
+                self._index_entry(entry)
+            self._release_chunks([chunk_id for knowledge in previous for chunk_id in knowledge.get("chunk_ids", [])])
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = " ".join(words[i:i + chunk_size])
-            if chunk.strip():
-                chunks.append(chunk.strip())
+        for entry in entries:
+            logger.info(f"Added knowledge: {entry['title']} ({len(entry['chunk_ids'])} chunks)")
         
-        return chunks
+        return [entry["id"] for entry in entries], stats
     
-    def search_knowledge(self, query: str, top_k: int = 5, category: str = None) -> List[Dict[str, Any]]:
-        """Search for relevant knowledge based on query."""
-        if not self.model or not self.knowledge_base:
+    def search_knowledge(self, query: str, top_k: int = 5, category: str = None, mode: str = None) -> List[Dict[str, Any]]:
+        """
+        Search for relevant knowledge based on query.
+        
+        Args:
+            query: Query text
+            top_k: Number of results
+            category: Optional category filter
+            mode: "semantic" (embeddings), "lexical" (BM25) or "hybrid" (both, fused
+                with reciprocal rank fusion); defaults to RAG_SEARCH_MODE
+        """
+        mode = (mode or RAG_SEARCH_MODE).lower()
+        self.warmup()
+        if not self.knowledge_base:
             return []
         
         try:
-            # Get query embedding
-            query_embedding = self._get_embedding(query)
+            accept = None
+            if category:
+                if category not in self.category_ids:
+                    return []
+                accept = lambda key: key[0] == category
+            
+            # Lexical ranking: only the postings of the query terms are visited
+            lexical = []
+            if mode != "semantic" or RAG_BM25_PREFILTER:
+                lexical = self.bm25.search(query, max(top_k, RAG_HYBRID_CANDIDATES, RAG_BM25_PREFILTER), accept=accept)
+            bm25_scores = dict(lexical)
+            
+            query_embedding = None
+            if mode != "lexical" and self.model:
+                query_embedding = self._get_query_embedding(query)
             if query_embedding is None:
-                return []
+                # Lexical mode, or no embedding model available
+                if mode == "semantic":
+                    return []
+                return self._format_results([(key, None, score, score) for key, score in lexical[:top_k]])
             
-            candidates = []
+            self._ensure_index()
+            index = self.index
             
-            # Search through all knowledge entries
-            for knowledge_id, knowledge in self.knowledge_base.items():
-                if category and knowledge.get("category") != category:
-                    continue
-                
-                # Search through chunks
-                for i, chunk in enumerate(knowledge.get("chunks", [])):
-                    chunk_embedding = self._get_embedding(chunk)
-                    if chunk_embedding is not None:
-                        # Calculate cosine similarity
-                        similarity = np.dot(query_embedding, chunk_embedding) / (
-                            np.linalg.norm(query_embedding) * np.linalg.norm(chunk_embedding)
-                        )
-                        
-                        candidates.append({
-                            "knowledge_id": knowledge_id,
-                            "chunk_index": i,
-                            "chunk": chunk,
-                            "title": knowledge.get("title", ""),
-                            "category": knowledge.get("category", ""),
-                            "similarity": float(similarity),
-                            "metadata": knowledge.get("metadata", {})
-                        })
+            rows = None
+            if RAG_BM25_PREFILTER and lexical:
+                # Cheap first stage: only score the BM25 candidates with the vectors
+                rows = np.array(sorted(index.row_of[key] for key, _ in lexical if key in index.row_of), dtype=np.int64)
             
-            # Sort by similarity and return top results
-            candidates.sort(key=lambda x: x["similarity"], reverse=True)
-            return candidates[:top_k]
+            n_semantic = top_k if mode == "semantic" else max(top_k, RAG_HYBRID_CANDIDATES)
+            semantic = [
+                (index.row_ids[row], similarity)
+                for row, similarity in index.search(query_embedding, n_semantic, rows=rows, partition=category)
+            ]
+            
+            if mode == "semantic":
+                return self._format_results([
+                    (key, similarity, similarity, bm25_scores.get(key)) for key, similarity in semantic
+                ])
+            
+            fused = reciprocal_rank_fusion([[key for key, _ in semantic], [key for key, _ in lexical]])[:top_k]
+            similarities = dict(semantic)
+            # Cosine for lexical-only hits, so every result reports a similarity
+            missing = [key for key, _ in fused if key not in similarities and key in index.row_of]
+            if missing:
+                scores = index.score(query_embedding, np.array([index.row_of[key] for key in missing], dtype=np.int64))
+                similarities.update(zip(missing, (float(score) for score in scores)))
+            
+            return self._format_results([
+                (key, similarities.get(key), score, bm25_scores.get(key)) for key, score in fused
+            ])
             
         except Exception as e:
             logger.error(f"Error searching knowledge: {str(e)}")
             return []
     
-    def get_relevant_context(self, query: str, max_context_length: int = 1000) -> str:
-        """Get relevant context for a query, formatted for LLM input."""
-        relevant_chunks = self.search_knowledge(query, top_k=3)
-        
-        if not relevant_chunks:
-            return ""
-        
-        context_parts = []
-        current_length = 0
-        
-        for chunk_info in relevant_chunks:
-            chunk = chunk_info["chunk"]
-            title = chunk_info["title"]
-            
-            # Format the chunk with title
-            formatted_chunk = f"**{title}**\n{chunk}\n"
-            
-            if current_length + len(formatted_chunk) > max_context_length:
-                break
-            
-            context_parts.append(formatted_chunk)
-            current_length += len(formatted_chunk)
-        
-        return "\n".join(context_parts)
+    def _format_results(self, ranked: List[tuple]) -> List[Dict[str, Any]]:
+        """Turn ((category, chunk_id), similarity, score, bm25) tuples into result dicts."""
+        results = []
+        seen = set()
+        for key, similarity, score, bm25 in ranked:
+            owners = self.chunk_owners.get(key)
+            chunk = self.chunk_store.text(key[1])
+            if not owners or chunk is None or key[1] in seen:
+                # Changed after the index snapshot was taken, or same text in another category
+                continue
+            seen.add(key[1])
+            knowledge_id, i = next(iter(owners.items()))
+            knowledge = self.knowledge_base.get(knowledge_id)
+            if knowledge is None:
+                continue
+            results.append({
+                "knowledge_id": knowledge_id,
+                "knowledge_ids": list(owners),
+                "chunk_id": key[1],
+                "chunk_index": i,
+                "chunk": chunk,
+                "title": knowledge.get("title", ""),
+                "category": knowledge.get("category", ""),
+                "similarity": similarity,
+                "score": score,
+                "bm25": bm25,
+                "metadata": knowledge.get("metadata", {})
+            })
+        return results
+    
+    def _context_key(self, query: str, max_context_length: Optional[int], max_tokens: Optional[int]) -> tuple:
+        return (self.version, self._normalize_query(query), max_tokens or RAG_CONTEXT_MAX_TOKENS, max_context_length)
+    
+    def get_relevant_context(self, query: str, max_context_length: int = None, max_tokens: int = None) -> str:
+        """
+        Get relevant context for a query, formatted for LLM input.
+        
+        Args:
+            query: Query text
+            max_context_length: Optional cap in characters
+            max_tokens: Token budget (defaults to RAG_CONTEXT_MAX_TOKENS)
+        """
+        key = self._context_key(query, max_context_length, max_tokens)
+        context = self.context_assembler.get(key)
+        if context is not None:
+            return context
+        
+        relevant_chunks = self.search_knowledge(query, top_k=RAG_CONTEXT_TOP_K)
+        context = self.context_assembler.assemble(
+            relevant_chunks,
+            max_tokens=max_tokens or RAG_CONTEXT_MAX_TOKENS,
+            max_chars=max_context_length
+        )
+        # Only memoize against the version the search saw
+        if key[0] == self.version:
+            self.context_assembler.set(key, context)
+        return context
     
     def update_knowledge(self, knowledge_id: str, content: str = None, title: str = None, metadata: Dict[str, Any] = None) -> bool:
         """Update existing knowledge entry."""
-        if knowledge_id not in self.knowledge_base:
-            return False
-        
-        knowledge = self.knowledge_base[knowledge_id]
-        
-        if content is not None:
-            knowledge["content"] = content
-            knowledge["chunks"] = self._chunk_text(content)
+        with self._write_lock:
+            if knowledge_id not in self.knowledge_base:
+                return False
             
-            # Regenerate embeddings for updated chunks
-            for i, chunk in enumerate(knowledge["chunks"]):
-                embedding = self._get_embedding(chunk)
-                if embedding is not None:
-                    self.embeddings_cache[self._get_text_hash(chunk)] = embedding.tolist()
-        
-        if title is not None:
-            knowledge["title"] = title
-        
-        if metadata is not None:
-            knowledge["metadata"].update(metadata)
-        
-        knowledge["updated_at"] = datetime.now().isoformat()
-        
-        self._save_knowledge_base()
-        logger.info(f"Updated knowledge: {knowledge_id}")
-        
-        return True
+            # Work on a copy; the store swaps it in when the mutation is logged
+            previous = self.knowledge_base[knowledge_id]
+            knowledge = dict(previous)
+            chunks = {}
+            
+            if content is not None:
+                texts = self.chunker.split(content)
+                knowledge["content"] = content
+                knowledge["chunk_ids"] = [self._get_text_hash(text) for text in texts]
+                chunks = {
+                    chunk_id: text for chunk_id, text in zip(knowledge["chunk_ids"], texts)
+                    if chunk_id not in self.chunk_store.entries
+                }
+                self._index_dirty = True
+            
+                # Generate (and cache) embeddings for updated chunks
+                self._encode_missing(texts)
+            
+            if title is not None:
+                knowledge["title"] = title
+            
+            if metadata is not None:
+                knowledge["metadata"] = {**knowledge.get("metadata", {}), **metadata}
+            
+            knowledge["updated_at"] = datetime.now().isoformat()
+            
+            self._unindex_entry(previous)
+            self._save_knowledge_entry(knowledge_id, knowledge, chunks=chunks)
+            self._index_entry(knowledge)
+            self._release_chunks(previous.get("chunk_ids", []))
+            logger.info(f"Updated knowledge: {knowledge_id}")
+            
+            return True
     
     def delete_knowledge(self, knowledge_id: str) -> bool:
         """Delete knowledge entry."""
-        if knowledge_id not in self.knowledge_base:
-            return False
-        
-        # Remove embeddings from cache
-        knowledge = self.knowledge_base[knowledge_id]
-        for chunk in knowledge.get("chunks", []):
-            chunk_hash = self._get_text_hash(chunk)
-            if chunk_hash in self.embeddings_cache:
-                del self.embeddings_cache[chunk_hash]
-        
-        del self.knowledge_base[knowledge_id]
-        self._save_knowledge_base()
-        logger.info(f"Deleted knowledge: {knowledge_id}")
-        
-        return True
+        with self._write_lock:
+            if knowledge_id not in self.knowledge_base:
+                return False
+            
+            knowledge = self.knowledge_base[knowledge_id]
+            self._unindex_entry(knowledge)
+            self._index_dirty = True
+            self._save_knowledge_entry(knowledge_id)
+            # Texts and embeddings of chunks no other entry shares
+            self._release_chunks(knowledge.get("chunk_ids", []))
+            logger.info(f"Deleted knowledge: {knowledge_id}")
+            
+            return True
     
     def list_knowledge(self, category: str = None) -> List[Dict[str, Any]]:
         """List all knowledge entries."""
         entries = []
         
-        for knowledge_id, knowledge in self.knowledge_base.items():
-            if category and knowledge.get("category") != category:
+        if category:
+            knowledge_ids = self.category_ids.get(category, frozenset())
+        else:
+            knowledge_ids = list(self.knowledge_base.keys())
+        
+        for knowledge_id in knowledge_ids:
+            knowledge = self.knowledge_base.get(knowledge_id)
+            if knowledge is None:
                 continue
             
             entries.append({
@@ -279,7 +817,7 @@ class RAGService:
                 "title": knowledge.get("title", ""),
                 "category": knowledge.get("category", ""),
                 "content_length": len(knowledge.get("content", "")),
-                "chunks_count": len(knowledge.get("chunks", [])),
+                "chunks_count": len(knowledge.get("chunk_ids", [])),
                 "created_at": knowledge.get("created_at", ""),
                 "updated_at": knowledge.get("updated_at", ""),
                 "metadata": knowledge.get("metadata", {})
@@ -289,10 +827,64 @@ class RAGService:
     
     def get_categories(self) -> List[str]:
         """Get all available categories."""
-        categories = set()
-        for knowledge in self.knowledge_base.values():
-            categories.add(knowledge.get("category", "general"))
-        return sorted(list(categories))
+        return sorted(self.category_ids.keys())
+    
+    # ---- Async API: CPU-bound work runs in the bounded RAG thread pool ----
+    async def _run_in_executor(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+    
+    async def asearch_knowledge(self, query: str, top_k: int = 5, category: str = None, mode: str = None) -> List[Dict[str, Any]]:
+        """Async search_knowledge; the event loop stays free while embedding and scoring."""
+        return await self._run_in_executor(self.search_knowledge, query, top_k=top_k, category=category, mode=mode)
+    
+    async def aembed_query(self, query: str) -> Optional[np.ndarray]:
+        """Query embedding (through the query cache), computed in the RAG pool; None without a model."""
+        embedding = self.query_cache.get(self._normalize_query(query))
+        if embedding is not None:
+            return embedding
+        return await self._run_in_executor(self._get_query_embedding, query)
+    
+    def submit_relevant_context(self, query: str, max_context_length: int = None, max_tokens: int = None) -> asyncio.Future:
+        """
+        Start get_relevant_context in the RAG pool right away (must be called from the event loop).
+        
+        Unlike a coroutine, the work is submitted immediately, so it overlaps with
+        whatever the caller does before awaiting the returned future.
+        """
+        loop = asyncio.get_running_loop()
+        context = self.context_assembler.get(self._context_key(query, max_context_length, max_tokens))
+        if context is not None:
+            future = loop.create_future()
+            future.set_result(context)
+            return future
+        return loop.run_in_executor(self._executor, functools.partial(
+            self.get_relevant_context, query, max_context_length=max_context_length, max_tokens=max_tokens
+        ))
+    
+    async def aget_relevant_context(self, query: str, max_context_length: int = None, max_tokens: int = None) -> str:
+        """Async get_relevant_context; memoized contexts are returned without leaving the event loop."""
+        return await self.submit_relevant_context(query, max_context_length=max_context_length, max_tokens=max_tokens)
+    
+    async def aadd_knowledge(self, title: str, content: str, category: str = "general", metadata: Dict[str, Any] = None) -> Tuple[str, Dict[str, Any]]:
+        """Async add_knowledge."""
+        return await self._run_in_executor(self.add_knowledge, title, content, category=category, metadata=metadata)
+    
+    async def aadd_knowledge_batch(self, documents: List[Dict[str, Any]]) -> Tuple[List[str], Dict[str, Any]]:
+        """Async add_knowledge_batch."""
+        return await self._run_in_executor(self.add_knowledge_batch, documents)
+    
+    async def aupdate_knowledge(self, knowledge_id: str, content: str = None, title: str = None, metadata: Dict[str, Any] = None) -> bool:
+        """Async update_knowledge."""
+        return await self._run_in_executor(self.update_knowledge, knowledge_id, content=content, title=title, metadata=metadata)
+    
+    async def adelete_knowledge(self, knowledge_id: str) -> bool:
+        """Async delete_knowledge."""
+        return await self._run_in_executor(self.delete_knowledge, knowledge_id)
+    
+    async def ainitialize_default_knowledge(self):
+        """Async initialize_default_knowledge."""
+        return await self._run_in_executor(self.initialize_default_knowledge)
     
     def initialize_default_knowledge(self):
         """Initialize with default SCAIE knowledge."""
@@ -364,9 +956,5 @@ class RAGService:
         
         logger.info("Initialized default knowledge base")
 
-# Create singleton instance
+# Create singleton instance (cheap: the model and default knowledge load in warmup())
 rag_service = RAGService()
-
-# Initialize with default knowledge if empty
-if not rag_service.knowledge_base:
-    rag_service.initialize_default_knowledge()
@@ -0,0 +1,122 @@
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    # Without numpy only exact lookups are served
+    np = None
+
+from ..core.cache import TTLCache
+from .keyword_matcher import tokenize
+
+
+class ResponseCache:
+    """
+    Cache of LLM replies keyed by interest level and normalized message.
+
+    A lookup first tries the exact key (lowercase words, punctuation
+    dropped, so "¿Cuánto cuesta?" and "cuanto cuesta" only differ by the
+    accent), then the most similar cached message of the same interest
+    level whose embedding cosine similarity reaches ``threshold``. Entries
+    expire after ``ttl_seconds`` and the least recently used are evicted
+    beyond ``max_entries``. Everything is dropped when the generation
+    (prompt and knowledge fingerprint) changes. The similarity tier needs
+    numpy (see ``semantic``).
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = 3600, threshold: float = 0.92):
+        self.entries = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.threshold = threshold
+        self.generation: Optional[Hashable] = None
+        # interest level -> (keys, unit vectors matrix); replaced, never mutated
+        self._vectors: Dict[str, Tuple[List[Tuple[str, str]], Any]] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def semantic(self) -> bool:
+        """Whether lookups by embedding similarity are available (numpy installed)."""
+        return np is not None
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        return " ".join(tokenize(message))
+
+    def check_generation(self, generation: Hashable):
+        """Drop every entry if the prompts or knowledge changed since they were cached."""
+        if generation != self.generation:
+            with self._lock:
+                if generation != self.generation:
+                    self.entries.clear()
+                    self._vectors = {}
+                    self.generation = generation
+
+    def get_exact(self, interest_level: str, message: str) -> Optional[str]:
+        response = self.entries.get((interest_level, self.normalize(message)))
+        if response is not None:
+            self.exact_hits += 1
+        return response
+
+    def get_similar(self, interest_level: str, vector: Any) -> Optional[Tuple[str, float]]:
+        """(reply, similarity) of the closest live entry above the threshold, or None."""
+        if not self.semantic:
+            return None
+        snapshot = self._vectors.get(interest_level)
+        if snapshot is None:
+            return None
+        keys, matrix = snapshot
+        scores = matrix @ self._unit(vector)
+        for row in np.argsort(-scores):
+            score = float(scores[row])
+            if score < self.threshold:
+                break
+            response = self.entries.get(keys[row])
+            if response is not None:
+                self.semantic_hits += 1
+                return response, score
+        return None
+
+    def miss(self):
+        self.misses += 1
+
+    def set(self, interest_level: str, message: str, response: str, vector: Optional[Any] = None):
+        key = (interest_level, self.normalize(message))
+        with self._lock:
+            self.entries.set(key, response)
+            if vector is None or not self.semantic:
+                return
+            keys, matrix = self._vectors.get(interest_level, ([], None))
+            if len(keys) >= 2 * self.entries.max_entries:
+                # Drop rows whose entries expired or were evicted
+                live = [i for i, k in enumerate(keys) if self.entries.get(k) is not None]
+                keys, matrix = [keys[i] for i in live], matrix[live]
+            unit = self._unit(vector)[None, :]
+            matrix = unit if matrix is None else np.vstack([matrix, unit])
+            self._vectors[interest_level] = (keys + [key], matrix)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._vectors = {}
+
+    @staticmethod
+    def _unit(vector: Any) -> Any:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.entries.max_entries,
+            "ttl_seconds": self.entries.ttl_seconds,
+            "threshold": self.threshold,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else None
+        }
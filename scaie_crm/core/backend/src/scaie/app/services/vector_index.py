@@ -0,0 +1,449 @@
+import os
+import logging
+import hashlib
+import threading
+from typing import Dict, List, Tuple, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# (category, chunk id) for every row of the matrix
+RowId = Tuple[str, str]
+
+# Storage for the search matrix: float32 or int8 with a per-row scale (4x smaller). float16
+# was dropped: numpy converts it to float32 so slowly that scoring took 5-6x as long.
+QUANTIZATIONS = ("none", "int8")
+
+# Rows scored per matmul when assigning rows to IVF centroids
+SCORE_BLOCK_ROWS = 8192
+# int8 rows are converted to float32 in blocks of this many rows while scoring,
+# into a per-thread buffer that is reused (small enough to stay in cache)
+QUANTIZED_BLOCK_ROWS = 1024
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of matrix with every row scaled to unit length."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class BruteForceIndex:
+    """
+    Exact cosine search over a contiguous, pre-normalized float32 matrix.
+
+    Rows can be labelled (the RAG service uses the category): rows with the
+    same label are stored contiguously, so a search restricted to one
+    partition only scores that slice of the matrix.
+
+    With ``quantization="int8"`` the matrix is kept as int8. If a
+    ``rescore_path`` is given, the float32 rows are written there and
+    memory-mapped: the quantized scores select ``top_k * rescore_factor``
+    candidates and only those are re-ranked in full precision.
+    """
+
+    def __init__(self, quantization: str = "none", rescore_factor: int = 4, rescore_path: Optional[str] = None):
+        if quantization == "float16":
+            logger.warning("float16 index storage is no longer supported (slower to score than float32), storing int8")
+            quantization = "int8"
+        if quantization not in QUANTIZATIONS:
+            logger.warning(f"Unknown quantization '{quantization}', storing float32")
+            quantization = "none"
+        self.quantization = quantization
+        self.rescore_factor = max(1, rescore_factor)
+        self.rescore_path = rescore_path
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        # Per-row dequantization scale (int8 only)
+        self.scales: Optional[np.ndarray] = None
+        # Memory-mapped float32 rows used for rescoring quantized results
+        self.full: Optional[np.ndarray] = None
+        self.row_ids: List[RowId] = []
+        self.row_of: Dict[RowId, int] = {}
+        # label -> (first row, end row)
+        self.partitions: Dict[str, Tuple[int, int]] = {}
+        # Per-thread float32 conversion buffer for quantized scoring (see _score)
+        self._buffers = threading.local()
+
+    def __len__(self) -> int:
+        return len(self.row_ids)
+
+    def build(self, row_ids: List[RowId], vectors: np.ndarray, labels: Optional[List[str]] = None):
+        """
+        Replace the index contents with the given rows.
+
+        Args:
+            row_ids: Id of every row
+            vectors: One embedding per row
+            labels: Optional partition label per row; rows are regrouped by label
+        """
+        self.partitions = {}
+        self.scales = None
+        self.full = None
+        if len(row_ids) == 0:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+            self.row_ids = []
+            self.row_of = {}
+            return
+        row_ids = list(row_ids)
+        if labels is not None:
+            order = sorted(range(len(row_ids)), key=labels.__getitem__)
+            row_ids = [row_ids[i] for i in order]
+            vectors = np.asarray(vectors)[order]
+            start = 0
+            for row in range(1, len(order) + 1):
+                if row == len(order) or labels[order[row]] != labels[order[start]]:
+                    self.partitions[labels[order[start]]] = (start, row)
+                    start = row
+        self._store(normalize_rows(vectors))
+        self.row_ids = row_ids
+        self.row_of = {row_id: row for row, row_id in enumerate(self.row_ids)}
+
+    def _store(self, normalized: np.ndarray):
+        """Keep the normalized rows in the configured representation."""
+        if self.quantization == "int8":
+            scales = np.abs(normalized).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.matrix = np.round(normalized / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+        else:
+            self.matrix = np.ascontiguousarray(normalized)
+            return
+
+        if self.rescore_path:
+            try:
+                # Replacing the file leaves a previous index's mapping valid
+                tmp_path = f"{self.rescore_path}.tmp"
+                normalized.tofile(tmp_path)
+                os.replace(tmp_path, self.rescore_path)
+                self.full = np.memmap(self.rescore_path, dtype=np.float32, mode='r', shape=normalized.shape)
+            except OSError as e:
+                logger.warning(f"Could not write rescoring vectors to {self.rescore_path}: {str(e)}")
+
+    def memory_bytes(self) -> int:
+        """Resident size of the search structures (memory-mapped rescoring rows excluded)."""
+        size = self.matrix.nbytes
+        if self.scales is not None:
+            size += self.scales.nbytes
+        return size
+
+    def dequantize(self, rows) -> np.ndarray:
+        """Float32 rows of the matrix (approximate if quantized); rows is an index array or slice."""
+        block = self.matrix[rows].astype(np.float32, copy=False)
+        if self.scales is not None:
+            block = block * self.scales[rows][:, None]
+        return block
+
+    def _score(self, query: np.ndarray, rows) -> np.ndarray:
+        """Scores of the normalized query against rows (an index array or slice)."""
+        if self.matrix.dtype == np.float32:
+            return self.matrix[rows] @ query
+        # numpy has no fast int8 matmul: convert a block at a time into a reused float32 buffer
+        if isinstance(rows, slice):
+            first, end, _ = rows.indices(len(self.matrix))
+            count = max(0, end - first)
+        else:
+            count = len(rows)
+        buffer = self._buffer()
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, QUANTIZED_BLOCK_ROWS):
+            stop = min(start + QUANTIZED_BLOCK_ROWS, count)
+            block = buffer[:stop - start]
+            if isinstance(rows, slice):
+                block[...] = self.matrix[first + start:first + stop]
+            else:
+                block[...] = self.matrix[rows[start:stop]]
+            np.dot(block, query, out=scores[start:stop])
+        if self.scales is not None:
+            scores *= self.scales[rows]
+        return scores
+
+    def _buffer(self) -> np.ndarray:
+        """This thread's float32 conversion buffer, sized for the matrix."""
+        buffer = getattr(self._buffers, "block", None)
+        if buffer is None or buffer.shape[1] != self.matrix.shape[1]:
+            buffer = np.empty((QUANTIZED_BLOCK_ROWS, self.matrix.shape[1]), dtype=np.float32)
+            self._buffers.block = buffer
+        return buffer
+
+    def partition_rows(self, label: str) -> np.ndarray:
+        """Row numbers of one partition (empty if the label is unknown)."""
+        start, end = self.partitions.get(label, (0, 0))
+        return np.arange(start, end, dtype=np.int64)
+
+    def score(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Exact cosine similarity between query and the given rows."""
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.float32)
+        query = normalize_rows(query)[0]
+        if self.full is not None:
+            return self.full[rows] @ query
+        return self._score(query, rows)
+
+    def search(self, query: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None,
+               partition: Optional[str] = None) -> List[Tuple[int, float]]:
+        """
+        Return up to top_k (row, cosine similarity) pairs, best first.
+
+        Args:
+            query: Query embedding (does not need to be normalized)
+            top_k: Number of results
+            rows: Optional array of row numbers to restrict the search to
+            partition: Optional label; only that partition's rows are scored
+        """
+        if len(self.row_ids) == 0 or top_k <= 0:
+            return []
+
+        offset = 0
+        query = normalize_rows(query)[0]
+        if partition is not None and rows is None:
+            # Contiguous slice: a view of the matrix, nothing is copied
+            offset, end = self.partitions.get(partition, (0, 0))
+            if end == offset:
+                return []
+            scores = self._score(query, slice(offset, end))
+        elif partition is not None or rows is not None:
+            if partition is not None:
+                start, end = self.partitions.get(partition, (0, 0))
+                rows = rows[(rows >= start) & (rows < end)]
+            if len(rows) == 0:
+                return []
+            scores = self._score(query, rows)
+        else:
+            scores = self._score(query, slice(None))
+
+        # With rescoring, the quantized scores only shortlist candidates
+        k = min(top_k * self.rescore_factor if self.full is not None else top_k, len(scores))
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        candidates = rows[top] if rows is not None else top + offset
+
+        if self.full is not None:
+            # Sorted reads touch the memory-mapped rows in file order
+            candidates = np.sort(candidates)
+            top_scores = self.full[candidates] @ query
+        else:
+            top_scores = scores[top]
+        order = np.argsort(-top_scores)[:top_k]
+        return [(int(candidates[i]), float(top_scores[i])) for i in order]
+
+
+class IVFIndex(BruteForceIndex):
+    """
+    Approximate cosine search with an inverted file (IVF-Flat).
+
+    Rows are clustered with spherical k-means; a query only scores the rows
+    of the ``nprobe`` clusters whose centroids are closest to it. Small
+    indexes (fewer than ``min_rows`` rows) are searched exactly.
+
+    After a knowledge change, extend_from() keeps the previous clustering:
+    rows already indexed keep their cluster and only new rows are assigned
+    to their nearest centroid. needs_retrain turns true once more than
+    ``retrain_fraction`` of the trained rows were added or removed since
+    k-means last ran.
+    """
+
+    def __init__(self, nlist: int = 64, nprobe: int = 8, min_rows: int = 2048, seed: int = 42,
+                 retrain_fraction: float = 0.2, **kwargs):
+        super().__init__(**kwargs)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.seed = seed
+        self.retrain_fraction = retrain_fraction
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.lists: List[np.ndarray] = []
+        # Rows the clustering was trained on, and rows added or removed since
+        self.trained_rows = 0
+        self.changed_rows = 0
+
+    @staticmethod
+    def fingerprint(row_ids: List[RowId], vectors: np.ndarray) -> str:
+        """Identify a set of rows so a persisted index can be reused."""
+        digest = hashlib.md5()
+        for label, chunk_id in row_ids:
+            digest.update(f"{label}:{chunk_id};".encode())
+        digest.update(memoryview(np.ascontiguousarray(vectors, dtype=np.float32)).cast("B"))
+        return digest.hexdigest()
+
+    def build(self, row_ids: List[RowId], vectors: np.ndarray, labels: Optional[List[str]] = None):
+        super().build(row_ids, vectors, labels=labels)
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.lists = []
+        self.trained_rows = 0
+        self.changed_rows = 0
+        if len(self.row_ids) >= self.min_rows:
+            self._train()
+
+    def extend_from(self, previous: "IVFIndex", row_ids: List[RowId], vectors: np.ndarray,
+                    labels: Optional[List[str]] = None) -> bool:
+        """
+        Build from the given rows reusing previous's clustering (no k-means).
+
+        Returns False, leaving the index untouched, if previous has no
+        clustering for vectors of this size.
+        """
+        if not previous.lists or len(row_ids) == 0 or previous.centroids.shape[1] != np.shape(vectors)[1]:
+            return False
+        BruteForceIndex.build(self, row_ids, vectors, labels=labels)
+        previous_cluster = np.empty(len(previous), dtype=np.int64)
+        for c, members in enumerate(previous.lists):
+            previous_cluster[members] = c
+
+        assignment = np.empty(len(self.row_ids), dtype=np.int64)
+        new_rows = []
+        for row, row_id in enumerate(self.row_ids):
+            old_row = previous.row_of.get(row_id)
+            if old_row is None:
+                new_rows.append(row)
+            else:
+                assignment[row] = previous_cluster[old_row]
+        self.centroids = previous.centroids
+        if new_rows:
+            new_rows = np.array(new_rows, dtype=np.int64)
+            assignment[new_rows] = self._nearest_centroid(new_rows)
+        self._set_lists(assignment)
+
+        removed = len(previous) - (len(self.row_ids) - len(new_rows))
+        self.trained_rows = previous.trained_rows
+        self.changed_rows = previous.changed_rows + len(new_rows) + removed
+        return True
+
+    @property
+    def needs_retrain(self) -> bool:
+        """Large enough to cluster but not clustered yet, or changed too much since training."""
+        if len(self.row_ids) < self.min_rows:
+            return False
+        return not self.lists or self.changed_rows > self.retrain_fraction * self.trained_rows
+
+    def _train(self, n_iter: int = 10):
+        """Cluster the normalized rows with spherical k-means."""
+        rng = np.random.default_rng(self.seed)
+        n = len(self.matrix)
+        nlist = min(self.nlist, n)
+
+        # Train on a sample; assigning every row afterwards is a single pass
+        sample_size = min(n, nlist * 256)
+        sample = self.dequantize(rng.choice(n, sample_size, replace=False))
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = normalize_rows(centroids)
+
+        self._assign(centroids)
+
+    def _assign(self, centroids: np.ndarray):
+        """Assign every row to its closest centroid and build the inverted lists."""
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._set_lists(self._nearest_centroid(np.arange(len(self.matrix), dtype=np.int64)))
+        self.trained_rows = len(self.matrix)
+        self.changed_rows = 0
+
+    def _nearest_centroid(self, rows: np.ndarray) -> np.ndarray:
+        """Closest centroid of each of the given rows."""
+        assignment = np.empty(len(rows), dtype=np.int64)
+        # Assign in blocks to keep the temporary score matrix small
+        for start in range(0, len(rows), SCORE_BLOCK_ROWS):
+            block = self.dequantize(rows[start:start + SCORE_BLOCK_ROWS])
+            assignment[start:start + SCORE_BLOCK_ROWS] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignment
+
+    def _set_lists(self, assignment: np.ndarray):
+        """Inverted lists (rows of each cluster) from the cluster of every row."""
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+
+    def search(self, query: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None,
+               partition: Optional[str] = None) -> List[Tuple[int, float]]:
+        if partition is not None:
+            start, end = self.partitions.get(partition, (0, 0))
+            if not self.lists or end - start < self.min_rows:
+                return super().search(query, top_k, rows=rows, partition=partition)
+            partition_rows = self.partition_rows(partition)
+            rows = partition_rows if rows is None else np.intersect1d(rows, partition_rows, assume_unique=True)
+        if not self.lists or (rows is not None and len(rows) < self.min_rows):
+            return super().search(query, top_k, rows=rows)
+
+        query_norm = normalize_rows(query)[0]
+        nprobe = min(self.nprobe, len(self.centroids))
+        probed = np.argpartition(-(self.centroids @ query_norm), nprobe - 1)[:nprobe]
+        candidates = np.concatenate([self.lists[c] for c in probed])
+        if rows is not None:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+        return super().search(query, top_k, rows=candidates)
+
+    def save(self, path: str, fingerprint: str):
+        """Persist the trained clustering next to the embeddings."""
+        if not self.lists:
+            return
+        lengths = np.array([len(l) for l in self.lists], dtype=np.int64)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            fingerprint=np.array(fingerprint),
+            centroids=self.centroids,
+            members=np.concatenate(self.lists),
+            lengths=lengths,
+        )
+        os.replace(tmp_path, path)
+
+    def load(self, path: str, row_ids: List[RowId], vectors: np.ndarray, fingerprint: str,
+             labels: Optional[List[str]] = None) -> bool:
+        """Load a persisted clustering if it was built from the same rows."""
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                if str(data["fingerprint"]) != fingerprint:
+                    return False
+                centroids = data["centroids"]
+                members = data["members"]
+                lengths = data["lengths"]
+        except Exception as e:
+            logger.warning(f"Could not load IVF index from {path}: {str(e)}")
+            return False
+
+        BruteForceIndex.build(self, row_ids, vectors, labels=labels)
+        self.centroids = centroids
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.lists = [members[offsets[c]:offsets[c + 1]] for c in range(len(lengths))]
+        self.trained_rows = len(self.row_ids)
+        self.changed_rows = 0
+        return True
+
+
+def create_index(backend: str, rescore_path: Optional[str] = None) -> BruteForceIndex:
+    """
+    Create the vector index selected by RAG_INDEX_BACKEND ("bruteforce" or "ivf").
+
+    RAG_QUANTIZATION picks the matrix storage (none or int8) and
+    RAG_RESCORE_FACTOR how many candidates per result are re-ranked in
+    float32 (from rescore_path) when quantized.
+    """
+    storage = {
+        "quantization": os.getenv("RAG_QUANTIZATION", "none").lower(),
+        "rescore_factor": int(os.getenv("RAG_RESCORE_FACTOR", "4")),
+        "rescore_path": rescore_path,
+    }
+    if backend == "ivf":
+        return IVFIndex(
+            nlist=int(os.getenv("RAG_IVF_NLIST", "64")),
+            nprobe=int(os.getenv("RAG_IVF_NPROBE", "8")),
+            min_rows=int(os.getenv("RAG_IVF_MIN_ROWS", "2048")),
+            retrain_fraction=float(os.getenv("RAG_IVF_RETRAIN_FRACTION", "0.2")),
+            **storage,
+        )
+    if backend != "bruteforce":
+        logger.warning(f"Unknown RAG index backend '{backend}', using exact search")
+    return BruteForceIndex(**storage)
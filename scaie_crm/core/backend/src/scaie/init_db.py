@@ -73,6 +73,7 @@ def check_and_update_tables():
         print("Todas las tablas requeridas ya existen.")
         # Verificar si la tabla contacts necesita actualizarse
         check_contacts_table_update(inspector)
+        check_messages_indexes(inspector)
 
 def check_contacts_table_update(inspector):
     """Verifica si la tabla contacts necesita actualizarse con nuevas columnas."""
@@ -96,6 +97,15 @@ def check_contacts_table_update(inspector):
     else:
         print("Tabla contacts actualizada.")
 
+def check_messages_indexes(inspector):
+    """Crea los índices de la tabla messages que falten (p. ej. el del historial de conversación)."""
+    existing = {index['name'] for index in inspector.get_indexes('messages')}
+    for index in conversation.Message.__table__.indexes:
+        if index.name not in existing:
+            print(f"Creando índice {index.name} en messages...")
+            index.create(bind=engine)
+    print("Índices de messages actualizados.")
+
 def update_contacts_table():
     """Actualiza la tabla contacts con las nuevas columnas."""
     print("Actualizando tabla contacts...")
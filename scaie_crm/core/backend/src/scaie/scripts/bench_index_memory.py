@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memoria y recall del índice vectorial según su almacenamiento.
+
+Compara la matriz float32 con la variante cuantizada (int8 con escala por
+vector), con y sin re-puntuación en float32 de los candidatos, y
+con el formato antiguo (listas de floats de Python en un pickle).
+
+Uso:
+    python scripts/bench_index_memory.py --rows 50000 --queries 200
+"""
+
+import os
+import sys
+import time
+import pickle
+import argparse
+import tempfile
+
+import numpy as np
+
+# Añadir el directorio backend al path para poder importar los módulos
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.vector_index import BruteForceIndex
+from bench_vector_index import make_dataset, time_queries
+
+
+def legacy_bytes_per_vector(vectors: np.ndarray, sample: int = 1000):
+    """Pickle size and in-memory size of the old dict of hash -> list of floats."""
+    legacy = {f"{i:032x}": vector.tolist() for i, vector in enumerate(vectors[:sample])}
+    pickled = len(pickle.dumps(legacy)) / len(legacy)
+    # list object + one boxed float per dimension
+    in_memory = sum(sys.getsizeof(v) + sum(sys.getsizeof(x) for x in v) for v in legacy.values()) / len(legacy)
+    return pickled, in_memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    row_ids, vectors = make_dataset(args.rows, args.dim, clusters=256)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(args.rows, args.queries, replace=False)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    exact = BruteForceIndex()
+    exact.build(row_ids, vectors)
+    truth, exact_ms = time_queries(exact, queries, args.top_k)
+    baseline = exact.memory_bytes()
+
+    pickled, in_memory = legacy_bytes_per_vector(vectors)
+    print(f"rows={args.rows} dim={args.dim} top_k={args.top_k}")
+    print(f"legacy float lists: {pickled:.0f} B/vector pickled, {in_memory:.0f} B/vector in memory "
+          f"({in_memory / (4 * args.dim):.1f}x float32)")
+    print(f"{'storage':<22}{'MB':>9}{'B/vector':>10}{'vs f32':>8}{'recall@k':>10}{'ms/query':>10}")
+    print(f"{'float32':<22}{baseline / 2**20:>9.1f}{baseline / args.rows:>10.0f}{1.0:>8.1f}{1.0:>10.3f}{exact_ms:>10.3f}")
+
+    tmp_dir = tempfile.mkdtemp(prefix="rag_bench_")
+    for quantization in ("int8",):
+        for rescore in (False, True):
+            index = BruteForceIndex(
+                quantization=quantization,
+                rescore_factor=args.rescore_factor,
+                rescore_path=os.path.join(tmp_dir, f"{quantization}.f32") if rescore else None,
+            )
+            index.build(row_ids, vectors)
+            results, ms = time_queries(index, queries, args.top_k)
+            recall = np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)])
+            size = index.memory_bytes()
+            name = f"{quantization}{' + rescore' if rescore else ''}"
+            print(f"{name:<22}{size / 2**20:>9.1f}{size / args.rows:>10.0f}{baseline / size:>8.1f}{recall:>10.3f}{ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
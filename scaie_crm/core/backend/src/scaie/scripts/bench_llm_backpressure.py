@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Ráfaga de mensajes contra el servidor LLM de prueba (stub_llm_server) con
+un límite de concurrencia como el del proveedor (429 por encima de N
+peticiones simultáneas).
+
+Compara llm_service sin límite (todas las llamadas salen a la vez) con el
+limitador adaptativo (AIMD + cola con plazo): respuestas correctas, 429,
+llamadas descartadas por la cola, latencia p50/p95 y límite final.
+
+Uso:
+    python scripts/bench_llm_backpressure.py --requests 60 --provider-concurrency 4
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+# Añadir el directorio backend al path para poder importar los módulos
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault("LLM_USE_RAG", "false")
+os.environ.setdefault("LLM_RESPONSE_CACHE", "false")
+
+import numpy as np
+from openai import AsyncOpenAI
+
+from app.services.llm_service import llm_service
+from app.services.llm_limiter import AdaptiveLimiter
+from app.services.message_classifier import message_classifier
+from stub_llm_server import StubLLMServer
+
+
+async def burst(requests: int):
+    async def one(i: int):
+        message = f"Mensaje {i}: quiero automatizar los reportes semanales del área"
+        assert not message_classifier.classify(message).predefined
+        started = time.perf_counter()
+        result = await llm_service.generate_response(message)
+        return result, (time.perf_counter() - started) * 1000
+
+    return await asyncio.gather(*(one(i) for i in range(requests)))
+
+
+def report(name: str, results, server: StubLLMServer, limiter: AdaptiveLimiter):
+    ok = [ms for result, ms in results if result.get("success")]
+    shed = sum(1 for result, _ in results if result.get("error") == "LLM overloaded")
+    failed = len(results) - len(ok) - shed
+    latencies = np.array(ok) if ok else np.zeros(1)
+    print(f"{name}:")
+    print(f"  correctas {len(ok)}, con error {failed}, descartadas {shed}; 429 del proveedor: {server.rate_limited}")
+    print(f"  latencia (correctas) p50 {np.percentile(latencies, 50):.0f} ms, p95 {np.percentile(latencies, 95):.0f} ms")
+    print(f"  límite final {limiter.limit:.2f}")
+
+
+async def run(args, name: str, limiter: AdaptiveLimiter):
+    server = StubLLMServer(latency_ms=args.latency_ms, max_concurrent=args.provider_concurrency).start()
+    try:
+        # No client retries: every 429 reaches the service
+        llm_service.client = AsyncOpenAI(api_key="stub", base_url=server.url, max_retries=0)
+        llm_service.limiter = limiter
+        results = await burst(args.requests)
+        report(name, results, server, limiter)
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--provider-concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--queue-timeout-ms", type=float, default=5000)
+    args = parser.parse_args()
+    # One error line per 429 otherwise
+    logging.getLogger("app.services.llm_service").setLevel(logging.CRITICAL)
+
+    print(f"{args.requests} mensajes simultáneos, proveedor: {args.provider_concurrency} en paralelo, "
+          f"{args.latency_ms:.0f} ms por respuesta\n")
+    unbounded = AdaptiveLimiter(max_concurrency=10 ** 6, min_concurrency=10 ** 6, max_queue=10 ** 6)
+    asyncio.run(run(args, "sin límite", unbounded))
+    adaptive = AdaptiveLimiter(max_concurrency=args.max_concurrency, max_queue=args.requests,
+                               queue_timeout_ms=args.queue_timeout_ms)
+    asyncio.run(run(args, f"limitador adaptativo (máx. {args.max_concurrency}, plazo {args.queue_timeout_ms:.0f} ms)", adaptive))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Mismo mensaje enviado N veces a la vez (p. ej. un grupo de Telegram que
+responde a un broadcast) contra el servidor LLM de prueba: llamadas al
+proveedor, respuestas compartidas y latencia, con y sin coalescencia
+(LLM_COALESCE).
+
+Uso:
+    python scripts/bench_llm_coalescing.py --requests 50
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+# Añadir el directorio backend al path para poder importar los módulos
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault("LLM_USE_RAG", "false")
+os.environ.setdefault("LLM_RESPONSE_CACHE", "false")
+
+import numpy as np
+from openai import AsyncOpenAI
+
+import app.services.llm_service as llm_module
+from app.services.llm_service import llm_service
+from stub_llm_server import StubLLMServer
+
+MESSAGE = "¿El taller sirve para automatizar los reportes semanales del área?"
+
+
+async def burst(requests: int):
+    async def one():
+        started = time.perf_counter()
+        result = await llm_service.generate_response(MESSAGE)
+        return result, (time.perf_counter() - started) * 1000
+
+    return await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    print(f"{args.requests} copias simultáneas del mismo mensaje, {args.latency_ms:.0f} ms por respuesta\n")
+    for mode in ("off", "exact"):
+        llm_module.LLM_COALESCE = mode
+        server = StubLLMServer(latency_ms=args.latency_ms).start()
+        try:
+            llm_service.client = AsyncOpenAI(api_key="stub", base_url=server.url, max_retries=0)
+            results = asyncio.run(burst(args.requests))
+        finally:
+            server.stop()
+        shared = sum(1 for result, _ in results if result.get("timings", {}).get("coalesced"))
+        latencies = np.array([ms for _, ms in results])
+        print(f"LLM_COALESCE={mode}: {server.calls} llamadas al proveedor, {shared} respuestas compartidas, "
+              f"p50 {np.percentile(latencies, 50):.0f} ms, p95 {np.percentile(latencies, 95):.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del clasificador de mensajes (respuestas predefinidas +
+señales de interés).
+
+Compara el coste por mensaje de message_classifier.classify (una sola
+tokenización, todas las reglas) con el esquema anterior: un
+any(keyword in mensaje) por regla sobre el texto en minúsculas. También
+cuenta cuántos mensajes marcaba como "negativo" cada uno (la búsqueda por
+subcadena de "no" se disparaba con "nosotros", "nombre"...).
+
+Uso:
+    python scripts/bench_message_classifier.py --repeat 20000
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Añadir el directorio backend al path para poder importar los módulos
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.message_classifier import message_classifier, PREDEFINED_KEYWORDS, INTEREST_KEYWORDS
+from app.services.workshop_knowledge import workshop_knowledge
+
+MESSAGES = [
+    "Hola",
+    "¿Cuánto cuesta el taller?",
+    "Somos un equipo de ventas de 12 personas, ¿es online?",
+    "Me interesa para nosotros, ¿cómo funciona la sesión de seguimiento?",
+    "No gracias, por ahora no",
+    "Nuestro nombre es Comercial del Norte y queremos conocer el temario",
+    "me podrías explicar un poco mejor cómo funcionaría esto en la práctica para nosotros",
+    "Buenas tardes, me gustaría saber más sobre el workshop para mi equipo, somos unas 15 personas en el área comercial",
+    "¿Tienen número de WhatsApp para agendar una llamada?",
+    "Ya usamos ChatGPT pero no sabemos cómo estandarizar los prompts en el equipo de operaciones",
+]
+
+
+def legacy_rules():
+    """The rule lists as the old code scanned them: (name, keywords) in priority order."""
+    rules = []
+    for name, keywords in PREDEFINED_KEYWORDS:
+        if name == "objecciones":
+            for key, cfg in workshop_knowledge["objecciones"].items():
+                rules.append((f"objecion:{key}", cfg["keywords"]))
+            for role in workshop_knowledge["casos_uso_por_rol"]:
+                rules.append((f"rol:{role}", [role]))
+        else:
+            rules.append((name, keywords))
+    return rules + INTEREST_KEYWORDS
+
+
+def legacy_classify(message, rules):
+    message_lower = message.lower()
+    return [name for name, keywords in rules if any(k in message_lower for k in keywords)]
+
+
+def per_message_us(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for message in MESSAGES:
+            fn(message)
+    return (time.perf_counter() - started) / (repeat * len(MESSAGES)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    rules = legacy_rules()
+    legacy_us = per_message_us(lambda m: legacy_classify(m, rules), args.repeat)
+    new_us = per_message_us(message_classifier.classify, args.repeat)
+    print(f"{len(MESSAGES)} mensajes x {args.repeat}")
+    print(f"subcadenas (any por regla): {legacy_us:.1f} us/mensaje")
+    print(f"message_classifier:         {new_us:.1f} us/mensaje ({legacy_us / new_us:.1f}x)")
+
+    print("\nclases por mensaje (antes -> ahora):")
+    for message in MESSAGES:
+        before = set(legacy_classify(message, rules))
+        after = message_classifier.classify(message).classes
+        diff = ", ".join(sorted(f"-{c}" for c in before - after) + sorted(f"+{c}" for c in after - before))
+        print(f"  {message[:60]!r}: {diff or 'igual'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Comprueba que el event loop sigue respondiendo durante búsquedas RAG concurrentes.
+
+Compara llamar a `search_knowledge` directamente desde corrutinas (bloquea el
+loop) con `asearch_knowledge` (pool de hilos acotado por RAG_MAX_CONCURRENCY),
+midiendo el retraso máximo de un "tick" que debería ejecutarse cada 10 ms.
+
+Uso:
+    python scripts/bench_rag_async.py --docs 300 --searches 50
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+# Añadir el directorio backend al path para poder importar los módulos
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """Return the worst delay (ms) seen by a coroutine that wants to wake every interval."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, (time.perf_counter() - start - interval) * 1000)
+    return worst
+
+
+async def run(rag, queries, use_async: bool):
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop))
+
+    async def search_blocking(query):
+        return rag.search_knowledge(query, top_k=3)
+
+    search = rag.asearch_knowledge if use_async else search_blocking
+    start = time.perf_counter()
+    await asyncio.gather(*(search(q) for q in queries))
+    elapsed = (time.perf_counter() - start) * 1000
+
+    stop.set()
+    return elapsed, await ticker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=300)
+    parser.add_argument("--searches", type=int, default=50)
+    args = parser.parse_args()
+
+    # RAGService stores data relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="rag_bench_"))
+    from app.services.rag_service import rag_service, RAG_MAX_CONCURRENCY
+
+    rag_service.warmup()
+    rag_service.add_knowledge_batch([
+        {"title": f"Documento {i}", "content": f"Documento {i} sobre automatización, precios y modalidades del workshop. " * 40}
+        for i in range(args.docs)
+    ])
+    rag_service.search_knowledge("warmup")
+
+    # Distinct queries so every search pays for an embedding
+    queries = [f"¿cuánto cuesta el workshop para {i} personas?" for i in range(args.searches)]
+    blocking_ms, blocking_lag = asyncio.run(run(rag_service, queries, use_async=False))
+    queries = [f"¿el workshop {i} es presencial u online?" for i in range(args.searches)]
+    async_ms, async_lag = asyncio.run(run(rag_service, queries, use_async=True))
+
+    print(f"{args.searches} concurrent searches over {args.docs} documents (RAG_MAX_CONCURRENCY={RAG_MAX_CONCURRENCY})")
+    print(f"{'mode':<22}{'total ms':>10}{'max loop lag ms':>18}")
+    print(f"{'search_knowledge':<22}{blocking_ms:>10.1f}{blocking_lag:>18.1f}")
+    print(f"{'asearch_knowledge':<22}{async_ms:>10.1f}{async_lag:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark de recall vs latencia: índice IVF aproximado contra búsqueda exacta.
+
+Uso:
+    python scripts/bench_vector_index.py --rows 50000 --queries 200
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+# Añadir el directorio backend al path para poder importar los módulos
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.vector_index import BruteForceIndex, IVFIndex
+
+
+def make_dataset(rows: int, dim: int, clusters: int, seed: int = 0):
+    """Synthetic clustered embeddings, closer to real text embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    row_ids = [(f"doc_{i // 4}", i % 4) for i in range(rows)]
+    return row_ids, vectors
+
+
+def time_queries(index, queries, top_k):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append([row for row, _ in index.search(query, top_k)])
+    elapsed = time.perf_counter() - start
+    return results, elapsed / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=256)
+    args = parser.parse_args()
+
+    row_ids, vectors = make_dataset(args.rows, args.dim, clusters=args.nlist)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(args.rows, args.queries, replace=False)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    exact = BruteForceIndex()
+    exact.build(row_ids, vectors)
+    truth, exact_ms = time_queries(exact, queries, args.top_k)
+    print(f"rows={args.rows} dim={args.dim} top_k={args.top_k}")
+    print(f"{'backend':<22}{'recall@k':>10}{'ms/query':>12}")
+    print(f"{'bruteforce':<22}{1.0:>10.3f}{exact_ms:>12.3f}")
+
+    start = time.perf_counter()
+    ivf = IVFIndex(nlist=args.nlist, min_rows=0)
+    ivf.build(row_ids, vectors)
+    print(f"(IVF build: {time.perf_counter() - start:.2f}s)")
+
+    for nprobe in (1, 4, 8, 16, 32):
+        ivf.nprobe = nprobe
+        approx, ivf_ms = time_queries(ivf, queries, args.top_k)
+        recall = np.mean([
+            len(set(a) & set(t)) / len(t) for a, t in zip(approx, truth)
+        ])
+        print(f"{f'ivf nprobe={nprobe}':<22}{recall:>10.3f}{ivf_ms:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Conversación larga (N turnos) por omnipotent_agent contra el servidor LLM de
+prueba y una base SQLite en memoria: comprueba que el historial que va en el
+prompt (últimos mensajes + resumen en Conversation.context) se mantiene
+acotado, que cada mensaje que sale de la ventana se manda a resumir una
+sola vez (el primero incluido), que el resumen llega al prompt y que la
+consulta del historial usa el índice (conversation_id, created_at).
+
+Uso:
+    python scripts/check_conversation_history.py --turns 200
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+
+# Añadir el directorio backend al path para poder importar los módulos
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault("LLM_USE_RAG", "false")
+
+from openai import AsyncOpenAI
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.database import Base
+from app.core.tokens import estimate_tokens
+from app.models import contact, conversation, agent_action  # noqa: F401  (registran las tablas)
+from app.models.conversation import Conversation
+from app.services.conversation_history import CONTEXT_KEY, SUMMARY_INSTRUCTIONS, conversation_history
+from app.services.llm_service import llm_service
+from app.services.omnipotent_agent import omnipotent_agent
+from stub_llm_server import StubLLMServer
+
+CONTACT = {"name": "Ana Pérez", "phone": "5500000001", "company": "Acme"}
+SUMMARY_PREFIX = SUMMARY_INSTRUCTIONS[:40]
+
+
+def message(i: int) -> str:
+    return f"Mensaje {i}: quiero automatizar los reportes semanales del área de finanzas"
+
+
+def is_summary(request) -> bool:
+    return request["json"]["messages"][0]["content"].startswith(SUMMARY_PREFIX)
+
+
+def check(condition: bool, description: str):
+    print(f"{'ok  ' if condition else 'FAIL'} {description}")
+    if not condition:
+        raise SystemExit(1)
+
+
+async def run(db, server: StubLLMServer, turns: int):
+    prompt = ""
+    history_tokens = []
+    user_tokens = []
+    summarized = []
+    for i in range(turns):
+        await omnipotent_agent.process_incoming_message(message(i), "web", dict(CONTACT), db)
+        # The summary call runs alongside the response: take the last response request
+        prompt = [r for r in server.requests if not is_summary(r)][-1]["json"]["messages"][-1]["content"]
+        user_tokens.append(estimate_tokens(prompt if isinstance(prompt, str) else str(prompt)))
+        conv = db.query(Conversation).first()
+        state = (conv.context or {}).get(CONTEXT_KEY) or {}
+        summarized.append(state.get("through_id", 0))
+        window = conversation_history.build(db, conv)
+        history_tokens.append(window.tokens)
+    return history_tokens, user_tokens, summarized, prompt if isinstance(prompt, str) else str(prompt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    server = StubLLMServer(reply="Claro, te cuento cómo lo vemos en el taller.").start()
+    try:
+        llm_service.client = AsyncOpenAI(api_key="stub", base_url=server.url, max_retries=0)
+        history_tokens, user_tokens, summarized, last_prompt = asyncio.run(run(db, server, args.turns))
+    finally:
+        server.stop()
+        db.close()
+
+    budget = conversation_history.max_tokens + conversation_history.summary_tokens
+    for turn in (1, 5, 10, 50, args.turns):
+        if turn <= args.turns:
+            print(f"turno {turn:4d}: historial {history_tokens[turn - 1]:4d} tokens, "
+                  f"prompt de usuario {user_tokens[turn - 1]:4d} tokens")
+    print()
+    check(max(history_tokens) <= budget, f"historial <= {budget} tokens en todos los turnos (máx. {max(history_tokens)})")
+    # Ventana y resumen llenos tras unos 2 * LLM_HISTORY_MESSAGES turnos
+    settled = user_tokens[2 * conversation_history.max_messages:]
+    if len(settled) >= 2:
+        # Oscila entre resúmenes (notas pendientes), pero no crece
+        half = len(settled) // 2
+        check(max(settled[half:]) <= 1.05 * max(settled[:half]), "el prompt deja de crecer cuando la ventana se llena")
+    check(all(b >= a for a, b in zip(summarized, summarized[1:])),
+          "el historial solo avanza: ningún mensaje vuelve a salir de la ventana")
+    if args.turns > 2 * conversation_history.max_messages:
+        summary_prompts = [r["json"]["messages"][-1]["content"] for r in server.requests if is_summary(r)]
+        sent = [sum(p.count(message(i)[:12]) for p in summary_prompts) for i in range(args.turns // 2)]
+        check(all(count == 1 for count in sent),
+              f"cada mensaje se manda a resumir una sola vez ({len(summary_prompts)} llamadas de resumen)")
+        check("Resumen de la conversación anterior: Claro, te cuento" in last_prompt,
+              "el resumen del modelo ligero está en el último prompt")
+
+    with engine.connect() as conn:
+        plan = conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id, sender, content FROM messages "
+            "WHERE conversation_id = 1 AND id > 0 ORDER BY created_at DESC, id DESC LIMIT 30"
+        )).fetchall()
+    detail = " | ".join(str(row[-1]) for row in plan)
+    check("ix_messages_conversation_created" in detail, f"consulta por índice: {detail}")
+
+
+if __name__ == "__main__":
+    main()
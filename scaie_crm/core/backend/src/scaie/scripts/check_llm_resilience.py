@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Recorre los estados de la capa de resiliencia de llm_service (reintentos,
+timeout por intento y circuit breaker) contra el servidor LLM de prueba
+(stub_llm_server) con fallos inyectados, y comprueba cada transición:
+
+    cerrado -> reintento con éxito (503, timeout, desconexión, error en stream)
+    cerrado -> sin reintento (400) / fallo tras agotar reintentos
+    cerrado -> abierto (fallos consecutivos) -> respuesta inmediata sin red
+    abierto -> semiabierto -> abierto (la sonda falla)
+    abierto -> semiabierto -> cerrado (la sonda funciona), una sola sonda a la vez
+
+Uso:
+    python scripts/check_llm_resilience.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+
+# Añadir el directorio backend al path para poder importar los módulos
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault("LLM_USE_RAG", "false")
+os.environ.setdefault("LLM_RESPONSE_CACHE", "false")
+
+from openai import AsyncOpenAI
+
+from app.services.llm_service import llm_service
+from app.services.llm_resilience import CircuitBreaker, RetryPolicy
+from stub_llm_server import StubLLMServer
+
+REPLY = "Respuesta del proveedor"
+FAILURES = 3
+RESET_MS = 300
+
+
+def message(i: int) -> str:
+    return f"Mensaje {i}: quiero automatizar los reportes semanales del área"
+
+
+async def generate(i: int):
+    started = time.perf_counter()
+    result = await llm_service.generate_response(message(i))
+    return result, (time.perf_counter() - started) * 1000
+
+
+async def stream(i: int):
+    events = [event async for event in llm_service.generate_response_stream(message(i))]
+    return [e["text"] for e in events if e["type"] == "delta"], events[-1]
+
+
+def check(condition: bool, description: str):
+    print(f"{'ok  ' if condition else 'FAIL'} {description}")
+    if not condition:
+        raise SystemExit(1)
+
+
+async def run(server: StubLLMServer):
+    breaker = llm_service.circuit_breaker
+    fallback = llm_service._predefined_response("contacto")
+
+    # closed: retryable failures are retried
+    for fault in (503, "hang", "disconnect"):
+        server.inject(fault)
+        calls = server.calls
+        result, _ = await generate(1)
+        check(result["success"] and result["timings"]["attempts"] == 2 and server.calls - calls == 2,
+              f"{fault}: reintento y respuesta correcta (2 intentos)")
+    check(breaker.state == "closed" and breaker.failures == 0, "un éxito reinicia el conteo de fallos")
+
+    server.inject(503)
+    deltas, done = await stream(2)
+    check(done["success"] and "".join(deltas) == REPLY and done["timings"]["attempts"] == 2,
+          "stream: 503 antes del primer token se reintenta")
+    server.inject("cut")
+    calls = server.calls
+    deltas, done = await stream(3)
+    check(not done["success"] and len(deltas) == 1 and server.calls - calls == 1,
+          "stream: error a mitad de respuesta no se reintenta (ya se envió texto)")
+
+    check(breaker.failures == 1, "el error en stream cuenta como fallo del proveedor")
+    result, _ = await generate(4)
+    check(result["success"] and breaker.failures == 0, "cerrado: siguiente llamada correcta")
+
+    # closed: non-retryable errors do not count as provider failures
+    server.inject(400)
+    calls = server.calls
+    result, _ = await generate(4)
+    check(not result["success"] and server.calls - calls == 1 and breaker.failures == 0,
+          "400: sin reintento, no cuenta como caída del proveedor")
+
+    # closed -> open once retries are exhausted
+    server.outage = 503
+    calls = server.calls
+    result, _ = await generate(5)
+    check(not result["success"] and server.calls - calls == 3 and breaker.state == "open",
+          f"caída: 3 intentos fallidos -> circuito abierto ({breaker.failures} fallos consecutivos)")
+    calls = server.calls
+    result, ms = await generate(6)
+    check(result["response"] == fallback and server.calls == calls and ms < 50,
+          f"abierto: respuesta de contacto sin llamar al proveedor ({ms:.1f} ms)")
+    deltas, done = await stream(7)
+    check(done["response"] == fallback and server.calls == calls, "abierto: también en stream")
+
+    # open -> half_open -> open
+    await asyncio.sleep(RESET_MS / 1000)
+    calls = server.calls
+    result, _ = await generate(8)
+    check(server.calls - calls == 1 and breaker.state == "open" and result["response"] == fallback,
+          "semiabierto: la sonda falla -> abierto de nuevo (su reintento ya no sale)")
+
+    # open -> half_open -> closed, one probe at a time
+    await asyncio.sleep(RESET_MS / 1000)
+    server.outage = None
+    server.latency_ms = 200
+    calls = server.calls
+    probe = asyncio.create_task(generate(9))
+    await asyncio.sleep(0.05)
+    check(breaker.state == "half_open", "semiabierto mientras la sonda está en curso")
+    result, ms = await generate(10)
+    check(result["response"] == fallback and ms < 50, "semiabierto: las demás llamadas no esperan a la sonda")
+    result, _ = await probe
+    check(result["success"] and breaker.state == "closed" and server.calls - calls == 1,
+          "la sonda funciona -> circuito cerrado")
+    server.latency_ms = 0
+    result, _ = await generate(11)
+    check(result["success"], "cerrado: las llamadas vuelven al proveedor")
+    print(f"\n{breaker.stats()}")
+
+
+def main():
+    logging.getLogger("app.services.llm_service").setLevel(logging.CRITICAL)
+    server = StubLLMServer(reply=REPLY).start()
+    server.hang_ms = 1000
+    try:
+        llm_service.client = AsyncOpenAI(api_key="stub", base_url=server.url, max_retries=0)
+        llm_service.retry_policy = RetryPolicy(max_retries=2, timeout_ms=300, base_delay_ms=10, max_delay_ms=50)
+        llm_service.circuit_breaker = CircuitBreaker(failure_threshold=FAILURES, reset_timeout_ms=RESET_MS)
+        asyncio.run(run(server))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
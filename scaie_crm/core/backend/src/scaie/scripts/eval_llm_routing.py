@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Evaluación offline del enrutado de modelos (LLM_ROUTING): reenvía los
+mensajes de usuario guardados (tabla messages) a llm_service contra el
+servidor LLM de prueba, una vez con todo en QWEN_MODEL (LLM_ROUTING=off) y
+otra con el enrutado (auto), y compara llamadas por modelo, tokens, coste
+estimado y latencia.
+
+El servidor de prueba responde con la latencia indicada para cada modelo;
+los tokens son los estimados del prompt real de cada mensaje. Los mensajes
+se reenvían sin historial, con el nivel de interés actual de su contacto.
+
+Uso:
+    python scripts/eval_llm_routing.py --limit 500
+    python scripts/eval_llm_routing.py --database-url sqlite:////ruta/scaie.db --price qwen-turbo=0.05/0.2
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+# Añadir el directorio backend al path para poder importar los módulos
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault("LLM_USE_RAG", "false")
+os.environ.setdefault("LLM_RESPONSE_CACHE", "false")
+os.environ.setdefault("LLM_COALESCE", "off")
+
+import numpy as np
+from openai import AsyncOpenAI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import SQLALCHEMY_DATABASE_URL
+from app.models import agent_action  # noqa: F401  (registra las tablas relacionadas)
+from app.models.contact import Contact
+from app.models.conversation import Message
+from app.services.llm_service import llm_service
+from stub_llm_server import StubLLMServer
+
+# USD por millón de tokens (entrada, salida); ajústalos a la tarifa vigente con --price
+PRICES = {
+    "qwen-turbo": (0.05, 0.2),
+    "qwen-flash": (0.05, 0.4),
+    "qwen-plus": (0.4, 1.2),
+    "qwen-max": (1.6, 6.4),
+}
+
+REPLY = "Claro, con gusto te cuento cómo el taller ayuda a tu equipo a ahorrar tiempo con IA. ¿Qué tareas te gustaría automatizar primero?"
+
+
+def load_messages(database_url: str, limit: int) -> List[Tuple[str, Any]]:
+    """(texto, contacto) de los últimos limit mensajes de usuario."""
+    engine = create_engine(database_url)
+    db = sessionmaker(bind=engine, expire_on_commit=False)()
+    try:
+        rows = db.query(Message).filter(Message.sender == "user").order_by(Message.id.desc()).limit(limit).all()
+        contacts = {c.id: c for c in db.query(Contact).filter(Contact.id.in_({row.contact_id for row in rows}))}
+        # Los contactos se usan después de cerrar la sesión
+        db.expunge_all()
+        return [(row.content, contacts.get(row.contact_id)) for row in reversed(rows)]
+    finally:
+        db.close()
+
+
+async def replay(messages: List[Tuple[str, Any]], concurrency: int) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(text: str, contact: Any):
+        async with semaphore:
+            return await llm_service.generate_response(text, contact)
+
+    return await asyncio.gather(*(one(text, contact) for text, contact in messages))
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    calls: Counter = Counter()
+    tokens: Dict[str, List[int]] = {}
+    latencies = []
+    for result in results:
+        timings = result.get("timings", {})
+        model = timings.get("model")
+        if not model or not result.get("success"):
+            continue
+        calls[model] += 1
+        usage = result.get("usage") or {}
+        model_tokens = tokens.setdefault(model, [0, 0])
+        model_tokens[0] += usage.get("prompt_tokens", 0)
+        model_tokens[1] += usage.get("completion_tokens", 0)
+        latencies.append(timings["total_ms"])
+    cost = 0.0
+    for model, (prompt, completion) in tokens.items():
+        price_in, price_out = PRICES.get(model, (0.0, 0.0))
+        cost += (prompt * price_in + completion * price_out) / 1e6
+    return {
+        "calls": calls,
+        "tokens": tokens,
+        "cost": cost,
+        "llm_messages": len(latencies),
+        "other": len(results) - len(latencies),
+        "p50": float(np.percentile(latencies, 50)) if latencies else 0.0,
+        "p95": float(np.percentile(latencies, 95)) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=SQLALCHEMY_DATABASE_URL)
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--light-ms", type=float, default=300, help="latencia simulada del modelo ligero")
+    parser.add_argument("--strong-ms", type=float, default=1200, help="latencia simulada de QWEN_MODEL")
+    parser.add_argument("--price", action="append", default=[], metavar="MODELO=ENTRADA/SALIDA",
+                        help="USD por millón de tokens, p. ej. qwen-plus=0.4/1.2")
+    args = parser.parse_args()
+
+    for price in args.price:
+        model, _, values = price.partition("=")
+        price_in, _, price_out = values.partition("/")
+        PRICES[model] = (float(price_in), float(price_out))
+
+    messages = load_messages(args.database_url, args.limit)
+    if not messages:
+        print(f"No hay mensajes de usuario en {args.database_url}")
+        raise SystemExit(1)
+
+    router = llm_service.router
+    print(f"{len(messages)} mensajes de usuario; ligero {router.light_model} ({args.light_ms:.0f} ms), "
+          f"fuerte {router.strong_model} ({args.strong_ms:.0f} ms)\n")
+    summaries = {}
+    for mode in ("off", "auto"):
+        router.mode = mode
+        router.decisions.clear()
+        server = StubLLMServer(reply=REPLY, latency_ms=args.strong_ms).start()
+        server.model_latency_ms = {router.light_model: args.light_ms, router.strong_model: args.strong_ms}
+        try:
+            llm_service.client = AsyncOpenAI(api_key="stub", base_url=server.url, max_retries=0)
+            summaries[mode] = summary = summarize(asyncio.run(replay(messages, args.concurrency)))
+        finally:
+            server.stop()
+        print(f"LLM_ROUTING={mode}: {summary['llm_messages']} respuestas del LLM "
+              f"({summary['other']} predefinidas o fallidas), coste estimado ${summary['cost']:.4f}, "
+              f"p50 {summary['p50']:.0f} ms, p95 {summary['p95']:.0f} ms")
+        for model, calls in summary["calls"].most_common():
+            prompt, completion = summary["tokens"][model]
+            print(f"    {model}: {calls} llamadas, {prompt} tokens de entrada, {completion} de salida")
+
+    print("\nDecisiones del enrutado:")
+    for decision, count in sorted(router.decisions.items(), key=lambda item: -item[1]):
+        print(f"    {decision}: {count}")
+    off, auto = summaries["off"], summaries["auto"]
+    if off["cost"]:
+        print(f"\nAhorro estimado: {100 * (1 - auto['cost'] / off['cost']):.1f}% del coste, "
+              f"p50 {off['p50']:.0f} -> {auto['p50']:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
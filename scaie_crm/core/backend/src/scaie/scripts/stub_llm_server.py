@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Servidor OpenAI-compatible mínimo (POST /v1/chat/completions) para pruebas
+locales de llm_service sin llamar a DashScope.
+
+Guarda el cuerpo crudo de cada petición y simula la caché de prefijos del
+proveedor: los tokens del prefijo común más largo con una petición anterior
+(si llega a 256 tokens) se reportan en usage.prompt_tokens_details.cached_tokens.
+
+Para probar errores del proveedor, inject() encola fallos para las próximas
+peticiones y outage fija uno para todas: un código HTTP (p. ej. 503), "hang"
+(tarda hang_ms en responder), "disconnect" (cierra la conexión sin responder)
+o "cut" (error dentro del stream tras el primer chunk).
+
+Al ejecutarlo comprueba que el prefijo estático del system prompt es
+idéntico byte a byte entre llamadas con distintos contactos, niveles de
+interés y mensajes, y muestra los tokens en caché / sin caché.
+
+Uso:
+    python scripts/stub_llm_server.py
+    LLM_PROMPT_CACHE=explicit python scripts/stub_llm_server.py
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+# Añadir el directorio backend al path para poder importar los módulos
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.tokens import estimate_tokens
+
+# DashScope only caches prefixes of at least this many tokens
+MIN_CACHED_TOKENS = 256
+
+
+def _text(content: Any) -> str:
+    """Text of a message content (string or list of text blocks)."""
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content)
+    return content or ""
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class StubLLMServer:
+    """OpenAI-compatible chat completions stub running in a background thread."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, reply: str = "Respuesta de prueba 👋",
+                 latency_ms: float = 0.0, token_interval_ms: float = 0.0, max_concurrent: int = 0):
+        self.reply = reply
+        # Delay before the response (or the first streamed chunk) and between streamed chunks
+        self.latency_ms = latency_ms
+        # Per-model latency_ms (model name -> ms), like a small model answering faster
+        self.model_latency_ms: Dict[str, float] = {}
+        self.token_interval_ms = token_interval_ms
+        # Like the provider's rate limit: 429 for requests beyond this many in flight (0 = no limit)
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.rate_limited = 0
+        # Injected failures: HTTP status, "hang", "disconnect" or "cut" (see inject)
+        self.faults: Deque[Union[int, str]] = deque()
+        self.outage: Optional[Union[int, str]] = None
+        self.hang_ms = 60000.0
+        # chat/completions requests received, failed ones included
+        self.calls = 0
+        # One {"raw": bytes, "json": dict, "cached_tokens": int} per request
+        self.requests: List[Dict[str, Any]] = []
+        self._prompts: List[str] = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+                with server._lock:
+                    server.calls += 1
+                    server.active += 1
+                    limited = 0 < server.max_concurrent < server.active
+                    if limited:
+                        server.rate_limited += 1
+                    fault = server.faults.popleft() if server.faults else server.outage
+                try:
+                    if limited:
+                        self._send(429, {"error": {"message": "Requests rate limit exceeded",
+                                                   "type": "limit_requests", "code": "limit_requests"}})
+                        return
+                    if isinstance(fault, int):
+                        self._send(fault, {"error": {"message": f"Injected failure {fault}", "type": "stub_fault"}})
+                        return
+                    if fault == "disconnect":
+                        self.close_connection = True
+                        return
+                    if fault == "hang":
+                        time.sleep(server.hang_ms / 1000)
+                    status, payload = server.handle(raw)
+                    if isinstance(payload, dict):
+                        if fault == "cut":
+                            self.close_connection = True
+                            return
+                        self._send(status, payload)
+                    else:
+                        self._stream(payload, limit=1 if fault == "cut" else None)
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+            def _stream(self, chunks, limit: Optional[int] = None):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for i, chunk in enumerate(chunks):
+                        if i == limit:
+                            # "cut": the provider reports an error mid-stream
+                            chunk = {"error": {"message": "Injected mid-stream failure", "type": "stub_fault"}}
+                            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                            self.wfile.flush()
+                            return
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading the stream
+                    pass
+
+            def _send(self, status: int, payload: Dict[str, Any]):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up waiting ("hang")
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubLLMServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def inject(self, *faults: Union[int, str]):
+        """Fail the next requests, one fault each: HTTP status, "hang", "disconnect" or "cut"."""
+        with self._lock:
+            self.faults.extend(faults)
+
+    def _cache(self, prompt: str) -> Tuple[int, int]:
+        """(cached tokens, tokens written to the cache) for a serialized prompt."""
+        with self._lock:
+            shared = max((_common_prefix(prompt, previous) for previous in self._prompts), default=0)
+            self._prompts.append(prompt)
+        cached = estimate_tokens(prompt[:shared])
+        if cached >= MIN_CACHED_TOKENS:
+            return cached, 0
+        prefix = estimate_tokens(prompt)
+        return 0, prefix if prefix >= MIN_CACHED_TOKENS else 0
+
+    def handle(self, raw: bytes) -> Tuple[int, Any]:
+        """(status, JSON payload), or (200, iterator of chunks) for stream=True requests."""
+        request = json.loads(raw)
+        messages = request.get("messages", [])
+        prompt = "".join(f"<{m.get('role')}>{_text(m.get('content'))}" for m in messages)
+        cached, created = self._cache(prompt)
+        self.requests.append({"raw": raw, "json": request, "cached_tokens": cached})
+        latency_ms = self.model_latency_ms.get(request.get("model"), self.latency_ms)
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        prompt_tokens = estimate_tokens(prompt)
+        details: Dict[str, Any] = {"cached_tokens": cached}
+        if created:
+            details["cache_creation_input_tokens"] = created
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(self.reply),
+            "total_tokens": prompt_tokens + estimate_tokens(self.reply),
+            "prompt_tokens_details": details
+        }
+        base = {"id": f"chatcmpl-stub-{len(self.requests)}", "created": int(time.time()),
+                "model": request.get("model", "stub")}
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+            return 200, self._chunks(base, usage if include_usage else None)
+        return 200, {
+            **base,
+            "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.reply},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }
+
+    def _chunks(self, base: Dict[str, Any], usage: Optional[Dict[str, Any]]):
+        """Streamed chat.completion.chunk objects, one per word of the reply."""
+        words = self.reply.split(" ")
+        for i, word in enumerate(words):
+            if i and self.token_interval_ms:
+                time.sleep(self.token_interval_ms / 1000)
+            text = word if i == 0 else " " + word
+            yield {**base, "object": "chat.completion.chunk",
+                   "choices": [{"index": 0, "delta": {"role": "assistant", "content": text}, "finish_reason": None}]}
+        yield {**base, "object": "chat.completion.chunk",
+               "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        if usage is not None:
+            yield {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+
+
+async def check_prefix_stability(server: StubLLMServer):
+    from openai import AsyncOpenAI
+    from app.services.llm_service import llm_service, LLM_PROMPT_CACHE
+    from app.models.contact import Contact, InterestLevel
+    from app.core.metrics import metrics
+
+    llm_service.client = AsyncOpenAI(api_key="stub", base_url=server.url)
+    messages = [
+        "Me gustaría saber si el taller sirve para un despacho contable",
+        "¿Pueden darlo en Monterrey la próxima semana?",
+        "Estamos evaluando opciones para el área comercial",
+    ]
+    calls = 0
+    for level in InterestLevel:
+        contact = Contact(name=f"Contacto {level.value}", company="ACME", platform="web", interest_level=level)
+        for message in messages:
+            result = await llm_service.generate_response(message, contact)
+            assert result.get("success"), result
+            calls += 1
+
+    static = llm_service.system_prompt_parts()[0]
+    prefixes = set()
+    for request in server.requests:
+        system = request["json"]["messages"][0]["content"]
+        first = system[0]["text"] if isinstance(system, list) else system
+        assert first.startswith(static), "system prompt does not start with the static prefix"
+        prefixes.add(first[:len(static)].encode("utf-8"))
+    # Provider caches are per model: compare the bodies sent to each model (see LLM_ROUTING)
+    by_model: Dict[str, List[str]] = {}
+    for request in server.requests:
+        by_model.setdefault(request["json"].get("model"), []).append(request["raw"].decode("utf-8"))
+    shared = min((_common_prefix(bodies[0], body) for bodies in by_model.values() for body in bodies[1:]), default=0)
+
+    counters = metrics.snapshot()["counters"]
+    prompt = counters.get("llm.usage.prompt_tokens", 0)
+    cached = counters.get("llm.usage.cached_tokens", 0)
+    print(f"LLM_PROMPT_CACHE={LLM_PROMPT_CACHE} calls={calls}")
+    print(f"static prefix: {len(static.encode('utf-8'))} bytes, ~{estimate_tokens(static)} tokens; "
+          f"distinct prefixes seen by the server: {len(prefixes)}")
+    print(f"identical leading bytes of every request body (per model, {len(by_model)} models): {shared}")
+    print(f"prompt tokens: {prompt} (cached {cached}, uncached {prompt - cached}, "
+          f"{100 * cached / max(prompt, 1):.0f}% cached)")
+    if len(prefixes) != 1:
+        raise SystemExit("static prefix changed between calls")
+
+
+def main():
+    os.environ.setdefault("LLM_USE_RAG", "false")
+    server = StubLLMServer().start()
+    try:
+        asyncio.run(check_prefix_stability(server))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Los módulos del backend se importan como "app." (igual que en scripts/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "scaie"))
+
+# RAGService guarda sus datos bajo el directorio de trabajo: importar llm_service
+# (que crea rag_service) no debe tocar core/backend/data
+os.chdir(tempfile.mkdtemp(prefix="scaie_tests_"))
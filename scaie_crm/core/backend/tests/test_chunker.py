@@ -0,0 +1,27 @@
+import pytest
+
+from app.services.chunker import Chunker, SentenceChunker, WordWindowChunker
+
+
+def test_chunker_is_abstract():
+    with pytest.raises(TypeError):
+        Chunker()
+
+    class NoSplit(Chunker):
+        pass
+
+    with pytest.raises(TypeError):
+        NoSplit()
+
+
+def test_word_window_chunker_overlaps():
+    chunks = WordWindowChunker(chunk_size=4, overlap=1).split("a b c d e f g")
+    assert chunks == ["a b c d", "d e f g", "g"]
+
+
+def test_sentence_chunker_keeps_sentences_whole():
+    text = "Primera frase del documento. Segunda frase, algo más larga que la primera. Tercera."
+    chunks = SentenceChunker(max_tokens=12, overlap_tokens=0).split(text)
+    assert len(chunks) > 1
+    assert all(chunk.endswith(".") for chunk in chunks)
+    assert " ".join(chunks) == text
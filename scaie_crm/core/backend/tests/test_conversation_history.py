@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.database import Base
+from app.models import agent_action, contact  # noqa: F401  (register the related tables)
+from app.models.conversation import Conversation, Message
+from app.services.conversation_history import CONTEXT_KEY, ConversationHistory
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def _conversation(db, messages):
+    conversation = Conversation(contact_id=1, platform="web")
+    db.add(conversation)
+    db.flush()
+    for i, text in enumerate(messages):
+        db.add(Message(conversation_id=conversation.id, contact_id=1,
+                       sender="user" if i % 2 == 0 else "agent", content=text))
+    db.commit()
+    return conversation
+
+
+def _add(db, conversation, text):
+    db.add(Message(conversation_id=conversation.id, contact_id=1, sender="user", content=text))
+    db.commit()
+
+
+def test_every_evicted_message_is_summarized_once(db):
+    history = ConversationHistory(max_messages=4, max_tokens=400, summary_tokens=80, note_tokens=10,
+                                  summary_batch=3, batch=5)
+    conversation = _conversation(db, ["Soy Ana de Acme, somos 40 en ventas", "¡Hola Ana! ¿Qué te gustaría automatizar?"])
+    summarized = []
+    for i in range(40):
+        _add(db, conversation, f"Mensaje número {i}")
+        window = history.build(db, conversation)
+        request = window.summary_request
+        if request is not None:
+            summarized.extend(content for _, content in request.turns)
+            history.apply_summary(conversation, f"Resumen hasta el mensaje {request.through_id}", request.through_id)
+        db.commit()
+        assert window.tokens <= history.max_tokens + history.summary_tokens
+
+    assert summarized[:3] == ["Soy Ana de Acme, somos 40 en ventas", "¡Hola Ana! ¿Qué te gustaría automatizar?",
+                              "Mensaje número 0"]
+    assert summarized == list(dict.fromkeys(summarized))
+    # Everything older than the window and the pending notes went through a summary
+    assert f"Mensaje número {40 - history.max_messages - history.summary_batch}" in summarized
+    window = history.build(db, conversation)
+    assert window.summary.startswith("Resumen hasta el mensaje")
+    assert "…" not in window.summary
+    assert [content for _, content in window.turns][-1] == "Mensaje número 39"
+
+
+def test_failing_summaries_keep_the_history_bounded(db):
+    history = ConversationHistory(max_messages=4, max_tokens=400, summary_tokens=60, note_tokens=10,
+                                  summary_batch=3, batch=5)
+    conversation = _conversation(db, [])
+    for i in range(60):
+        _add(db, conversation, f"Mensaje número {i}")
+        window = history.build(db, conversation)
+        db.commit()
+        assert window.tokens <= history.max_tokens + history.summary_tokens
+
+    pending = conversation.context[CONTEXT_KEY]["pending"]
+    assert len(pending) == history.max_pending
+    assert window.summary.startswith("…") and "Mensaje número 55" in window.summary
+    assert len(window.summary_request.turns) == history.max_pending
+
+
+def test_apply_summary_ignores_an_older_summary(db):
+    history = ConversationHistory(max_messages=2, summary_batch=2, batch=5)
+    conversation = _conversation(db, [f"Mensaje {i}" for i in range(6)])
+    request = history.build(db, conversation).summary_request
+
+    history.apply_summary(conversation, "Resumen nuevo", request.through_id)
+    history.apply_summary(conversation, "Resumen viejo", request.through_id - 1)
+
+    state = conversation.context[CONTEXT_KEY]
+    assert state["summary"] == "Resumen nuevo" and state["pending"] == []
+
+
+def test_build_leaves_the_commit_to_the_caller(db):
+    history = ConversationHistory(max_messages=2, batch=5)
+    conversation = _conversation(db, [f"Mensaje {i}" for i in range(6)])
+
+    history.build(db, conversation)
+    assert db.is_modified(conversation)
+    db.rollback()
+    assert CONTEXT_KEY not in (conversation.context or {})
@@ -0,0 +1,65 @@
+import json
+import os
+
+from app.services.knowledge_store import KnowledgeStore
+
+
+def _store(tmp_path):
+    return KnowledgeStore(str(tmp_path), compact_every=1000, fsync=False)
+
+
+def test_reload_replays_log(tmp_path):
+    store = _store(tmp_path)
+    store.put({"id": "a", "title": "A"})
+    store.put_many([{"id": "b", "title": "B"}, {"id": "c", "title": "C"}])
+    store.delete("b")
+
+    assert set(_store(tmp_path).load()) == {"a", "c"}
+
+
+def test_compaction_keeps_log_left_by_failed_compaction(tmp_path):
+    store = _store(tmp_path)
+    store.put({"id": "a", "title": "A"})
+    # A compaction that failed after rotating the log leaves knowledge_base.wal.jsonl.old
+    wal_file = os.path.join(str(tmp_path), KnowledgeStore.WAL_FILE)
+    os.replace(wal_file, wal_file + ".old")
+    store.put({"id": "b", "title": "B"})
+
+    # Simulate the next compaction failing while writing the snapshot
+    store.SNAPSHOT_FILE = os.path.join("missing", "knowledge_base.json")
+    store.compact()
+    assert not os.path.exists(wal_file)
+    assert set(_store(tmp_path).load()) == {"a", "b"}
+
+
+def test_compaction_serializes_a_copy(tmp_path, monkeypatch):
+    store = _store(tmp_path)
+    store.put_many([{"id": str(i)} for i in range(3)])
+    dumps = json.dumps
+    writes = []
+
+    def dumps_while_writing(obj, **kwargs):
+        # A writer mutating the store while the snapshot is serialized
+        if not writes:
+            writes.append(obj)
+            store.put({"id": "late"})
+        return dumps(obj, **kwargs)
+
+    monkeypatch.setattr("app.services.knowledge_store.json.dumps", dumps_while_writing)
+    store.compact()
+    monkeypatch.undo()
+
+    with open(os.path.join(str(tmp_path), KnowledgeStore.SNAPSHOT_FILE), encoding="utf-8") as f:
+        assert set(json.load(f)) == {"0", "1", "2"}
+    # The late write is still in the log
+    assert set(_store(tmp_path).load()) == {"0", "1", "2", "late"}
+
+
+def test_torn_record_is_skipped(tmp_path):
+    store = _store(tmp_path)
+    store.put({"id": "a"})
+    with open(os.path.join(str(tmp_path), KnowledgeStore.WAL_FILE), "a", encoding="utf-8") as f:
+        f.write('{"op": "put", "id": "b", "ent\n')
+        f.write(json.dumps({"op": "put", "id": "c", "entry": {"id": "c"}}) + "\n")
+
+    assert set(_store(tmp_path).load()) == {"a", "c"}
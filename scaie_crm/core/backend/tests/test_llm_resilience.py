@@ -0,0 +1,203 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APIConnectionError, BadRequestError, InternalServerError, RateLimitError
+
+from app.services import llm_resilience
+from app.services import llm_service as llm_module
+from app.services.llm_resilience import CircuitBreaker, CircuitOpen, LLMTimeout, RetryPolicy
+
+REQUEST = httpx.Request("POST", "https://llm.test/v1/chat/completions")
+
+
+def status_error(cls, status, headers=None):
+    return cls(f"HTTP {status}", response=httpx.Response(status, request=REQUEST, headers=headers), body=None)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += ms / 1000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_resilience.time, "monotonic", clock.monotonic)
+    return clock
+
+
+async def _run(breaker, error=None):
+    """One attempt through the breaker that fails with error (or succeeds)."""
+    async with breaker.call():
+        if error is not None:
+            raise error
+
+
+def run(breaker, error=None):
+    try:
+        asyncio.run(_run(breaker, error))
+    except Exception as e:
+        if e is not error:
+            raise
+
+
+def test_closed_to_open_after_consecutive_upstream_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout_ms=1000)
+    run(breaker, status_error(InternalServerError, 500))
+    run(breaker, LLMTimeout("slow"))
+    # A success resets the count
+    run(breaker)
+    for _ in range(2):
+        run(breaker, status_error(InternalServerError, 503))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    run(breaker, APIConnectionError(request=REQUEST))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    with pytest.raises(CircuitOpen):
+        breaker.call()
+
+
+def test_client_errors_do_not_open_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=2)
+    for _ in range(5):
+        run(breaker, status_error(BadRequestError, 400))
+        run(breaker, status_error(RateLimitError, 429))
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+
+
+def _opened(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_ms=1000)
+    run(breaker, status_error(InternalServerError, 500))
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_open_to_half_open_admits_a_single_probe(clock):
+    breaker = _opened(clock)
+    clock.advance(999)
+    with pytest.raises(CircuitOpen):
+        breaker.call()
+
+    clock.advance(1)
+    breaker.check()
+    probe = breaker.call()
+    assert probe.probe and breaker.state == CircuitBreaker.HALF_OPEN
+    # Everyone else is rejected while the probe is in flight
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    with pytest.raises(CircuitOpen):
+        breaker.call()
+
+
+def test_half_open_to_closed_when_the_probe_succeeds(clock):
+    breaker = _opened(clock)
+    clock.advance(1000)
+    run(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+    breaker.call()
+
+
+def test_half_open_to_open_when_the_probe_fails(clock):
+    breaker = _opened(clock)
+    clock.advance(1000)
+    run(breaker, LLMTimeout("slow"))
+    assert breaker.state == CircuitBreaker.OPEN
+    # The reset timeout starts again from the failed probe
+    clock.advance(999)
+    with pytest.raises(CircuitOpen):
+        breaker.call()
+    clock.advance(1)
+    assert breaker.call().probe
+
+
+def test_half_open_probe_with_client_error_frees_the_slot(clock):
+    breaker = _opened(clock)
+    clock.advance(1000)
+    run(breaker, status_error(BadRequestError, 400))
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.call().probe
+
+
+@pytest.mark.parametrize("error,retry", [
+    (status_error(BadRequestError, 400), False),
+    (status_error(BadRequestError, 422), False),
+    (status_error(RateLimitError, 429), True),
+    (status_error(InternalServerError, 503), True),
+    (LLMTimeout("slow"), True),
+    (APIConnectionError(request=REQUEST), True),
+])
+def test_should_retry(error, retry):
+    policy = RetryPolicy(max_retries=2)
+    assert policy.should_retry(error, 1) is retry
+    assert not policy.should_retry(error, 3)
+
+
+def test_delay_is_jittered_and_capped(monkeypatch):
+    policy = RetryPolicy(base_delay_ms=250, max_delay_ms=1000)
+    monkeypatch.setattr(llm_resilience.random, "uniform", lambda low, high: high)
+    assert [policy.delay(attempt) for attempt in (1, 2, 3, 4)] == [0.25, 0.5, 1.0, 1.0]
+    monkeypatch.setattr(llm_resilience.random, "uniform", lambda low, high: low)
+    assert policy.delay(1) == 0
+    # Retry-After raises the delay, up to max_delay_ms
+    assert policy.delay(1, status_error(RateLimitError, 429, {"retry-after": "0.5"})) == 0.5
+    assert policy.delay(1, status_error(RateLimitError, 429, {"retry-after": "30"})) == 1.0
+
+
+class FakeCompletions:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))])
+
+
+def _complete(monkeypatch, errors):
+    """Drive LLMService._complete against a fake client; returns (result or error, calls, sleeps)."""
+    service = llm_module.llm_service
+    completions = FakeCompletions(errors)
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(service, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(service, "retry_policy", RetryPolicy(max_retries=2, base_delay_ms=100, max_delay_ms=100))
+    monkeypatch.setattr(service, "circuit_breaker", CircuitBreaker(failure_threshold=10))
+    monkeypatch.setattr(llm_module.asyncio, "sleep", fake_sleep)
+    try:
+        result = asyncio.run(service._complete({"model": "m"}, {}))
+    except Exception as e:
+        result = e
+    return result, completions.calls, sleeps
+
+
+def test_complete_does_not_retry_client_errors(monkeypatch):
+    result, calls, sleeps = _complete(monkeypatch, [status_error(BadRequestError, 400)])
+    assert isinstance(result, BadRequestError)
+    assert calls == 1 and sleeps == []
+
+
+def test_complete_retries_upstream_errors_with_backoff(monkeypatch):
+    result, calls, sleeps = _complete(monkeypatch, [status_error(InternalServerError, 503), LLMTimeout("slow")])
+    assert result.choices[0].message.content == "ok"
+    assert calls == 3 and len(sleeps) == 2 and all(0 <= s <= 0.1 for s in sleeps)
+
+
+def test_complete_gives_up_after_max_retries(monkeypatch):
+    result, calls, _ = _complete(monkeypatch, [status_error(InternalServerError, 500)] * 5)
+    assert isinstance(result, InternalServerError)
+    assert calls == 3
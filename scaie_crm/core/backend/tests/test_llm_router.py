@@ -0,0 +1,26 @@
+import pytest
+
+from app.models.contact import InterestLevel
+from app.services.llm_router import ModelRouter
+from app.services.message_classifier import message_classifier
+
+
+@pytest.fixture
+def router():
+    return ModelRouter(light_model="light", strong_model="strong")
+
+
+def _route(router, message):
+    return router.route(message, message_classifier.classify(message), InterestLevel.NEW.value)
+
+
+@pytest.mark.parametrize("message", ["no sé", "no entiendo qué es un prompt", "hola, no vi su sitio web"])
+def test_neutral_message_with_no_stays_on_the_light_model(router, message):
+    assert message_classifier.classify(message).has("negativo")
+    assert _route(router, message).tier == "light"
+
+
+@pytest.mark.parametrize("message", ["no gracias", "la verdad no me interesa", "lo vemos en otro momento"])
+def test_refusal_goes_to_the_strong_model(router, message):
+    route = _route(router, message)
+    assert (route.tier, route.reason) == ("strong", "signal:rechazo")
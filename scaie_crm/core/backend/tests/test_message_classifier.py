@@ -0,0 +1,52 @@
+import pytest
+
+from app.services.keyword_matcher import KeywordMatcher, stem, tokenize
+from app.services.message_classifier import message_classifier
+
+# Real messages and the signals they must (and must not) produce
+REGRESSIONS = [
+    ("¿Cuáles son sus precios?", {"interes_fuerte", "objecion:precio"}, set()),
+    ("¿Hacen llamadas?", {"agendar", "interes_fuerte"}, set()),
+    ("me interesan sus cotizaciones", {"contacto", "interes_fuerte"}, set()),
+    ("tengo dudas sobre las sesiones", {"agendar"}, set()),
+    ("¿Qué herramienta me recomiendas?", {"herramientas"}, set()),
+    ("Holaa", {"saludo"}, set()),
+    ("Buenos días", {"saludo"}, set()),
+    ("Hola, soy gerente de ventas", {"saludo", "rol:ventas"}, set()),
+    ("quiero agendar una llamada", {"agendar", "interes_fuerte"}, set()),
+    ("¿Cuánto cuesta?", {"interes_fuerte", "objecion:precio"}, set()),
+    ("dame tu número de whatsapp", {"pide_telefono"}, set()),
+    ("¿Funciona con PDFs?", {"tendencias"}, set()),
+    ("Me gustan los modelos de Gemini", {"modelos"}, set()),
+    ("¿Qué incluye el taller y cuánto tiempo dura?", {"interes_medio"}, set()),
+    ("Queremos automatizar procesos del equipo", {"interes_medio"}, set()),
+    ("Buenas tardes, me gustaría saber más sobre el workshop", {"saludo", "interes_fuerte"}, set()),
+    ("¿Me podrías explicar cómo funcionaría esto para nosotros?", {"interes_medio"}, {"negativo"}),
+    ("No gracias, por ahora no", {"negativo"}, {"interes_fuerte"}),
+    ("Me parece muy caro", {"negativo"}, set()),
+    ("no tengo tiempo", {"negativo", "objecion:no_tengo_tiempo"}, set()),
+    # Short keywords only match whole words
+    ("Nosotros ya lo hicimos", set(), {"negativo", "saludo"}),
+    ("Trabajo con Carolina en finanzas", set(), {"negativo"}),
+]
+
+
+@pytest.mark.parametrize("message,expected,forbidden", REGRESSIONS)
+def test_message_signals(message, expected, forbidden):
+    classes = message_classifier.classify(message).classes
+    assert expected <= classes
+    assert not forbidden & classes
+
+
+def test_stem_folds_plurals_accents_and_repeats():
+    assert stem("precios") == stem("precio")
+    assert stem("sesiones") == stem("sesión")
+    assert stem("interesadas") == stem("interesado")
+    assert stem("holaaa") == stem("hola")
+    assert stem("nos") != stem("no")
+    assert stem("2000") == "2000"
+
+
+def test_matcher_keeps_priority_order():
+    matcher = KeywordMatcher([("b", ["precio"]), ("a", ["hola"])])
+    assert matcher.match(tokenize("hola, ¿precios?")) == ["b", "a"]
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import time
+
+import numpy as np
+import pytest
+
+
+class FakeModel:
+    """Deterministic hash embeddings instead of the sentence-transformers model."""
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        if isinstance(texts, str):
+            return self._embed(texts)
+        return np.array([self._embed(text) for text in texts])
+
+    def _embed(self, text):
+        seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).standard_normal(16).astype(np.float32)
+
+
+class SlowQueryModel(FakeModel):
+    """Query embeddings take ENCODE_SECONDS of blocking work, like the real model on CPU."""
+
+    ENCODE_SECONDS = 0.05
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        if isinstance(texts, str):
+            time.sleep(self.ENCODE_SECONDS)
+        return super().encode(texts, batch_size=batch_size, convert_to_numpy=convert_to_numpy)
+
+
+class SlowDocumentModel(FakeModel):
+    """Document batches take ENCODE_SECONDS of blocking work each."""
+
+    ENCODE_SECONDS = 0.05
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        if not isinstance(texts, str):
+            time.sleep(self.ENCODE_SECONDS)
+        return super().encode(texts, batch_size=batch_size, convert_to_numpy=convert_to_numpy)
+
+
+async def _max_loop_lag(searches, interval=0.005):
+    """Run the searches concurrently; returns the worst extra delay (seconds) of a ticker coroutine."""
+    stop = asyncio.Event()
+
+    async def ticker():
+        worst = 0.0
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            worst = max(worst, time.perf_counter() - start - interval)
+        return worst
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    await asyncio.gather(*searches)
+    stop.set()
+    return await task
+
+
+@pytest.fixture
+def rag(tmp_path, monkeypatch):
+    # RAGService keeps its data under the working directory
+    monkeypatch.chdir(tmp_path)
+    from app.services.rag_service import RAGService
+
+    service = RAGService()
+    service._model = FakeModel()
+    service._model_loaded = True
+    yield service
+    service._executor.shutdown(wait=False)
+
+
+def test_add_knowledge_returns_stats_of_the_call(rag):
+    _, first = rag.add_knowledge("Precios", "El taller cuesta 2500 por persona. Incluye materiales.")
+    _, cached = rag.add_knowledge("Precios", "El taller cuesta 2500 por persona. Incluye materiales.")
+
+    assert first["encoded"] == first["chunks"] > 0
+    # Same content again: nothing to encode, whatever the last ingestion was
+    assert cached["encoded"] == 0
+
+
+def test_add_knowledge_batch_returns_ids_and_stats(rag):
+    documents = [{"title": f"Doc {i}", "content": f"Contenido del documento {i}."} for i in range(3)]
+    knowledge_ids, stats = rag.add_knowledge_batch(documents)
+
+    assert len(knowledge_ids) == 3 and all(i in rag.knowledge_base for i in knowledge_ids)
+    assert stats["encoded"] == 3
+
+
+def test_asearch_knowledge_keeps_event_loop_responsive(rag):
+    rag.add_knowledge_batch([
+        {"title": f"Doc {i}", "content": f"El workshop {i} cubre automatización y precios."} for i in range(20)
+    ])
+    rag.search_knowledge("warmup")
+    rag._model = SlowQueryModel()
+
+    async def blocking(query):
+        return rag.search_knowledge(query, top_k=3)
+
+    # Sanity check: searching on the loop blocks it for a whole encode
+    lag = asyncio.run(_max_loop_lag([blocking(f"consulta bloqueante {i}") for i in range(4)]))
+    assert lag >= SlowQueryModel.ENCODE_SECONDS
+
+    lag = asyncio.run(_max_loop_lag([rag.asearch_knowledge(f"consulta {i}", top_k=3) for i in range(16)]))
+    assert lag < SlowQueryModel.ENCODE_SECONDS / 2
+
+
+
+def test_ainitialize_default_knowledge_keeps_event_loop_responsive(rag):
+    rag._model = SlowDocumentModel()
+
+    lag = asyncio.run(_max_loop_lag([rag.ainitialize_default_knowledge()]))
+
+    assert len(rag.knowledge_base) > 0
+    assert lag < SlowDocumentModel.ENCODE_SECONDS / 2
+
+def test_ivf_retrain_during_writes_keeps_rescoring_rows(rag, monkeypatch):
+    import os
+    from app.services import rag_service, vector_index
+
+    monkeypatch.setattr(rag_service, "RAG_INDEX_BACKEND", "ivf")
+    monkeypatch.setenv("RAG_QUANTIZATION", "int8")
+    monkeypatch.setenv("RAG_IVF_MIN_ROWS", "8")
+    monkeypatch.setenv("RAG_IVF_NLIST", "4")
+    replace = os.replace
+
+    def slow_replace(src, dst):
+        # Widen the window between writing a rescoring file and publishing it
+        if "index_rescore" in str(dst):
+            time.sleep(0.02)
+        replace(src, dst)
+
+    def assert_rescoring_matches(index):
+        assert index.full is not None
+        vectors = np.array([rag.embeddings_cache.get(chunk_id) for _, chunk_id in index.row_ids])
+        np.testing.assert_allclose(index.full, vector_index.normalize_rows(vectors), rtol=1e-6)
+
+    monkeypatch.setattr(vector_index.os, "replace", slow_replace)
+    rag._warm = True
+    rag.index = rag._new_index()
+
+    # Every write rebuilds the index while background retrains build their own
+    for i in range(40):
+        rag.add_knowledge(f"Doc {i}", f"El workshop {i} cubre automatización y precios.")
+        rag.search_knowledge(f"consulta {i}", top_k=3)
+        assert_rescoring_matches(rag.index)
+    deadline = time.monotonic() + 10
+    while rag._retraining and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not rag._retraining
+
+    assert_rescoring_matches(rag.index)
+    # Superseded rescoring files are deleted
+    rescore_files = [name for name in os.listdir(rag.embeddings_path) if name.startswith("index_rescore")]
+    assert rescore_files == [os.path.basename(rag.index.rescore_path)]
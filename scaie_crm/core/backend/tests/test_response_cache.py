@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import numpy as np
+
+from app.services import llm_service as llm_module
+from app.services import response_cache as response_cache_module
+from app.services.response_cache import ResponseCache
+
+
+def test_exact_then_semantic_lookup():
+    cache = ResponseCache(threshold=0.9)
+    cache.set("nuevo", "¿Cuánto cuesta?", "Desde 2500.", vector=np.array([1.0, 0.0], dtype=np.float32))
+
+    assert cache.get_exact("nuevo", "cuánto cuesta") == "Desde 2500."
+    assert cache.get_similar("nuevo", np.array([0.99, 0.05]))[0] == "Desde 2500."
+    assert cache.get_similar("nuevo", np.array([0.0, 1.0])) is None
+    assert cache.get_similar("interesado", np.array([1.0, 0.0])) is None
+
+
+def test_without_numpy_only_exact_lookups(monkeypatch):
+    monkeypatch.setattr(response_cache_module, "np", None)
+    cache = ResponseCache()
+    cache.set("nuevo", "hola", "¡Hola!", vector=[1.0, 0.0])
+
+    assert not cache.semantic
+    assert cache.get_exact("nuevo", "Hola") == "¡Hola!"
+    assert cache.get_similar("nuevo", [1.0, 0.0]) is None
+
+
+class SlowRAG:
+    is_ready = True
+    # Part of the response cache generation
+    version = 0
+
+    async def aembed_query(self, message):
+        await asyncio.sleep(1)
+        return np.ones(4, dtype=np.float32)
+
+
+def _cached_reply(monkeypatch, rag):
+    monkeypatch.setattr(llm_module, "LLM_RESPONSE_CACHE", True)
+    monkeypatch.setattr(llm_module, "RAG_AVAILABLE", True)
+    monkeypatch.setattr(llm_module, "LLM_RESPONSE_CACHE_EMBED_MS", 50)
+    monkeypatch.setattr(llm_module, "rag_service", rag, raising=False)
+    service = llm_module.llm_service
+    monkeypatch.setattr(service, "response_cache", ResponseCache())
+    timings = {}
+
+    async def lookup():
+        start = time.perf_counter()
+        result = await service._cached_reply("¿tienen sesiones online?", "nuevo", timings)
+        return result, time.perf_counter() - start
+
+    return asyncio.run(lookup()), timings
+
+
+def test_cache_lookup_does_not_wait_for_a_slow_embedding(monkeypatch):
+    ((reply, vector), elapsed), timings = _cached_reply(monkeypatch, SlowRAG())
+
+    assert reply is None and vector is None
+    assert elapsed < 0.5
+    assert timings["response_cache"] == "miss"
+
+
+def test_cache_lookup_skips_embedding_while_rag_warms_up(monkeypatch):
+    rag = SlowRAG()
+    rag.is_ready = False
+    ((reply, vector), elapsed), _ = _cached_reply(monkeypatch, rag)
+
+    assert reply is None and vector is None
+    assert elapsed < 0.05
@@ -0,0 +1,66 @@
+import numpy as np
+
+from app.services.vector_index import BruteForceIndex, IVFIndex, normalize_rows
+
+
+def _vectors(n, dim=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def _trained(n=400):
+    index = IVFIndex(nlist=8, nprobe=8, min_rows=100, retrain_fraction=0.2)
+    index.build([f"r{i}" for i in range(n)], _vectors(n))
+    return index
+
+
+def test_extend_from_keeps_clusters_of_existing_rows():
+    previous = _trained()
+    row_ids = previous.row_ids + ["new0", "new1"]
+    vectors = np.vstack([_vectors(400), _vectors(2, seed=1)])
+
+    index = IVFIndex(nlist=8, nprobe=8, min_rows=100, retrain_fraction=0.2)
+    assert index.extend_from(previous, row_ids, vectors)
+
+    assert index.centroids is previous.centroids
+    for old, new in zip(previous.lists, index.lists):
+        assert set(old.tolist()) <= set(new.tolist())
+    assert sum(len(members) for members in index.lists) == len(row_ids)
+    assert index.changed_rows == 2
+    assert not index.needs_retrain
+    # The new rows are searchable right away
+    assert index.row_ids[index.search(vectors[-1], top_k=1)[0][0]] == "new1"
+
+
+def test_needs_retrain_after_drift():
+    previous = _trained()
+    # Drop a quarter of the rows (> retrain_fraction of the trained rows)
+    index = IVFIndex(nlist=8, nprobe=8, min_rows=100, retrain_fraction=0.2)
+    assert index.extend_from(previous, previous.row_ids[100:], _vectors(400)[100:])
+    assert index.changed_rows == 100
+    assert index.needs_retrain
+
+
+def test_extend_from_untrained_previous_is_refused():
+    previous = IVFIndex(nlist=8, min_rows=1000)
+    previous.build([f"r{i}" for i in range(10)], _vectors(10))
+    index = IVFIndex(nlist=8, min_rows=1000)
+    assert not index.extend_from(previous, previous.row_ids, _vectors(10))
+
+
+def test_int8_scores_match_dequantized_rows():
+    index = BruteForceIndex(quantization="int8")
+    vectors = _vectors(2500)
+    index.build([("general", str(i)) for i in range(2500)], vectors)
+    query = normalize_rows(_vectors(1, seed=2))[0]
+
+    rows = np.arange(3, 2500, 2)
+    np.testing.assert_allclose(index._score(query, rows), index.dequantize(rows) @ query, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(
+        index._score(query, slice(10, 2100)), index.dequantize(slice(10, 2100)) @ query, rtol=1e-5, atol=1e-6
+    )
+
+
+def test_float16_falls_back_to_int8():
+    index = BruteForceIndex(quantization="float16")
+    index.build([("general", "a")], _vectors(1))
+    assert index.quantization == "int8" and index.matrix.dtype == np.int8